@@ -0,0 +1,136 @@
+"""
+Benchmark decrypt_blob: local temp files vs streaming.
+
+Uploads a generated file with encrypt_upload_file, then decrypts it once per
+mode, reporting wall time and the peak size of the local temp directory.
+
+Example:
+    python benchmarks/bench_decrypt_blob.py -c resources/config/upload_config_file_example.yaml \
+        -b my-bucket -k test_key -r test_key_ring -l europe-west2 --size_mb 512
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from gcpip.config.config_reader import UploadConfig
+from gcpip.upload.gcp_upload import encrypt_upload_file, decrypt_blob
+from gcpip.utils.clients import get_kms_client, get_storage_client
+from gcpip.utils.storage import delete_blob
+
+
+def get_args(args):
+
+    parser = argparse.ArgumentParser(
+        description='Compare disk based and streaming decrypt_blob')
+    parser.add_argument('-c', '--config_file', type=str, required=True)
+    parser.add_argument('-b', '--bucket', type=str, required=True)
+    parser.add_argument('-k', '--key', type=str, required=True)
+    parser.add_argument('-r', '--keyring', type=str, required=True)
+    parser.add_argument('-l', '--location', type=str, required=True)
+    parser.add_argument('--size_mb', type=int, default=256)
+    parser.add_argument('--prefix', type=str, default='benchmarks/decrypt')
+    return parser.parse_args(args)
+
+
+def directory_size(path):
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskSampler():
+    """
+    Samples the size of a directory in a background thread and keeps the peak
+    """
+
+    def __init__(self, path, interval=0.05):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def write_random_file(path, size_mb):
+
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def run_mode(storage_client, kms_client, config, args, source, streaming):
+
+    destination = '{}/{}'.format(
+        args.prefix, 'streaming' if streaming else 'disk')
+    encrypt_upload_file(
+        storage_client, kms_client, args.bucket, source, destination,
+        config.project_name, args.location, args.keyring, args.key,
+        streaming=True)
+
+    temp_data = tempfile.mkdtemp(prefix='gcpip-bench-')
+    try:
+        with DiskSampler(temp_data) as sampler:
+            start = time.perf_counter()
+            decrypt_blob(
+                storage_client, kms_client, args.bucket,
+                destination + '.encrypted', config.project_name,
+                args.location, args.keyring, args.key, temp_data=temp_data,
+                streaming=streaming)
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(temp_data, ignore_errors=True)
+        delete_blob(storage_client, args.bucket, destination)
+
+    return elapsed, sampler.peak
+
+
+def main(args):
+
+    args = get_args(args)
+    config = UploadConfig(args.config_file)
+    storage_client = get_storage_client(key_file=config.get_key_file())
+    kms_client = get_kms_client(key_file=config.get_key_file())
+
+    work_dir = tempfile.mkdtemp(prefix='gcpip-bench-src-')
+    source = os.path.join(work_dir, 'payload.bin')
+    write_random_file(source, args.size_mb)
+
+    try:
+        print('{:<10} {:>10} {:>10} {:>14}'.format(
+            'mode', 'size MB', 'seconds', 'peak disk MB'))
+        for streaming in (False, True):
+            elapsed, peak = run_mode(
+                storage_client, kms_client, config, args, source, streaming)
+            print('{:<10} {:>10} {:>10.2f} {:>14.1f}'.format(
+                'streaming' if streaming else 'disk', args.size_mb, elapsed,
+                peak / 1024 / 1024))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
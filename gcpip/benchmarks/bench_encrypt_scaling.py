@@ -0,0 +1,77 @@
+"""
+Benchmark multi-core encryption of a single large file.
+
+Encrypts a generated file with the chunked format for 1/2/4/8 workers (or the
+counts given) and reports throughput and speedup over one worker. Runs
+offline: no GCP access is needed.
+
+Example:
+    python benchmarks/bench_encrypt_scaling.py --size_mb 2048 --executor process
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from gcpip.upload.encryption import (
+    generate_key, encrypt_stream, DEFAULT_CHUNK_SIZE, ENCRYPTION_EXECUTORS)
+
+
+def get_args(args):
+
+    parser = argparse.ArgumentParser(
+        description='Measure encryption throughput against worker count')
+    parser.add_argument('--size_mb', type=int, default=1024)
+    parser.add_argument('--workers', type=int, nargs='*',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--executor', type=str, default='thread',
+                        choices=sorted(ENCRYPTION_EXECUTORS))
+    parser.add_argument('--chunk_size_kb', type=int,
+                        default=DEFAULT_CHUNK_SIZE // 1024)
+    return parser.parse_args(args)
+
+
+def write_random_file(path, size_mb):
+
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def time_encryption(source, key, chunk_size, workers, executor):
+
+    with open(source, 'rb') as f_in, open(os.devnull, 'wb') as f_out:
+        start = time.perf_counter()
+        encrypt_stream(f_in, f_out, key, chunk_size, workers=workers,
+                       executor=executor)
+        return time.perf_counter() - start
+
+
+def main(args):
+
+    args = get_args(args)
+    work_dir = tempfile.mkdtemp(prefix='gcpip-bench-')
+    source = os.path.join(work_dir, 'payload.bin')
+    write_random_file(source, args.size_mb)
+    key = generate_key()
+
+    try:
+        print('cpu count: {}, executor: {}, file: {} MB'.format(
+            os.cpu_count(), args.executor, args.size_mb))
+        print('{:>8} {:>10} {:>10} {:>8}'.format(
+            'workers', 'seconds', 'MB/s', 'speedup'))
+        baseline = None
+        for workers in args.workers:
+            elapsed = time_encryption(source, key, args.chunk_size_kb * 1024,
+                                      workers, args.executor)
+            baseline = baseline or elapsed
+            print('{:>8} {:>10.2f} {:>10.1f} {:>8.2f}'.format(
+                workers, elapsed, args.size_mb / elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,251 @@
+"""
+Benchmark gcpip.upload.encryption end to end, offline.
+
+For each generated file size, runs the envelope encryption used by
+encrypt_upload_file and decrypt_blob against a local fake KMS: wrap a fresh
+DEK, encrypt the file, unwrap the DEK and decrypt the file. Compares the
+whole-file Fernet path with the chunked AES-GCM format across chunk sizes,
+worker counts and compression settings, and reports encrypt and decrypt
+MB/s, peak RSS, peak temp disk use and the encrypted/plain size ratio.
+
+Every case runs in a fresh process so peak RSS is measured per case. The
+Fernet path holds the whole file in memory and is limited to --fernet_max_mb.
+
+Example:
+    python benchmarks/bench_encryption.py --sizes_mb 1 64 1024 4096 \
+        --workers 1 2 4 --compression none gzip zstd
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from gcpip.testing.kms import FakeKmsClient
+from gcpip.upload.encryption import (
+    generate_key, encrypt_file, decrypt_file, encrypt_dek, decrypt_dek,
+    DEFAULT_CHUNK_SIZE)
+from gcpip.utils.compression import COMPRESSIONS, zstandard
+from gcpip.utils.encryption import ensure_kms_key
+
+PROJECT = 'bench-project'
+LOCATION = 'europe-west2'
+KEY_RING = 'bench-ring'
+KEY = 'bench-key'
+
+
+def get_args(args):
+
+    parser = argparse.ArgumentParser(
+        description='Measure encryption throughput, memory and disk use')
+    parser.add_argument('--sizes_mb', type=int, nargs='*',
+                        default=[1, 64, 1024])
+    parser.add_argument('--chunk_sizes_kb', type=int, nargs='*',
+                        default=[64, 256, 1024, 4096])
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4])
+    parser.add_argument('--compression', type=str, nargs='*',
+                        default=['none', 'gzip', 'zstd'],
+                        choices=('none',) + COMPRESSIONS)
+    parser.add_argument('--fernet_max_mb', type=int, default=1024)
+    parser.add_argument('--data', type=str, default='csv',
+                        choices=('csv', 'random'),
+                        help='Compressible CSV rows or random bytes')
+    parser.add_argument('--work_dir', type=str, default=None)
+    return parser.parse_args(args)
+
+
+def generate_block(kind, size, seed):
+
+    if kind == 'random':
+        return os.urandom(size)
+
+    rng = random.Random(seed)
+    rows = []
+    length = 0
+    while length < size:
+        row = '2020-{:02d}-{:02d},{},{:.4f},{}\n'.format(
+            rng.randint(1, 12), rng.randint(1, 28),
+            rng.choice(('AAPL', 'GOOG', 'MSFT', 'AMZN', 'BARC', 'VOD')),
+            rng.uniform(10, 500), rng.randint(100, 100000))
+        rows.append(row)
+        length += len(row)
+    return ''.join(rows).encode('ascii')[:size]
+
+
+def write_source(path, size_mb, kind):
+
+    # A pool of distinct blocks in random order, so compressors cannot
+    # simply match a repeated block
+    blocks = [generate_block(kind, 1024 * 1024, seed) for seed in range(16)]
+    rng = random.Random(0)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(rng.choice(blocks))
+
+
+def get_cases(args, size_mb):
+
+    cases = []
+    if size_mb <= args.fernet_max_mb:
+        cases.append({'mode': 'fernet', 'chunk_kb': None, 'workers': 1,
+                      'compression': None})
+    for chunk_kb in args.chunk_sizes_kb:
+        cases.append({'mode': 'aes-gcm', 'chunk_kb': chunk_kb,
+                      'workers': 1, 'compression': None})
+    default_chunk_kb = DEFAULT_CHUNK_SIZE // 1024
+    for workers in args.workers:
+        if workers != 1:
+            cases.append({'mode': 'aes-gcm', 'chunk_kb': default_chunk_kb,
+                          'workers': workers, 'compression': None})
+    for compression in args.compression:
+        if compression != 'none':
+            cases.append({'mode': 'aes-gcm', 'chunk_kb': default_chunk_kb,
+                          'workers': 1, 'compression': compression})
+    return cases
+
+
+def directory_size(path):
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                # lstat: the linked source file is not temp disk use
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class DiskSampler():
+    """
+    Samples the size of a directory in a background thread and keeps the peak
+    """
+
+    def __init__(self, path, interval=0.05):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def run_case(case, source, case_dir, results):
+    """
+    Runs one case in a child process and sends back timings and peak RSS
+    """
+
+    kms_client = FakeKmsClient()
+    ensure_kms_key(kms_client, PROJECT, LOCATION, KEY_RING, KEY)
+
+    # encrypt_file writes next to its input and decrypt_file restores the
+    # input name, so work on a link to the shared source
+    payload = os.path.join(case_dir, 'payload')
+    os.symlink(source, payload)
+
+    chunk_size = (case['chunk_kb'] or 0) * 1024 or DEFAULT_CHUNK_SIZE
+    start = time.perf_counter()
+    dek = generate_key()
+    wrapped = encrypt_dek(kms_client, dek, PROJECT, LOCATION, KEY_RING, KEY)
+    encrypted = encrypt_file(
+        payload, dek, chunk_size=chunk_size,
+        legacy=case['mode'] == 'fernet', workers=case['workers'],
+        compression=case['compression'])
+    encrypt_seconds = time.perf_counter() - start
+    encrypted_size = os.path.getsize(encrypted)
+
+    os.remove(payload)
+    start = time.perf_counter()
+    dek = decrypt_dek(kms_client, wrapped, PROJECT, LOCATION, KEY_RING, KEY,
+                      cache=None)
+    decrypted = decrypt_file(encrypted, dek, compression=case['compression'])
+    decrypt_seconds = time.perf_counter() - start
+
+    if os.path.getsize(decrypted) != os.path.getsize(source):
+        raise RuntimeError('Decrypted size does not match the source')
+
+    results.put({
+        'encrypt_seconds': encrypt_seconds,
+        'decrypt_seconds': decrypt_seconds,
+        'encrypted_size': encrypted_size,
+        # ru_maxrss is in KB on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+
+
+def measure(context, case, source, work_dir):
+
+    case_dir = tempfile.mkdtemp(prefix='case-', dir=work_dir)
+    results = context.Queue()
+    process = context.Process(target=run_case,
+                              args=(case, source, case_dir, results))
+    try:
+        with DiskSampler(case_dir) as sampler:
+            process.start()
+            process.join()
+        if process.exitcode != 0:
+            raise RuntimeError('Case {} failed'.format(case))
+        result = results.get()
+    finally:
+        shutil.rmtree(case_dir, ignore_errors=True)
+
+    result['peak_disk'] = sampler.peak
+    return result
+
+
+def main(args):
+
+    args = get_args(args)
+    if 'zstd' in args.compression and zstandard is None:
+        print('zstandard is not installed, skipping zstd cases')
+        args.compression.remove('zstd')
+
+    work_dir = tempfile.mkdtemp(prefix='gcpip-bench-', dir=args.work_dir)
+    context = multiprocessing.get_context('spawn')
+
+    row = '{:>8} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>9} {:>10} {:>6}'
+    print('cpu count: {}, data: {}'.format(os.cpu_count(), args.data))
+    print(row.format('size MB', 'mode', 'chunk KB', 'workers', 'compress',
+                     'enc MB/s', 'dec MB/s', 'RSS MB', 'disk MB', 'ratio'))
+
+    try:
+        for size_mb in args.sizes_mb:
+            source = os.path.join(work_dir, 'source-{}.csv'.format(size_mb))
+            write_source(source, size_mb, args.data)
+            for case in get_cases(args, size_mb):
+                result = measure(context, case, source, work_dir)
+                print(row.format(
+                    size_mb, case['mode'], case['chunk_kb'] or '-',
+                    case['workers'], case['compression'] or '-',
+                    '{:.1f}'.format(size_mb / result['encrypt_seconds']),
+                    '{:.1f}'.format(size_mb / result['decrypt_seconds']),
+                    '{:.1f}'.format(result['peak_rss'] / 1024 / 1024),
+                    '{:.1f}'.format(result['peak_disk'] / 1024 / 1024),
+                    '{:.2f}'.format(result['encrypted_size']
+                                    / (size_mb * 1024 * 1024))))
+                sys.stdout.flush()
+            os.remove(source)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+"""
+Benchmark runner commands end to end, offline.
+
+Installs the local fakes of gcpip.testing (filesystem GCS, SQLite BigQuery,
+in-memory KMS) with the given injected latency, generates CSV files and
+times these runner commands in one process: a plain batch upload, an
+encrypted batch upload, a bulk decryption of the encrypted upload and a
+BigQuery load of one file through a submission. Reports the wall time and
+the API calls made on each fake per command. With a fixed seed, runs with
+the same arguments inject the same latency.
+
+Example:
+    python benchmarks/bench_pipeline.py --files 50 --size_mb 4 \
+        --latency_ms 30 --jitter_ms 10 --bandwidth_mbps 100
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from gcpip import runner
+from gcpip.testing.backends import (
+    install_fake_backends, remove_fake_backends)
+from gcpip.testing.latency import Latency
+
+BUCKET = 'bench-landing'
+DATASET = 'bench_data'
+
+LOAD_CONFIG = '''
+project_id: fake-project
+sources:
+  source1:
+    bucket_id: {bucket}
+    file_path: plain/{name}
+    skip_leading_rows: 1
+destination:
+  schema:
+    field1: {{name: date, type: STRING, mode: required}}
+    field2: {{name: symbol, type: STRING, mode: required}}
+    field3: {{name: price, type: FLOAT, mode: nullable}}
+    field4: {{name: volume, type: INTEGER, mode: nullable}}
+  dataset: {dataset}
+  table: market
+'''
+
+SUBMISSION_CONFIG = '''
+submissions:
+  submission1:
+    submission_name: bench
+    metadata_file: {bucket}/meta/load.yaml
+    action: load
+'''
+
+
+def get_args(args):
+
+    parser = argparse.ArgumentParser(
+        description='Time runner commands against local fake backends')
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--size_mb', type=float, default=1)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency_ms', type=float, default=20)
+    parser.add_argument('--jitter_ms', type=float, default=0)
+    parser.add_argument('--bandwidth_mbps', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work_dir', type=str, default=None)
+    return parser.parse_args(args)
+
+
+def write_csv(path, size, rng):
+
+    with open(path, 'w') as f:
+        f.write('date,symbol,price,volume\n')
+        written = 0
+        while written < size:
+            row = '2020-{:02d}-{:02d},{},{:.4f},{}\n'.format(
+                rng.randint(1, 12), rng.randint(1, 28),
+                rng.choice(('AAPL', 'GOOG', 'MSFT', 'AMZN', 'BARC')),
+                rng.uniform(10, 500), rng.randint(100, 100000))
+            f.write(row)
+            written += len(row)
+
+
+def get_call_count(backends):
+
+    return sum(sum(x.calls.values()) for x in
+               (backends.storage, backends.bigquery, backends.kms))
+
+
+def main(args):
+
+    args = get_args(args)
+    work_dir = tempfile.mkdtemp(prefix='gcpip-pipeline-', dir=args.work_dir)
+    latency = Latency(seconds=args.latency_ms / 1000,
+                      jitter=args.jitter_ms / 1000,
+                      bandwidth_mbps=args.bandwidth_mbps, seed=args.seed)
+    backends = install_fake_backends(os.path.join(work_dir, 'backends'),
+                                     latency=latency)
+
+    try:
+        source = os.path.join(work_dir, 'source')
+        os.makedirs(source)
+        rng = random.Random(args.seed)
+        for i in range(args.files):
+            write_csv(os.path.join(source, 'market-{:04d}.csv'.format(i)),
+                      int(args.size_mb * 1024 * 1024), rng)
+
+        backends.storage.create_bucket(BUCKET)
+        backends.bigquery.create_dataset(backends.bigquery.dataset(DATASET))
+        bucket = backends.storage.bucket(BUCKET)
+        bucket.blob('meta/load.yaml').upload_from_string(LOAD_CONFIG.format(
+            bucket=BUCKET, dataset=DATASET, name='market-0000.csv'))
+        bucket.blob('submissions/bench.yaml').upload_from_string(
+            SUBMISSION_CONFIG.format(bucket=BUCKET))
+        config = os.path.join(work_dir, 'upload.yaml')
+        with open(config, 'w') as f:
+            f.write('project_name: fake-project\n')
+
+        kms_args = ['-l', 'europe-west2', '-r', 'bench', '-k', 'bench']
+        commands = [
+            ('upload plain', ['upload', '-a', 'plain', '-s', source, '-d',
+                              'plain/', '-c', config, '-b', BUCKET,
+                              '-w', str(args.workers)]),
+            ('upload encrypted', ['upload', '-a', 'encrypted', '-s', source,
+                                  '-d', 'encrypted/', '-c', config, '-b',
+                                  BUCKET, '-w', str(args.workers)]
+             + kms_args),
+            ('decrypt', ['decrypt', '-s', 'encrypted/', '-c', config, '-b',
+                         BUCKET, '-w', str(args.workers)] + kms_args),
+            ('load', ['load', '-b', BUCKET, '-s', 'submissions/bench.yaml']),
+        ]
+
+        print('files: {}, size: {} MB, latency: {} ms, jitter: {} ms, '
+              'bandwidth: {} MB/s'.format(
+                  args.files, args.size_mb, args.latency_ms, args.jitter_ms,
+                  args.bandwidth_mbps or 'unlimited'))
+        row = '{:>18} {:>10} {:>10} {:>10}'
+        print(row.format('command', 'seconds', 'MB/s', 'API calls'))
+
+        # Runner commands write temporary files to the cwd
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for name, command in commands:
+                calls = get_call_count(backends)
+                start = time.perf_counter()
+                runner.main(command)
+                elapsed = time.perf_counter() - start
+                size_mb = args.size_mb * (1 if name == 'load' else
+                                          args.files)
+                print(row.format(name, '{:.2f}'.format(elapsed),
+                                 '{:.1f}'.format(size_mb / elapsed),
+                                 get_call_count(backends) - calls))
+                sys.stdout.flush()
+        finally:
+            os.chdir(cwd)
+    finally:
+        remove_fake_backends()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
+try:
+    # importlib.metadata is much faster to import than pkg_resources
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:  # Python < 3.8
+    from pkg_resources import (
+        get_distribution, DistributionNotFound as PackageNotFoundError)
+
+    def version(dist_name):
+        return get_distribution(dist_name).version
 
 try:
     # Change here if project is renamed and does not equal the package name
     dist_name = __name__
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
+    __version__ = version(dist_name)
+except PackageNotFoundError:
     __version__ = 'unknown'
 finally:
-    del get_distribution, DistributionNotFound
+    del version, PackageNotFoundError
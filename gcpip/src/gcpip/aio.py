@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound
+from gcpip.upload.gcp_upload import upload_file
+from gcpip.utils import biq_query, storage
+from gcpip.utils.clients import (
+    get_storage_client, get_bq_client, HTTP_POOL_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Blocking calls in flight at once, sized to the connection pool of the
+# shared HTTP session so no call waits for or discards a connection
+DEFAULT_CONCURRENCY = HTTP_POOL_SIZE
+
+# Seconds between two status checks of a BigQuery job
+JOB_POLL_INTERVAL = 1.0
+
+
+class AsyncGcp():
+    """
+    Asyncio interface to the gcpip storage and BigQuery helpers. The helpers
+    run on a thread pool shared by every call, bounded by a concurrency
+    limit, and use the shared clients of gcpip.utils.clients with their
+    connection pools. Any number of operations can be awaited from one event
+    loop; at most `concurrency` of them hold a thread and a connection at a
+    time. Waiting for a BigQuery job only holds a thread while its status is
+    checked.
+
+    Example:
+        async with AsyncGcp() as gcp:
+            await asyncio.gather(*[
+                gcp.upload_file(bucket, path, os.path.basename(path))
+                for path in paths])
+
+    Args:
+        storage_client (storage.Client, optional): GCS client object.
+            Defaults to the shared client.
+        bq_client (bigquery.Client, optional): BQ client object.
+            Defaults to the shared client.
+        concurrency (int, optional): Blocking calls in flight at once.
+            Defaults to DEFAULT_CONCURRENCY.
+    """
+
+    def __init__(self, storage_client=None, bq_client=None,
+                 concurrency=DEFAULT_CONCURRENCY):
+        self._storage_client = storage_client
+        self._bq_client = bq_client
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='gcpip-aio')
+        # Created on first use, inside the event loop
+        self._limiter = None
+
+    @property
+    def storage_client(self):
+        if self._storage_client is None:
+            self._storage_client = get_storage_client()
+        return self._storage_client
+
+    @property
+    def bq_client(self):
+        if self._bq_client is None:
+            self._bq_client = get_bq_client()
+        return self._bq_client
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Runs a blocking function on the shared thread pool once a
+        concurrency slot is free.
+
+        Returns:
+            the result of function
+        """
+        if self._limiter is None:
+            self._limiter = asyncio.Semaphore(self.concurrency)
+        async with self._limiter:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(function, *args, **kwargs))
+
+    async def upload_file(self, bucket_name, source_file_name,
+                          destination_name, **kwargs):
+        """
+        See gcpip.upload.gcp_upload.upload_file, keyword arguments are
+        passed on.
+
+        Returns:
+            str: UPLOADED or SKIPPED
+        """
+        return await self.run(upload_file, self.storage_client, bucket_name,
+                              source_file_name, destination_name, **kwargs)
+
+    async def download_file(self, bucket_name, blob_path, destination_path,
+                            **kwargs):
+        """
+        See gcpip.utils.storage.download_gcs_file
+        """
+        await self.run(storage.download_gcs_file, self.storage_client,
+                       bucket_name, blob_path, destination_path, **kwargs)
+
+    async def load_object(self, bucket_name, blob_path):
+        """
+        Returns:
+            bytes: blob object contents
+        """
+        return await self.run(storage.load_gcs_object, self.storage_client,
+                              bucket_name, blob_path)
+
+    async def delete_blob(self, bucket_name, blob_path):
+        await self.run(storage.delete_blob, self.storage_client, bucket_name,
+                       blob_path)
+
+    async def delete_blobs(self, bucket_name, blob_paths, **kwargs):
+        """
+        See gcpip.utils.storage.delete_blobs
+
+        Returns:
+            list[dict]: blob and error of every deletion
+        """
+        return await self.run(storage.delete_blobs, self.storage_client,
+                              bucket_name, blob_paths, **kwargs)
+
+    async def get_table(self, project_id, dataset_id, table_id):
+        """
+        Returns:
+            google.cloud.bigquery.table.Table: BQ table object
+        """
+        return await self.run(biq_query.get_table, self.bq_client,
+                              project_id, dataset_id, table_id)
+
+    async def table_exists(self, project_id, dataset_id, table_id):
+        """
+        Returns:
+            bool: True if the table and its dataset exist
+        """
+        try:
+            await self.get_table(project_id, dataset_id, table_id)
+        except NotFound:
+            return False
+        return True
+
+    async def create_table(self, project_id, dataset_id, table_id,
+                           schema_config):
+        """
+        See gcpip.utils.biq_query.create_table
+
+        Returns:
+            google.cloud.bigquery.table.Table: BQ table object
+        """
+        return await self.run(biq_query.create_table, self.bq_client,
+                              project_id, dataset_id, table_id, schema_config)
+
+    async def submit_load_job(self, project_id, bucket_id, csv_path,
+                              dataset_id, table_id, skip_leading_rows):
+        """
+        Starts a BigQuery load job of a GCS CSV, see
+        gcpip.utils.biq_query.gcs_csv_to_bq
+
+        Returns:
+            google.cloud.bigquery.job.LoadJob: Started load job
+        """
+        return await self.run(biq_query.gcs_csv_to_bq, self.bq_client,
+                              project_id, bucket_id, csv_path, dataset_id,
+                              table_id, skip_leading_rows)
+
+    async def wait_for_job(self, job, poll_interval=JOB_POLL_INTERVAL,
+                           timeout=None):
+        """
+        Waits for a BigQuery job without holding a thread between status
+        checks.
+
+        Args:
+            job (google.cloud.bigquery.job._AsyncJob): Started job
+            poll_interval (float, optional): Seconds between status checks
+            timeout (float, optional): Seconds to wait before raising
+                asyncio.TimeoutError. Defaults to no limit.
+
+        Returns:
+            the job, raising its error if it failed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await self.run(job.done):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(
+                    'Job {} not done after {}s'.format(job.job_id, timeout))
+            await asyncio.sleep(poll_interval)
+        # The job is done, result() only raises its error if any
+        await self.run(job.result)
+        return job
+
+    async def load_csv(self, project_id, bucket_id, csv_path, dataset_id,
+                       table_id, skip_leading_rows, **kwargs):
+        """
+        Loads a GCS CSV into BigQuery and waits for the load job. Keyword
+        arguments are passed to wait_for_job.
+
+        Returns:
+            google.cloud.bigquery.job.LoadJob: Finished load job
+        """
+        job = await self.submit_load_job(project_id, bucket_id, csv_path,
+                                         dataset_id, table_id,
+                                         skip_leading_rows)
+        logger.debug('Waiting for load job: {}'.format(job.job_id))
+        return await self.wait_for_job(job, **kwargs)
+
+    def close(self):
+        """
+        Waits for running calls and stops the thread pool. The shared
+        clients stay open.
+        """
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
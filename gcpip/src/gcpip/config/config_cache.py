@@ -0,0 +1,68 @@
+import logging
+import threading
+from google.api_core.exceptions import NotFound
+from gcpip.utils.storage import get_bucket_handle, get_blob_generation
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cache of parsed configs, keyed by project, bucket, blob name
+# and config class and mapped to the blob generation and the config object.
+# A new generation replaces the entry of the blob.
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+
+def load_gcs_config(storage_client, bucket_name, blob_name, config_class,
+                    ttl=0):
+    """
+    Builds a config object from a YAML blob in memory. Parsed configs are
+    cached by blob generation, so an unchanged config costs one metadata
+    lookup and is never downloaded or parsed again. Cached config objects
+    are shared and should not be modified.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_name (str): Path to the config blob within bucket
+        config_class: Config class taking the YAML content, e.g. LoadConfig
+        ttl (float, optional): Seconds the generation lookup stays cached,
+            see get_blob_generation. Defaults to 0, looked up every time.
+
+    Returns:
+        config object of config_class
+
+    Raises:
+        NotFound: the config blob does not exist
+    """
+
+    generation = get_blob_generation(storage_client, bucket_name, blob_name,
+                                     ttl=ttl)
+    if generation is None:
+        raise NotFound('Config file gs://{}/{} does not exist'.format(
+            bucket_name, blob_name))
+
+    cache_key = (storage_client.project, bucket_name, blob_name,
+                 config_class)
+    with _config_cache_lock:
+        entry = _config_cache.get(cache_key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+
+    logger.debug("Loading config: gs://{}/{} generation {}".format(
+        bucket_name, blob_name, generation))
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    # Pinned to the looked up generation, so the cache key matches content
+    blob = bucket.blob(blob_name, generation=generation)
+    config = config_class(blob.download_as_bytes())
+    with _config_cache_lock:
+        _config_cache[cache_key] = (generation, config)
+    return config
+
+
+def clear_config_cache():
+    """
+    Forget all parsed configs
+    """
+
+    with _config_cache_lock:
+        _config_cache.clear()
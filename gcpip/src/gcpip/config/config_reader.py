@@ -1,12 +1,33 @@
+import os
 import yaml
 
+# The libyaml C loader parses several times faster, when PyYAML has it
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+def load_yaml(source):
+    """
+    Parse a YAML document
+
+    Args:
+        source: filepath, YAML content as bytes, or a stream to read it
+            from
+
+    Returns: parsed document
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            return yaml.load(file, Loader=YAML_LOADER)
+    return yaml.load(source, Loader=YAML_LOADER)
+
 
 class UploadConfig():
     """
     Config object for GCP upload
 
     Args:
-        configfile_path: filepath to config file
+        configfile_path: filepath to config file, or its content as bytes
+            or a stream
     """
 
     def __init__(self, configfile_path):
@@ -24,9 +45,7 @@ class UploadConfig():
 
         Returns:
         """
-        with open(self.configfile) as file:
-            configs = yaml.load(file, Loader=yaml.FullLoader)
-        return configs
+        return load_yaml(self.configfile)
 
     def parse_dlp_config(self):
         """
@@ -131,7 +150,8 @@ class BigQueryViewConfig():
     Abstract config object for use when generating Big Query views
 
     Args:
-        configfile_path (str): Filepath for config file
+        configfile_path (str): Filepath for config file, or its content as
+            bytes or a stream
     """
 
     def __init__(self, configfile_path):
@@ -146,9 +166,7 @@ class BigQueryViewConfig():
 
         Returns: Dict containing all config info
         """
-        with open(self.configfile) as file:
-            configs = yaml.load(file, Loader=yaml.FullLoader)
-        return configs
+        return load_yaml(self.configfile)
 
     def __parse_views(self):
         """
@@ -179,7 +197,8 @@ class SubmissionConfig():
     Config object for pipeline submissions
 
     Args:
-        configfile_path: filepath to config file
+        configfile_path: filepath to config file, or its content as bytes
+            or a stream
     """
 
     def __init__(self, configfile_path):
@@ -193,9 +212,7 @@ class SubmissionConfig():
 
         Returns:
         """
-        with open(self.configfile) as file:
-            configs = yaml.load(file, Loader=yaml.FullLoader)
-        return configs
+        return load_yaml(self.configfile)
 
     def parse_submissions(self):
         """
@@ -236,9 +253,7 @@ class LoadConfig():
 
         Returns:
         """
-        with open(self.configfile) as file:
-            configs = yaml.load(file, Loader=yaml.FullLoader)
-        return configs
+        return load_yaml(self.configfile)
 
     def parse_key_file(self):
         """
@@ -355,9 +370,7 @@ class FeatureEngineeringFunction():
 
         Returns: Dict containing all config info
         """
-        with open(self.configfile) as file:
-            configs = yaml.load(file, Loader=yaml.FullLoader)
-        return configs
+        return load_yaml(self.configfile)
 
     def get_config(self):
         """
@@ -450,7 +463,8 @@ class FeatureEngineeringConfig(FeatureEngineeringFunction):
     Abstract config object for use when generating Big Query views
 
     Args:
-        configfile_path (str): Filepath for config file
+        configfile_path (str): Filepath for config file, or its content as
+            bytes or a stream
     """
 
     def __init__(self, configfile_path):
@@ -1,6 +1,7 @@
 import os
-from google.cloud import storage
 import logging
+from gcpip.utils.clients import get_storage_client
+from gcpip.utils.storage import get_bucket_handle, api_calls
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +37,9 @@ def upload_file_to_staging_bucket(project, bucket_name, filename, file_obj):
 
     """
     logger.info('Uploading file {} to bucket: {}.'.format(filename, bucket_name))
-    client = storage.Client(project=project)
-    bucket = client.get_bucket(bucket_name)
+    client = get_storage_client(project=project)
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(client, bucket_name)
     blob = bucket.blob(filename)
     blob.upload_from_file(file_obj)
 
@@ -2,6 +2,7 @@ import sys
 import logging
 import argparse
 from google.cloud import bigquery
+from gcpip.utils.clients import get_bq_client
 
 
 def load(dataset_id, table, gcs_uri, client, autodetect=False):
@@ -44,7 +45,7 @@ def main(args):
     """
 
     autodetect = False
-    client_bq = bigquery.Client()
+    client_bq = get_bq_client()
     dataset = 'market_dataset'
     bq_table = 'market'
     uri = 'gs://data-science-activator-landing-data-bucket-mssb-sandbox/prepared_data/market_data.csv'
@@ -1,8 +1,20 @@
 import logging
-from gcpip.utils.biq_query import create_table, gcs_csv_to_bq
+from concurrent.futures import ThreadPoolExecutor
+from gcpip.utils.biq_query import (
+    create_table, gcs_csv_to_bq, get_table_reference, get_csv_load_job_config,
+    MAX_LOAD_URIS, MAX_LOAD_BYTES)
+from gcpip.utils.storage import get_bucket_handle, get_gcs_url
 
 logger = logging.getLogger(__name__)
 
+# Concurrent object lookups sizing the sources of a load
+SIZE_LOOKUP_WORKERS = 16
+
+# Error reasons of a load job over a quota or limit of BigQuery, see
+# https://cloud.google.com/bigquery/docs/error-messages. A failed job loads
+# no rows, so a job failing with one of them is split in two and retried.
+LOAD_LIMIT_REASONS = ('quotaExceeded', 'resourcesExceeded')
+
 
 def load_gcs_csv_to_bq(bq_client, bucket_id, csv_path,
                        project_id, dataset_id,
@@ -41,3 +53,170 @@ def load_gcs_csv_to_bq(bq_client, bucket_id, csv_path,
                                table_id, skip_leading_rows)
 
     return import_job
+
+
+def get_gcs_source_bytes(storage_client, bucket_id, file_path):
+    """
+    Get the size of the file of a load source with one object lookup. The
+    size of a path with a * wildcard is not looked up, as that would need
+    listing every object under its prefix.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_id (str): ID of bucket containing the file
+        file_path (str): Path of the file, or with one * wildcard
+
+    Returns:
+        int: bytes of the file, 0 if it is missing (the load job reports
+            it), None for a wildcard path
+    """
+
+    if '*' in file_path:
+        return None
+    blob = get_bucket_handle(storage_client, bucket_id).get_blob(file_path)
+    return 0 if blob is None else blob.size
+
+
+def is_load_limit_error(error):
+    """
+    Returns (bool): True if a load job failed with the reason of a quota or
+        limit, so the same sources may load when split into smaller jobs
+
+    """
+    return any(x.get('reason') in LOAD_LIMIT_REASONS
+               for x in getattr(error, 'errors', None) or [])
+
+
+def get_load_groups(sources, sizes=None, max_uris=MAX_LOAD_URIS,
+                    max_bytes=MAX_LOAD_BYTES):
+    """
+    Split load sources into as few load jobs as BigQuery limits allow.
+    Sources skipping different numbers of header rows need separate jobs.
+
+    Args:
+        sources (list[dict]): bucket_id, file_path and skip_leading_rows of
+            every source, as in load configs
+        sizes (list[int], optional): Bytes of every source, None for unknown
+            sizes. Defaults to not checking max_bytes.
+        max_uris (int, optional): Source URIs per job
+        max_bytes (int, optional): Bytes per job, None for no limit
+
+    Returns:
+        list[dict]: skip_leading_rows, uris and bytes of every job
+    """
+
+    groups = []
+    open_groups = {}
+    for i, source in enumerate(sources):
+        size = (sizes[i] if sizes else None) or 0
+        skip_leading_rows = source.get('skip_leading_rows') or 0
+        group = open_groups.get(skip_leading_rows)
+        if group is None or len(group['uris']) >= max_uris or (
+                max_bytes is not None and group['bytes'] + size > max_bytes):
+            group = {'skip_leading_rows': skip_leading_rows, 'uris': [],
+                     'bytes': 0}
+            groups.append(group)
+            open_groups[skip_leading_rows] = group
+        if max_bytes is not None and size > max_bytes:
+            logger.warning("Source {} exceeds the load job size limit".format(
+                source['file_path']))
+        group['uris'].append(get_gcs_url(source['bucket_id'],
+                                         source['file_path']))
+        group['bytes'] += size
+    return groups
+
+
+def load_gcs_csvs_to_bq(bq_client, sources, project_id, dataset_id,
+                        table_id, schema_config, storage_client=None,
+                        max_uris=MAX_LOAD_URIS, max_bytes=MAX_LOAD_BYTES,
+                        workers=SIZE_LOOKUP_WORKERS):
+    """
+    Create a table and load every CSV source into it, with one load job
+    taking the list of source URIs. When the sources exceed the URI limit
+    of a job, or skip different numbers of header rows, they are split into
+    jobs running in parallel, appending to the new table. A job failing
+    with a quota or limit reason is split in two and retried, other errors
+    are returned unchanged. Unlike a single job, several jobs are not
+    all-or-nothing: rows of the jobs that succeed stay loaded.
+
+    Args:
+        bq_client (google.cloud.bigquery.Client): BQ client object
+        sources (list[dict]): bucket_id, file_path (optionally with one *
+            wildcard) and skip_leading_rows of every source
+        project_id (str): ID of project for load job.
+        dataset_id (str): ID of Biq Query dataset to load data.
+        table_id (str): ID of Big Query table to load data.
+        schema_config (dict): Dictionary containing schema config information.
+        storage_client (storage.Client, optional): Client looking up the
+            sizes of sources without a wildcard when the URI limit already
+            splits them, so the jobs are also split on max_bytes. Defaults to
+            only splitting jobs failing on the size limit.
+        max_uris (int, optional): Source URIs per job
+        max_bytes (int, optional): Bytes per job, None for no limit
+        workers (int, optional): Number of concurrent size lookups
+
+    Returns:
+        dict: jobs (job IDs, including jobs split after failing on a quota
+            or limit), errors ((job ID, exception) of failed jobs), and
+            output_rows, input_files and input_file_bytes summed over the
+            jobs
+    """
+
+    logger.info("Creating table: {} in dataset: {} and loading {} CSV "
+                "sources".format(table_id, dataset_id, len(sources)))
+
+    sizes = None
+    if storage_client is not None and max_bytes is not None and \
+            len(sources) > max_uris:
+        with ThreadPoolExecutor(max(1, min(workers, len(sources)))) as pool:
+            sizes = list(pool.map(
+                lambda x: get_gcs_source_bytes(
+                    storage_client, x['bucket_id'], x['file_path']),
+                sources))
+    groups = get_load_groups(sources, sizes, max_uris=max_uris,
+                             max_bytes=max_bytes)
+
+    create_table(bq_client, project_id, dataset_id, table_id, schema_config)
+    table_reference = get_table_reference(bq_client, project_id, dataset_id,
+                                          table_id)
+
+    stats = {'jobs': [], 'errors': [], 'output_rows': 0, 'input_files': 0,
+             'input_file_bytes': 0}
+    write_disposition = 'WRITE_EMPTY' if len(groups) == 1 else 'WRITE_APPEND'
+    while groups:
+        # Jobs run in parallel in BigQuery, they are all submitted before
+        # waiting for any of them
+        jobs = [bq_client.load_table_from_uri(
+            x['uris'], table_reference, job_config=get_csv_load_job_config(
+                x['skip_leading_rows'], write_disposition))
+            for x in groups]
+        if len(jobs) > 1:
+            logger.info("Split {} sources into {} load jobs".format(
+                sum(len(x['uris']) for x in groups), len(jobs)))
+
+        retries = []
+        for group, job in zip(groups, jobs):
+            stats['jobs'].append(job.job_id)
+            try:
+                job.result()
+            except Exception as e:
+                if is_load_limit_error(e) and len(group['uris']) > 1:
+                    # A failed job loads no rows, its halves append
+                    logger.warning("Load job {} exceeds a limit, splitting "
+                                   "it: {}".format(job.job_id, e))
+                    half = len(group['uris']) // 2
+                    retries.extend(
+                        dict(group, uris=x) for x in (
+                            group['uris'][:half], group['uris'][half:]))
+                    continue
+                logger.error("Load job {} failed: {}".format(job.job_id, e))
+                stats['errors'].append((job.job_id, e))
+                continue
+            for key in ('output_rows', 'input_files', 'input_file_bytes'):
+                stats[key] += getattr(job, key) or 0
+        groups = retries
+        write_disposition = 'WRITE_APPEND'
+    logger.info("Loaded {} rows from {} files ({} bytes) with {} jobs".format(
+        stats['output_rows'], stats['input_files'],
+        stats['input_file_bytes'], len(stats['jobs'])))
+    return stats
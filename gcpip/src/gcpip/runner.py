@@ -1,20 +1,21 @@
-import os
-
-from google.cloud import bigquery, storage, dataproc_v1
-from gcpip.bq_view_generator import create_bq_views
 from gcpip.config.config_reader import (
     UploadConfig, BigQueryViewConfig, LoadConfig, FeatureEngineeringConfig, SubmissionConfig)
-from gcpip.utils.encryption import get_kms_client
-from gcpip.utils.storage import get_storage_client
-from gcpip.utils.biq_query import get_bq_client
-from gcpip.fe.gap_pyspark import run_submit_job_to_dataproc_cluster
-from gcpip.upload.gcp_upload import (
-    upload_file, encrypt_upload_file, decrypt_blob)
-from gcpip.load.load import load_gcs_csv_to_bq
+from gcpip.config.config_cache import load_gcs_config
+from gcpip.utils.clients import (
+    get_storage_client, get_bq_client, get_kms_client,
+    get_dataproc_job_client, get_http_session)
+from gcpip.upload.defaults import (
+    DEFAULT_WORKERS, COMPOSITE_THRESHOLD, COMPRESSIONS)
+from gcpip.upload.journal import UploadJournal, DEFAULT_STATE_DIR
+from gcpip.utils.storage import blob_exists, api_calls
+from gcpip.submission import (
+    DEFAULT_STEP_WORKERS, SUCCEEDED, get_submission_steps,
+    run_submission_steps, format_report)
+from google.api_core.exceptions import NotFound
 import argparse
+import functools
 import logging
 import sys
-from google.cloud.dataproc_v1.gapic.transports import job_controller_grpc_transport
 
 logger = logging.getLogger(__name__)
 
@@ -57,8 +58,9 @@ def get_args(args):
     parser_decrypt.set_defaults(which='decrypt')
     parser_decrypt.add_argument(
         '-s', '--source', type=str,
-        help='Please provide the blob to be decrypted '
-             'features.',
+        help='Please provide the blob to be decrypted, a prefix ending with '
+             '/ or a glob pattern to decrypt every matching .encrypted '
+             'blob.',
         required=True),
     parser_decrypt.add_argument(
         '-c', '--config_file', type=str,
@@ -86,6 +88,12 @@ def get_args(args):
              'features.',
         required=False
     )
+    parser_decrypt.add_argument(
+        '--stream', action='store_true',
+        help='Decrypt while copying within GCS, without local temp files.')
+    parser_decrypt.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_WORKERS,
+        help='Number of concurrent decryptions for prefixes and globs.')
 
     # Upload subparser
     parser_upload = subparsers.add_parser("upload")
@@ -101,11 +109,17 @@ def get_args(args):
         help='Please provide the blob destination'
              'features.',
         required=True),
-    parser_upload.add_argument(
+    upload_sources = parser_upload.add_mutually_exclusive_group(
+        required=True)
+    upload_sources.add_argument(
         '-s', '--source', type=str,
-        help='Please provide the local source file'
-             'features.',
-        required=True),
+        help='Please provide the local source file, directory or glob '
+             'pattern. For directories and globs the destination is used '
+             'as a blob name prefix.')
+    upload_sources.add_argument(
+        '-m', '--manifest', type=str,
+        help='Please provide a file listing local source files, one per '
+             'line. The destination is used as a blob name prefix.')
     parser_upload.add_argument(
         '-c', '--config_file', type=str,
         help='Please provide the config file that is required by to build'
@@ -131,6 +145,44 @@ def get_args(args):
         help='Please provide the location id for the KEK'
              'features.',
         required=False)
+    parser_upload.add_argument(
+        '--stream', action='store_true',
+        help='Encrypt while uploading, without writing a local encrypted '
+             'copy of the source file.')
+    parser_upload.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_WORKERS,
+        help='Number of concurrent uploads for directories, globs and '
+             'manifests.')
+    parser_upload.add_argument(
+        '--composite_threshold_mb', type=int,
+        default=COMPOSITE_THRESHOLD // (1024 * 1024),
+        help='Files of at least this many MB are uploaded as parallel '
+             'composite uploads. 0 disables composite uploads.')
+    parser_upload.add_argument(
+        '--session_key', action='store_true',
+        help='For encrypted batches, wrap one session key with KMS and '
+             'derive a key per file from it instead of one KMS call per '
+             'file.')
+    parser_upload.add_argument(
+        '--encryption_workers', type=int, default=1,
+        help='Number of CPU cores used to encrypt each file.')
+    parser_upload.add_argument(
+        '--compression', type=str, choices=COMPRESSIONS, default=None,
+        help='Compress files before upload. Encrypted uploads support gzip '
+             'and zstd, plain uploads are stored with Content-Encoding: '
+             'gzip.')
+    parser_upload.add_argument(
+        '--skip_unchanged', action='store_true',
+        help='Skip files whose destination blob already has the same '
+             'content, compared by CRC32C/MD5 checksum.')
+    parser_upload.add_argument(
+        '--resume', action='store_true',
+        help='Journal resumable upload sessions in --state_dir, so running '
+             'the same command again resumes interrupted files and skips '
+             'completed ones.')
+    parser_upload.add_argument(
+        '--state_dir', type=str, default=DEFAULT_STATE_DIR,
+        help='Directory of the upload journal used with --resume.')
 
     # bigquery view parser
     parser_bq_view = subparsers.add_parser("bq_view")
@@ -186,6 +238,34 @@ def get_args(args):
         help='Please provide the submission configuration file. e.g. submissions/submission_config.yaml',
         required=True)
 
+    # Run a whole submission file parser
+    parser_run_submission = subparsers.add_parser("run-submission")
+    parser_run_submission.set_defaults(which='run-submission')
+    parser_run_submission.add_argument(
+        '-b', '--bucket', type=str,
+        help='Please provide the bucket_name storing the submission configuration and metadata files.',
+        required=True)
+    parser_run_submission.add_argument(
+        '-s', '--submission_config_blob', type=str,
+        help='Please provide the submission configuration file. e.g. submissions/submission_config.yaml',
+        required=True)
+    parser_run_submission.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_STEP_WORKERS,
+        help='Number of submission steps running at once.')
+    parser_run_submission.add_argument(
+        '-r', '--region', type=str, default="europe-west2",
+        help='Dataproc region of feature engineering steps. e.g., "europe-west2"')
+    parser_run_submission.add_argument(
+        '-p', '--pyspark_file', type=str,
+        help='Pyspark filepath of feature engineering steps. e.g., "fe/feature_engineering_runner.py"')
+    parser_run_submission.add_argument(
+        '-o', '--other_python_files', type=str,
+        help='Complementary python filepath of feature engineering steps. '
+             'e.g., "fe/feature_engineering_functions.py"')
+    parser_run_submission.add_argument(
+        '-u', '--cluster_name', type=str,
+        help='Dataproc cluster of feature engineering steps. e.g., "dataproc-cluster"')
+
     # Global parser arguments
     parser.add_argument(
         '-v',
@@ -206,6 +286,11 @@ def get_args(args):
     )
 
     args = parser.parse_args(args)
+    if getattr(args, 'which', None) == 'upload' and \
+            args.action == 'plain' and args.compression not in (None, 'gzip'):
+        parser_upload.error(
+            '--compression {} needs -a encrypted, plain uploads only support '
+            'gzip Content-Encoding'.format(args.compression))
     return args
 
 
@@ -221,39 +306,112 @@ def setup_logging(loglevel):
 
 
 def run_upload(source, destination, bucket_name, config, encrypt=False,
-               location_id=None, key_ring_id=None, key_id=None):
+               location_id=None, key_ring_id=None, key_id=None,
+               streaming=False, manifest=None, workers=DEFAULT_WORKERS,
+               composite_threshold=COMPOSITE_THRESHOLD, session_keys=False,
+               encryption_workers=1, compression=None, skip_unchanged=False,
+               state_dir=None):
     """
     It runs upload task. Currently it upload the file to GCS.
     Uploaded file can be encrpyted or left as plain text before upload.
+    A directory, glob pattern or manifest uploads every matching file
+    concurrently, using the destination as a blob name prefix.
     Args:
-        data_file (str): Path to the input file.
+        source (str): Path to the input file, directory or glob pattern.
         destination (str): Google Cloud Destination directory/name
         bucket_name (str): Google Cloud Bucket name.
         config (UploadConfig): config object.
+        streaming (bool): Stream encrypted data straight to GCS instead of
+            writing a local encrypted copy first.
+        manifest (str): Path to a file listing the files to upload.
+        workers (int): Number of concurrent uploads for batches.
+        composite_threshold (int): Size in bytes from which files are sent
+            as parallel composite uploads. None disables them.
+        session_keys (bool): Encrypt batches with keys derived from one
+            KMS-wrapped session key.
+        encryption_workers (int): Number of segments sealed concurrently
+            for each encrypted file.
+        compression (str): Compress files before upload, 'gzip' or 'zstd'.
+            Plain uploads only support gzip.
+        skip_unchanged (bool): Skip files already uploaded with the same
+            content.
+        state_dir (str): Directory of the upload journal. When given,
+            uploads are resumable and completed files are skipped on
+            re-runs.
 
     Returns: Upload the file and return the upload confirmation message.
+        For batches, a summary with per file results and throughput.
 
     """
-    storage_client = get_storage_client(key_file=config.get_key_file())
-
-    if encrypt is False:
-        upload_file(storage_client=storage_client, bucket_name=bucket_name,
-                    source_file_name=source,
-                    destination_name=destination)
+    # Imported here as they load cryptography and the compression libraries,
+    # which the other commands do not need
+    from gcpip.upload.batch import (
+        is_batch_source, resolve_sources, upload_files)
+    from gcpip.upload.gcp_upload import upload_file, encrypt_upload_file
 
+    storage_client = get_storage_client(key_file=config.get_key_file())
+    kms_client = None
     if encrypt is True:
         kms_client = get_kms_client(key_file=config.get_key_file())
-        encrypt_upload_file(storage_client, kms_client, bucket_name, source,
-                            destination, config.project_name, location_id,
-                            key_ring_id, key_id)
+
+    journal = None
+    transport = None
+    if state_dir is not None:
+        journal = UploadJournal(state_dir)
+        transport = get_http_session(key_file=config.get_key_file())
+
+    try:
+        if is_batch_source(source, manifest):
+            summary = upload_files(
+                storage_client, bucket_name,
+                resolve_sources(source, manifest), destination,
+                workers=workers, encrypt=encrypt, kms_client=kms_client,
+                project_id=config.project_name, location_id=location_id,
+                key_ring_id=key_ring_id, key_id=key_id, streaming=streaming,
+                composite_threshold=composite_threshold,
+                session_keys=session_keys,
+                encryption_workers=encryption_workers,
+                compression=compression, skip_unchanged=skip_unchanged,
+                journal=journal, transport=transport)
+            if summary['failed']:
+                raise RuntimeError('{} of {} uploads failed'.format(
+                    summary['failed'], len(summary['files'])))
+            return summary
+
+        if encrypt is False:
+            upload_file(storage_client=storage_client,
+                        bucket_name=bucket_name,
+                        source_file_name=source,
+                        destination_name=destination,
+                        composite_threshold=composite_threshold,
+                        compression=compression,
+                        skip_unchanged=skip_unchanged, journal=journal,
+                        transport=transport)
+
+        if encrypt is True:
+            encrypt_upload_file(storage_client, kms_client, bucket_name,
+                                source, destination, config.project_name,
+                                location_id, key_ring_id, key_id,
+                                streaming=streaming,
+                                composite_threshold=composite_threshold,
+                                encryption_workers=encryption_workers,
+                                compression=compression,
+                                skip_unchanged=skip_unchanged,
+                                journal=journal, transport=transport)
+    finally:
+        if journal is not None:
+            journal.close()
 
 
 def run_decryption(blob_path, bucket_name, config, location_id,
-                   key_ring_id, key_id):
+                   key_ring_id, key_id, streaming=False,
+                   workers=DEFAULT_WORKERS):
     """
     Run decryption on uploaded blob.
     File will be downloaded to worker disk, decrypted and then uploaded to GCS
         storage
+    A prefix ending with / or a glob pattern decrypts every matching
+        .encrypted blob concurrently.
 
     Args:
         blob_path (str): Path to encrypted blob within bucket
@@ -262,65 +420,142 @@ def run_decryption(blob_path, bucket_name, config, location_id,
         location_id (str): Location id of KEK
         key_ring_id (str): Key ring id of KEK
         key_id (str): Key id of KEK
+        streaming (bool): Stream ranged downloads through the decryptor into
+            GCS instead of using worker disk
+        workers (int): Number of concurrent decryptions for batches
+
+    Returns: For batches, a summary with per blob results and throughput.
     """
+    from gcpip.upload.batch import is_batch_blob_source, decrypt_blobs
+    from gcpip.upload.gcp_upload import decrypt_blob
 
     storage_client = get_storage_client(key_file=config.get_key_file())
     kms_client = get_kms_client(key_file=config.get_key_file())
 
+    if is_batch_blob_source(blob_path):
+        summary = decrypt_blobs(
+            storage_client, kms_client, bucket_name, blob_path,
+            config.project_name, location_id, key_ring_id, key_id,
+            workers=workers, streaming=streaming)
+        if summary['failed']:
+            raise RuntimeError('{} of {} decryptions failed'.format(
+                summary['failed'], len(summary['blobs'])))
+        return summary
+
     decrypt_blob(
         storage_client, kms_client, bucket_name, blob_path,
-        config.project_name, location_id, key_ring_id, key_id)
+        config.project_name, location_id, key_ring_id, key_id,
+        streaming=streaming)
 
 
 def run_load(load_config):
+    """
+    Load every source of a load config into its table, with as few load jobs as BigQuery limits allow
+    Args:
+        load_config (LoadConfig): load configuration object
+
+    Returns:
+        dict: job IDs and statistics of the load, see load_gcs_csvs_to_bq
+    """
+    # Imported here as the BigQuery and Dataproc libraries take most of a second to import,
+    # the same goes for the bq_view and fe commands
+    from gcpip.load.load import load_gcs_csvs_to_bq
+
     # Get big query client
     bq_client = get_bq_client(load_config.key_file)
 
-    # Run load job
-    source0 = load_config.sources[0]
-    load_gcs_csv_to_bq(bq_client,
-                       bucket_id=source0['bucket_id'],
-                       csv_path=source0['file_path'],
-                       project_id=load_config.project_id,
-                       dataset_id=load_config.destination_dataset,
-                       table_id=load_config.destination_table,
-                       schema_config=load_config.destination_schema,
-                       skip_leading_rows=source0['skip_leading_rows'])
+    # Run load jobs
+    stats = load_gcs_csvs_to_bq(bq_client, load_config.sources,
+                                project_id=load_config.project_id,
+                                dataset_id=load_config.destination_dataset,
+                                table_id=load_config.destination_table,
+                                schema_config=load_config.destination_schema,
+                                storage_client=get_storage_client(load_config.key_file))
+    if stats['errors']:
+        raise stats['errors'][0][1]
+    return stats
+
+
+def check_feature_engineering_args(cluster_name, pyspark_file, other_python_files):
+    """
+    Check the arguments feature engineering steps submit their Dataproc job with
+    Args:
+        cluster_name (str): Dataproc cluster of feature engineering steps
+        pyspark_file (str): pyspark filepath of feature engineering steps
+        other_python_files (str): complementary python filepath of feature engineering steps
+
+    Raises:
+        ValueError: if any of the arguments is missing
+    """
+    if not (cluster_name and pyspark_file and other_python_files):
+        raise ValueError("feature engineering steps need the cluster name, pyspark file and other python files")
 
 
-def check_submission_config_file_exists(client, bucket_name, source_blob_name):
+def run_submission_step(step, region="europe-west2", cluster_name=None,
+                        pyspark_file=None, other_python_files=None):
+    """
+    Run one step of a submission with the shared clients
+    Args:
+        step (dict): submission step, see gcpip.submission.get_submission_steps
+        region (str): Dataproc region of feature engineering steps
+        cluster_name (str): Dataproc cluster of feature engineering steps
+        pyspark_file (str): pyspark filepath of feature engineering steps
+        other_python_files (str): complementary python filepath of feature engineering steps
+    """
+    if step['action'] == 'load':
+        run_load(step['config'])
+    elif step['action'] == 'view':
+        from gcpip.bq_view_generator import create_bq_views
+
+        create_bq_views(client=get_bq_client(), bq_config_obj=step['config'])
+    elif step['action'] == 'feature_engineering':
+        from gcpip.fe.gap_pyspark import run_submit_job_to_dataproc_cluster
+
+        check_feature_engineering_args(cluster_name, pyspark_file, other_python_files)
+        run_submit_job_to_dataproc_cluster(region=region,
+                                           cluster_name=cluster_name,
+                                           pyspark_file_path=pyspark_file,
+                                           other_python_file_path=other_python_files,
+                                           jar_file_uris=["gs://spark-lib/bigquery/spark-bigquery-latest.jar"],
+                                           config_obj=step['config'],
+                                           dataproc_job_client=get_dataproc_job_client(region))
+
+
+def check_submission_config_file_exists(client, bucket_name, source_blob_name, ttl=0):
     """
     This function checks if the specified submission configure file exists in the specified bucket.
+    It looks up the blob metadata directly, so the check does not depend on the number of blobs in the bucket.
     Args:
         client: cloud storage client object
         bucket_name (str): name of the bucket containing the view configuration file
         source_blob_name (str): name of the blob, which corresponds to the unique path of the object in the bucket.
+        ttl (float, optional): seconds the lookup stays cached. Defaults to 0, not cached.
 
     Returns:
         submission_config_exists (boolean): True, if the specified view_blob exists; otherwise, False
 
     """
-    bucket = client.get_bucket(bucket_name)
-    blobs = [x.name for x in bucket.list_blobs()]
-    submission_config_exists = (source_blob_name in blobs)
+    api_calls.record('buckets.get', saved=True)
+    submission_config_exists = blob_exists(client, bucket_name, source_blob_name, ttl=ttl)
     return submission_config_exists
 
 
-def check_config_file_exists(client, bucket_name, config_blob_name):
+def check_config_file_exists(client, bucket_name, config_blob_name, ttl=0):
     """
     This function checks if the specified BigQuery view configure file exists in the specified bucket.
+    It looks up the blob metadata directly, so the check does not depend on the number of blobs in the bucket.
     Args:
         client: cloud storage client object
         bucket_name (str): name of the bucket containing the configuration files
         config_blob_name (str): name of the blob, which corresponds to the unique path of the object in the bucket.
+        ttl (float, optional): seconds the lookup stays cached. Defaults to 0, not cached.
 
     Returns:
         config_exists (boolean): True, if the specified config_blob exists; otherwise, False
 
     """
-    bucket = client.get_bucket(bucket_name)
-    blobs = [x.name for x in bucket.list_blobs()]
-    config_exists = (config_blob_name in blobs)
+    api_calls.record('buckets.get', saved=True)
+    config_exists = blob_exists(client, bucket_name, config_blob_name, ttl=ttl)
     return config_exists
 
 
@@ -328,34 +563,30 @@ def get_submission_config_obj(client, bucket_name, source_blob_name):
     """
     This function get the submission configurations from submission config files in GCS
     The submission config file should be located in the submission folder in the data-landing-bucket
+    The file is parsed in memory and cached by generation, see load_gcs_config.
     Args:
         client: cloud storage client object
         bucket_name (str): name of the bucket
         source_blob_name (str): name of the blob, which corresponds to the unique path of the object in the bucket.
     Returns:
         submission_config_obj: submission configuration object
-    """
-    temp_local_file = os.path.basename(source_blob_name)  # temporary local file for storing the submission yaml file
-
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
-    blob.download_to_filename(temp_local_file)
-    submission_config_obj = SubmissionConfig(temp_local_file)
 
-    # remove the temp local file
+    Raises:
+        FileNotFoundError: if the submission config file does not exist
+    """
+    # The generation lookup of load_gcs_config doubles as the existence check
     try:
-        os.remove(temp_local_file)
-        print("% s removed successfully" % temp_local_file)
-    except OSError as error:
-        print(error)
-        print("File path can not be removed")
-
+        submission_config_obj = load_gcs_config(client, bucket_name, source_blob_name, SubmissionConfig)
+    except NotFound:
+        raise FileNotFoundError("Submission yaml file gs://{}/{} is not found in the GCS bucket, please upload!"
+                                .format(bucket_name, source_blob_name))
     return submission_config_obj
 
 
 def get_config_obj_from_submission(action, client, bucket_name, source_blob_name):
     """
     This function create BigQuery view object from the source_table in the source_dataset
+    The configuration file is parsed in memory and cached by generation, see load_gcs_config.
     Args:
         action (str): can be "view", "load", or "feature_engineering"
         client: cloud storage client object
@@ -364,6 +595,8 @@ def get_config_obj_from_submission(action, client, bucket_name, source_blob_name
     Returns:
         config_obj:
 
+    Raises:
+        FileNotFoundError: if the submission or configuration file does not exist
     """
     submission_config_obj = get_submission_config_obj(client, bucket_name, source_blob_name)
     submission_list = list(submission_config_obj.get_submissions().keys())
@@ -371,35 +604,18 @@ def get_config_obj_from_submission(action, client, bucket_name, source_blob_name
         if submission_config_obj.get_submissions()[submission]["action"] == action:
             meta_file_path = submission_config_obj.get_submissions()[submission]["metadata_file"]
             meta_file_bucket_name = meta_file_path.split('/')[0]
-            meta_file_name = os.path.basename(meta_file_path)
 
     config_blob_name = meta_file_path.replace(meta_file_bucket_name + "/", "")
-    temp_local_file = meta_file_name  # temporary local file for storing config yaml file
-    bucket = client.bucket(meta_file_bucket_name)
-
-    config_blob_exists = check_config_file_exists(client=client,
-                                                  bucket_name=meta_file_bucket_name,
-                                                  config_blob_name=config_blob_name)
-    if config_blob_exists:
-        blob = bucket.blob(config_blob_name)
-        blob.download_to_filename(temp_local_file)
-        if action == "load":
-            config_obj = LoadConfig(temp_local_file)
-        elif action == "view":
-            config_obj = BigQueryViewConfig(temp_local_file)
-        elif action == "feature_engineering":
-            config_obj = FeatureEngineeringConfig(temp_local_file)
-
-        # remove the temp local file
-        try:
-            os.remove(temp_local_file)
-            print("% s removed successfully" % temp_local_file)
-        except OSError as error:
-            print(error)
-            print("File path can not be removed")
-        return config_obj
-    else:
-        assert config_blob_exists, "configuration yaml file does not exist in the GCS bucket, please upload!"
+    config_classes = {"load": LoadConfig,
+                      "view": BigQueryViewConfig,
+                      "feature_engineering": FeatureEngineeringConfig}
+
+    try:
+        config_obj = load_gcs_config(client, meta_file_bucket_name, config_blob_name, config_classes[action])
+    except NotFound:
+        raise FileNotFoundError("configuration yaml file gs://{}/{} does not exist in the GCS bucket, please upload!"
+                                .format(meta_file_bucket_name, config_blob_name))
+    return config_obj
 
 
 def main(args):
@@ -417,6 +633,7 @@ def main(args):
         loglevel = logging.INFO
     setup_logging(loglevel)
     logging.info(args)
+    api_calls.reset()
 
     if args.which == 'upload':
         upload_config = UploadConfig(args.config_file)
@@ -426,78 +643,97 @@ def main(args):
         if args.action == 'encrypted':
             encrypt = True
 
+        composite_threshold = None
+        if args.composite_threshold_mb > 0:
+            composite_threshold = args.composite_threshold_mb * 1024 * 1024
+
         run_upload(source=args.source, destination=args.destination,
                    bucket_name=args.bucket,
                    config=upload_config, encrypt=encrypt,
                    location_id=args.location, key_ring_id=args.keyring,
-                   key_id=args.key
+                   key_id=args.key, streaming=args.stream,
+                   manifest=args.manifest, workers=args.workers,
+                   composite_threshold=composite_threshold,
+                   session_keys=args.session_key,
+                   encryption_workers=args.encryption_workers,
+                   compression=args.compression,
+                   skip_unchanged=args.skip_unchanged,
+                   state_dir=args.state_dir if args.resume else None
                    )
 
     if args.which == 'decrypt':
         config = UploadConfig(args.config_file)
         run_decryption(args.source, args.bucket, config, args.location,
-                       args.keyring, args.key)
+                       args.keyring, args.key, streaming=args.stream,
+                       workers=args.workers)
 
     if args.which == 'bq_view':
+        from gcpip.bq_view_generator import create_bq_views
+
         logger.info("Creating Biq Query View")
-        client_bq = bigquery.Client()
-        client_gcs = storage.Client()
-        submission_config_exists = check_submission_config_file_exists(
+        client_bq = get_bq_client()
+        client_gcs = get_storage_client()
+        bq_config_obj = get_config_obj_from_submission(
+            action="view",
             client=client_gcs, bucket_name=args.bucket,
             source_blob_name=args.submission_config_blob)
-        if submission_config_exists:
-            bq_config_obj = get_config_obj_from_submission(
-                action="view",
-                client=client_gcs, bucket_name=args.bucket,
-                source_blob_name=args.submission_config_blob)
-            create_bq_views(client=client_bq,
-                            bq_config_obj=bq_config_obj)
-        else:
-            assert submission_config_exists, "Submission yaml file is not found in the GCS bucket, please upload!"
+        create_bq_views(client=client_bq,
+                        bq_config_obj=bq_config_obj)
 
     if args.which == 'load':
-        client_gcs = storage.Client()
-        submission_config_exists = check_submission_config_file_exists(
-            client=client_gcs, bucket_name=args.bucket,
+        client_gcs = get_storage_client()
+        load_config = get_config_obj_from_submission(
+            action="load",
+            client=client_gcs,
+            bucket_name=args.bucket,
             source_blob_name=args.submission_config_blob)
-        if submission_config_exists:
-            load_config = get_config_obj_from_submission(
-                action="load",
-                client=client_gcs,
-                bucket_name=args.bucket,
-                source_blob_name=args.submission_config_blob)
-            run_load(load_config)
-        else:
-            assert submission_config_exists, "Submission yaml file is not found in the GCS bucket, please upload!"
+        run_load(load_config)
 
     if args.which == 'fe':
+        from gcpip.fe.gap_pyspark import run_submit_job_to_dataproc_cluster
+
         logger.info("Performing feature engineering tasks")
-        client_gcs = storage.Client()
-        submission_config_exists = check_submission_config_file_exists(
-            client=client_gcs, bucket_name=args.bucket,
+        client_gcs = get_storage_client()
+        fe_config_obj = get_config_obj_from_submission(
+            action="feature_engineering",
+            client=client_gcs,
+            bucket_name=args.bucket,
             source_blob_name=args.submission_config_blob)
-        if submission_config_exists:
-            fe_config_obj = get_config_obj_from_submission(
-                action="feature_engineering",
-                client=client_gcs,
-                bucket_name=args.bucket,
-                source_blob_name=args.submission_config_blob)
-            job_transport = (
-                job_controller_grpc_transport.JobControllerGrpcTransport(
-                    address='{}-dataproc.googleapis.com:443'.format(args.region)))
-            dataproc_job_client = dataproc_v1.JobControllerClient(job_transport)
-            # jar file for bq connector
-            jar_file_uris_bq_connector = ["gs://spark-lib/bigquery/spark-bigquery-latest.jar"]
-
-            run_submit_job_to_dataproc_cluster(region=args.region,
-                                               cluster_name=args.cluster_name,
-                                               pyspark_file_path=args.pyspark_file,
-                                               other_python_file_path=args.other_python_files,
-                                               jar_file_uris=jar_file_uris_bq_connector,
-                                               config_obj=fe_config_obj,
-                                               dataproc_job_client=dataproc_job_client)
-        else:
-            assert submission_config_exists, "Submission yaml file is not found in the GCS bucket, please upload!"
+        dataproc_job_client = get_dataproc_job_client(args.region)
+        # jar file for bq connector
+        jar_file_uris_bq_connector = ["gs://spark-lib/bigquery/spark-bigquery-latest.jar"]
+
+        run_submit_job_to_dataproc_cluster(region=args.region,
+                                           cluster_name=args.cluster_name,
+                                           pyspark_file_path=args.pyspark_file,
+                                           other_python_file_path=args.other_python_files,
+                                           jar_file_uris=jar_file_uris_bq_connector,
+                                           config_obj=fe_config_obj,
+                                           dataproc_job_client=dataproc_job_client)
+
+    if args.which == 'run-submission':
+        client_gcs = get_storage_client()
+        submission_config_obj = get_submission_config_obj(
+            client_gcs, args.bucket, args.submission_config_blob)
+        steps = get_submission_steps(client_gcs, submission_config_obj,
+                                     workers=args.workers)
+        # Checked before any step runs, so a missing argument does not fail the
+        # submission after its loads and views already ran
+        if any(x['action'] == 'feature_engineering' for x in steps.values()):
+            check_feature_engineering_args(args.cluster_name, args.pyspark_file,
+                                           args.other_python_files)
+        run_step = functools.partial(
+            run_submission_step, region=args.region,
+            cluster_name=args.cluster_name, pyspark_file=args.pyspark_file,
+            other_python_files=args.other_python_files)
+        results = run_submission_steps(steps, run_step, workers=args.workers)
+        logger.info("Submission steps:\n{}".format(format_report(results)))
+        unfinished = [x['name'] for x in results if x['status'] != SUCCEEDED]
+        if unfinished:
+            raise RuntimeError("Submission steps failed or skipped: {}".format(
+                ', '.join(unfinished)))
+
+    logger.info("GCS API calls: {}".format(api_calls.summary()))
 
 
 def run():
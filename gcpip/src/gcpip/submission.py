@@ -0,0 +1,195 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from gcpip.config.config_cache import load_gcs_config
+from gcpip.config.config_reader import (
+    LoadConfig, BigQueryViewConfig, FeatureEngineeringConfig)
+
+logger = logging.getLogger(__name__)
+
+# Steps of a submission running at once by default
+DEFAULT_STEP_WORKERS = 4
+
+# Config class and stage of every submission action. Steps only depend on
+# steps of earlier stages: loads, then views, then feature engineering.
+ACTIONS = {
+    'load': (LoadConfig, 0),
+    'view': (BigQueryViewConfig, 1),
+    'feature_engineering': (FeatureEngineeringConfig, 2),
+}
+
+# Step statuses
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def get_step_tables(action, config):
+    """
+    Get the BigQuery tables a step writes and reads
+
+    Args:
+        action (str): 'load', 'view' or 'feature_engineering'
+        config: config object of the step
+
+    Returns:
+        tuple: sets of (dataset, table) written and read
+    """
+
+    if action == 'load':
+        return {(config.destination_dataset, config.destination_table)}, set()
+    if action == 'view':
+        writes, reads = set(), set()
+        for view in (config.get_views() or {}).values():
+            writes.add((view['dataset_des'], view['view_name']))
+            for col in view['cols'].values():
+                reads.add((col['dataset_src'], col['table_src']))
+        return writes, reads
+    return ({(config.destination_dataset, config.destination_table)},
+            {(config.source_dataset, config.source_table)})
+
+
+def get_submission_steps(storage_client, submission_config_obj,
+                         workers=DEFAULT_STEP_WORKERS):
+    """
+    Loads the config of every submission and works out its dependencies. A
+    step depends on the steps of earlier stages writing a table it reads,
+    or on the submissions listed in its optional depends_on field.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        submission_config_obj (SubmissionConfig): submission configuration
+        workers (int, optional): Number of configs loaded at once
+
+    Returns:
+        dict: steps by submission name, in submission file order. A step is
+            a dict of name, action, config, stage, the writes and reads
+            sets of tables and the depends_on list of step names.
+    """
+
+    submissions = submission_config_obj.get_submissions() or {}
+    for name, submission in submissions.items():
+        if submission['action'] not in ACTIONS:
+            raise ValueError('Unknown action {} of submission {}'.format(
+                submission['action'], name))
+
+    def load_config(submission):
+        bucket_name, blob_name = submission['metadata_file'].split('/', 1)
+        return load_gcs_config(storage_client, bucket_name, blob_name,
+                               ACTIONS[submission['action']][0])
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        configs = list(pool.map(load_config, submissions.values()))
+
+    steps = {}
+    for (name, submission), config in zip(submissions.items(), configs):
+        writes, reads = get_step_tables(submission['action'], config)
+        steps[name] = {'name': name, 'action': submission['action'],
+                       'config': config, 'writes': writes, 'reads': reads,
+                       'stage': ACTIONS[submission['action']][1]}
+
+    for name, step in steps.items():
+        depends_on = submissions[name].get('depends_on')
+        if depends_on is None:
+            depends_on = [x['name'] for x in steps.values()
+                          if x['stage'] < step['stage']
+                          and x['writes'] & step['reads']]
+        unknown = set(depends_on) - set(steps)
+        if unknown:
+            raise ValueError('Submission {} depends on unknown {}'.format(
+                name, sorted(unknown)))
+        step['depends_on'] = list(depends_on)
+    return steps
+
+
+def _run_step(step, run_step, start):
+
+    result = {'name': step['name'], 'action': step['action'],
+              'started': time.monotonic() - start, 'error': None}
+    logger.info("Running {} step: {}".format(step['action'], step['name']))
+    try:
+        run_step(step)
+        result['status'] = SUCCEEDED
+    except Exception as e:
+        logger.exception("Step {} failed".format(step['name']))
+        result['status'] = FAILED
+        result['error'] = e
+    result['seconds'] = time.monotonic() - start - result['started']
+    return result
+
+
+def run_submission_steps(steps, run_step, workers=DEFAULT_STEP_WORKERS):
+    """
+    Runs steps as a dependency graph: a step starts as soon as the steps it
+    depends on succeed, and at most workers steps run at once. Steps
+    depending on a failed step are skipped, independent ones still run.
+
+    Args:
+        steps (dict): steps by name, see get_submission_steps
+        run_step (callable): runs one step, raises on failure
+        workers (int, optional): Number of steps running at once
+
+    Returns:
+        list[dict]: name, action, status, error, and the started and
+            seconds timings of every step, in the order of steps
+    """
+
+    start = time.monotonic()
+    results = {}
+    pending = dict(steps)
+    running = {}
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, step in list(pending.items()):
+                    statuses = [results[x]['status'] if x in results
+                                else None for x in step['depends_on']]
+                    if FAILED in statuses or SKIPPED in statuses:
+                        logger.warning("Skipping step {}: a dependency "
+                                       "did not succeed".format(name))
+                        results[name] = {
+                            'name': name, 'action': step['action'],
+                            'status': SKIPPED, 'error': None,
+                            'started': None, 'seconds': 0}
+                    elif all(x == SUCCEEDED for x in statuses):
+                        future = pool.submit(_run_step, step, run_step,
+                                             start)
+                        running[future] = name
+                    else:
+                        continue
+                    del pending[name]
+                    scheduled = True
+            if not running:
+                if pending:
+                    raise ValueError('Dependency cycle between steps: '
+                                     '{}'.format(sorted(pending)))
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return [results[name] for name in steps]
+
+
+def format_report(results):
+    """
+    Returns (str): one line of status and timings per step, and the total
+
+    """
+    row = '{:<24} {:<20} {:<10} {:>9} {:>9}'
+    lines = [row.format('step', 'action', 'status', 'start s', 'seconds')]
+    for result in results:
+        started = result['started']
+        lines.append(row.format(
+            result['name'], result['action'], result['status'],
+            '-' if started is None else '{:.2f}'.format(started),
+            '{:.2f}'.format(result['seconds'])))
+    total = max([x['started'] + x['seconds'] for x in results
+                 if x['started'] is not None] or [0])
+    lines.append('{} steps in {:.2f}s: {} succeeded, {} failed, {} '
+                 'skipped'.format(
+                     len(results), total,
+                     *[sum(x['status'] == s for x in results)
+                       for s in (SUCCEEDED, FAILED, SKIPPED)]))
+    return '\n'.join(lines)
@@ -0,0 +1,64 @@
+import logging
+import os
+from types import SimpleNamespace
+from gcpip.config.config_cache import clear_config_cache
+from gcpip.testing.bigquery import FakeBigQueryClient
+from gcpip.testing.kms import FakeKmsClient
+from gcpip.testing.storage import FakeStorageClient
+from gcpip.utils.clients import override_client, clear_clients
+from gcpip.utils.encryption import invalidate_kms_cache
+from gcpip.utils.storage import (
+    invalidate_bucket_cache, invalidate_object_cache)
+
+logger = logging.getLogger(__name__)
+
+
+def install_fake_backends(root, latency=None, project='fake-project'):
+    """
+    Makes every gcpip client getter return local fakes, so runner commands
+    and helpers run offline: GCS in files under root/gcs, BigQuery in the
+    SQLite database root/bigquery.sqlite and KMS in memory. The HTTP session
+    getter returns the resumable upload transport of the fake GCS. KMS keys
+    do not outlive the process, encrypt and decrypt in the same process.
+
+    Args:
+        root (str): Directory holding the fake GCS buckets and BigQuery
+            database
+        latency (Latency, optional): Latency injected into every call of
+            every fake. Defaults to none.
+        project (str, optional): Project ID of the fakes
+
+    Returns:
+        SimpleNamespace: the installed storage, bigquery and kms clients
+    """
+
+    logger.info('Using fake GCP backends under: {}'.format(root))
+    os.makedirs(root, exist_ok=True)
+    storage_client = FakeStorageClient(os.path.join(root, 'gcs'),
+                                       project=project, latency=latency)
+    backends = SimpleNamespace(
+        storage=storage_client,
+        bigquery=FakeBigQueryClient(
+            storage_client, database=os.path.join(root, 'bigquery.sqlite'),
+            project=project, latency=latency),
+        kms=FakeKmsClient(latency=latency))
+
+    remove_fake_backends()
+    override_client('storage', backends.storage)
+    override_client('bigquery', backends.bigquery)
+    override_client('kms', backends.kms)
+    override_client('http', backends.storage.transport)
+    return backends
+
+
+def remove_fake_backends():
+    """
+    Restores the real clients and forgets the KMS, bucket, object and config
+    caches filled through the fakes
+    """
+
+    clear_clients()
+    invalidate_kms_cache()
+    invalidate_bucket_cache()
+    invalidate_object_cache()
+    clear_config_cache()
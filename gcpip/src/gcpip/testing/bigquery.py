@@ -0,0 +1,484 @@
+import csv
+import fnmatch
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from google.cloud import bigquery
+from google.cloud.bigquery.table import Row
+from gcpip.testing.latency import Latency
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS _datasets (
+    project TEXT NOT NULL,
+    dataset_id TEXT NOT NULL,
+    PRIMARY KEY (project, dataset_id)
+);
+CREATE TABLE IF NOT EXISTS _tables (
+    project TEXT NOT NULL,
+    dataset_id TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    schema TEXT NOT NULL,
+    view_query TEXT,
+    PRIMARY KEY (project, dataset_id, table_id)
+);
+'''
+
+# SQLite column affinity of BigQuery types, other types are stored as text
+_SQLITE_TYPES = {
+    'INTEGER': 'INTEGER', 'INT64': 'INTEGER',
+    'FLOAT': 'REAL', 'FLOAT64': 'REAL', 'NUMERIC': 'REAL',
+    'BOOLEAN': 'INTEGER', 'BOOL': 'INTEGER',
+}
+
+_TRUE = ('true', 't', '1', 'yes', 'y')
+_FALSE = ('false', 'f', '0', 'no', 'n')
+
+
+def _quote(identifier):
+
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def _parse_value(value, field):
+    """
+    Converts a CSV field like a BigQuery load job. Empty fields are NULL.
+    """
+
+    if value == '':
+        if (field.mode or '').upper() == 'REQUIRED':
+            raise ValueError('Required field {} cannot be null'.format(
+                field.name))
+        return None
+    field_type = field.field_type.upper()
+    if _SQLITE_TYPES.get(field_type) == 'INTEGER' and \
+            field_type not in ('BOOLEAN', 'BOOL'):
+        return int(value)
+    if _SQLITE_TYPES.get(field_type) == 'REAL':
+        return float(value)
+    if field_type in ('BOOLEAN', 'BOOL'):
+        if value.lower() in _TRUE:
+            return True
+        if value.lower() in _FALSE:
+            return False
+        raise ValueError('Could not parse {!r} as BOOL for field {}'.format(
+            value, field.name))
+    return value
+
+
+class FakeLoadJob():
+    """
+    Finished load job of a FakeBigQueryClient. Jobs run when they are
+    submitted; a failed job loads no rows and raises its error from result,
+    like a BigQuery job.
+    """
+
+    job_type = 'load'
+
+    def __init__(self, job_id, source_uris, destination, error=None,
+                 output_rows=0, input_files=0, input_file_bytes=0,
+                 reason='invalid'):
+        self.job_id = job_id
+        self.source_uris = source_uris
+        self.destination = destination
+        self.output_rows = output_rows
+        self.input_files = input_files
+        self.input_file_bytes = input_file_bytes
+        self.state = 'DONE'
+        self.ended = time.time()
+        self.error_result = None
+        self.errors = None
+        if error is not None:
+            self.error_result = {'reason': reason, 'message': str(error)}
+            self.errors = [self.error_result]
+
+    def done(self, retry=None, timeout=None, reload=True):
+        return True
+
+    def running(self):
+        return False
+
+    def reload(self, client=None, retry=None, timeout=None):
+        pass
+
+    def exception(self, timeout=None):
+        if self.error_result is None:
+            return None
+        return BadRequest(self.error_result['message'], errors=self.errors)
+
+    def result(self, timeout=None, retry=None):
+        error = self.exception()
+        if error is not None:
+            raise error
+        return self
+
+
+class FakeBigQueryClient():
+    """
+    SQLite-backed stand-in for google.cloud.bigquery.Client, for running
+    gcpip offline in tests and benchmarks. Implements the calls made by
+    gcpip: datasets and tables (views are stored but not queried), and CSV
+    load jobs from GCS URIs read through a storage client, usually a
+    FakeStorageClient. Loads follow the BigQuery rules used by gcpip:
+    skip_leading_rows, write and create dispositions, REQUIRED fields,
+    typed columns, one * wildcard per URI, all-or-nothing jobs and
+    optionally a size limit per job. Loaded rows can be read back with
+    list_rows. Calls are counted per method in `calls`.
+
+    Args:
+        storage_client: Client reading the source files of load jobs
+        database (str, optional): SQLite database path. Defaults to memory.
+        project (str, optional): Project ID. Defaults to 'fake-project'.
+        latency (Latency, optional): Latency injected into every call.
+            Defaults to none.
+        max_load_bytes (int, optional): Bytes of source files a load job
+            takes, larger jobs fail with the quotaExceeded reason. Defaults
+            to no limit.
+    """
+
+    def __init__(self, storage_client, database=':memory:',
+                 project='fake-project', latency=None, max_load_bytes=None):
+        self.storage_client = storage_client
+        self.max_load_bytes = max_load_bytes
+        self.project = project
+        self.location = None
+        self.latency = latency or Latency()
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def _count(self, method, nbytes=0):
+        with self.lock:
+            self.calls[method] += 1
+        self.latency.wait(nbytes)
+
+    def _get_dataset_ref(self, dataset):
+        if isinstance(dataset, str):
+            return bigquery.DatasetReference.from_string(
+                dataset, default_project=self.project)
+        return getattr(dataset, 'reference', dataset)
+
+    def _get_table_ref(self, table):
+        if isinstance(table, str):
+            return bigquery.TableReference.from_string(
+                table, default_project=self.project)
+        return getattr(table, 'reference', table)
+
+    @staticmethod
+    def _get_data_table(table_ref):
+        return _quote('{}.{}.{}'.format(
+            table_ref.project, table_ref.dataset_id, table_ref.table_id))
+
+    def _dataset_exists(self, dataset_ref):
+        return self.connection.execute(
+            'SELECT 1 FROM _datasets WHERE project = ? AND dataset_id = ?',
+            (dataset_ref.project, dataset_ref.dataset_id)).fetchone() \
+            is not None
+
+    def _read_table(self, table_ref):
+        row = self.connection.execute(
+            'SELECT schema, view_query FROM _tables WHERE project = ? AND '
+            'dataset_id = ? AND table_id = ?',
+            (table_ref.project, table_ref.dataset_id,
+             table_ref.table_id)).fetchone()
+        if row is None:
+            raise NotFound('Not found: Table {}:{}.{}'.format(
+                table_ref.project, table_ref.dataset_id, table_ref.table_id))
+        schema = [bigquery.SchemaField(x['name'], x['type'], mode=x['mode'])
+                  for x in json.loads(row[0])]
+        table = bigquery.Table(table_ref, schema=schema)
+        if row[1] is not None:
+            table.view_query = row[1]
+        elif not schema:
+            table._properties['numRows'] = '0'
+        else:
+            table._properties['numRows'] = str(self.connection.execute(
+                'SELECT COUNT(*) FROM {}'.format(
+                    self._get_data_table(table_ref))).fetchone()[0])
+        return table
+
+    def _create_table(self, table_ref, schema, view_query=None):
+        self.connection.execute(
+            'INSERT INTO _tables (project, dataset_id, table_id, schema, '
+            'view_query) VALUES (?, ?, ?, ?, ?)',
+            (table_ref.project, table_ref.dataset_id, table_ref.table_id,
+             '[]', view_query))
+        if view_query is None and schema:
+            self._set_schema(table_ref, schema)
+
+    def _set_schema(self, table_ref, schema):
+        """
+        Sets the schema of a table without one and creates its data table
+        """
+        self.connection.execute(
+            'UPDATE _tables SET schema = ? WHERE project = ? AND '
+            'dataset_id = ? AND table_id = ?',
+            (json.dumps([{'name': x.name, 'type': x.field_type,
+                          'mode': x.mode} for x in schema]),
+             table_ref.project, table_ref.dataset_id, table_ref.table_id))
+        columns = ', '.join('{} {}'.format(
+            _quote(x.name), _SQLITE_TYPES.get(x.field_type.upper(), 'TEXT'))
+            for x in schema)
+        self.connection.execute('CREATE TABLE {} ({})'.format(
+            self._get_data_table(table_ref), columns))
+
+    def dataset(self, dataset_id, project=None):
+        return bigquery.DatasetReference(project or self.project, dataset_id)
+
+    def get_dataset(self, dataset_ref, retry=None, timeout=None):
+        self._count('datasets.get')
+        dataset_ref = self._get_dataset_ref(dataset_ref)
+        with self.lock:
+            if not self._dataset_exists(dataset_ref):
+                raise NotFound('Not found: Dataset {}:{}'.format(
+                    dataset_ref.project, dataset_ref.dataset_id))
+        return bigquery.Dataset(dataset_ref)
+
+    def create_dataset(self, dataset, exists_ok=False, retry=None,
+                       timeout=None):
+        self._count('datasets.insert')
+        dataset_ref = self._get_dataset_ref(dataset)
+        with self.lock, self.connection:
+            if self._dataset_exists(dataset_ref):
+                if exists_ok:
+                    return bigquery.Dataset(dataset_ref)
+                raise Conflict('Already Exists: Dataset {}:{}'.format(
+                    dataset_ref.project, dataset_ref.dataset_id))
+            self.connection.execute(
+                'INSERT INTO _datasets (project, dataset_id) VALUES (?, ?)',
+                (dataset_ref.project, dataset_ref.dataset_id))
+        return bigquery.Dataset(dataset_ref)
+
+    def delete_dataset(self, dataset, delete_contents=False, retry=None,
+                       timeout=None, not_found_ok=False):
+        self._count('datasets.delete')
+        dataset_ref = self._get_dataset_ref(dataset)
+        with self.lock, self.connection:
+            if not self._dataset_exists(dataset_ref):
+                if not_found_ok:
+                    return
+                raise NotFound('Not found: Dataset {}:{}'.format(
+                    dataset_ref.project, dataset_ref.dataset_id))
+            tables = [x.table_id for x in self._list_tables(dataset_ref)]
+            if tables and not delete_contents:
+                raise BadRequest('Dataset {}:{} is still in use'.format(
+                    dataset_ref.project, dataset_ref.dataset_id))
+            for table_id in tables:
+                self._delete_table(dataset_ref.table(table_id))
+            self.connection.execute(
+                'DELETE FROM _datasets WHERE project = ? AND dataset_id = ?',
+                (dataset_ref.project, dataset_ref.dataset_id))
+
+    def list_datasets(self, project=None, retry=None, timeout=None):
+        self._count('datasets.list')
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT dataset_id FROM _datasets WHERE project = ? '
+                'ORDER BY dataset_id', (project or self.project,)).fetchall()
+        return [bigquery.Dataset(self.dataset(x[0], project))
+                for x in rows]
+
+    def _list_tables(self, dataset_ref):
+        rows = self.connection.execute(
+            'SELECT table_id FROM _tables WHERE project = ? AND '
+            'dataset_id = ? ORDER BY table_id',
+            (dataset_ref.project, dataset_ref.dataset_id)).fetchall()
+        return [bigquery.Table(dataset_ref.table(x[0])) for x in rows]
+
+    def list_tables(self, dataset, retry=None, timeout=None):
+        self._count('tables.list')
+        dataset_ref = self._get_dataset_ref(dataset)
+        with self.lock:
+            if not self._dataset_exists(dataset_ref):
+                raise NotFound('Not found: Dataset {}:{}'.format(
+                    dataset_ref.project, dataset_ref.dataset_id))
+            return self._list_tables(dataset_ref)
+
+    def create_table(self, table, exists_ok=False, retry=None,
+                     timeout=None):
+        self._count('tables.insert')
+        if not isinstance(table, bigquery.Table):
+            table = bigquery.Table(self._get_table_ref(table))
+        table_ref = table.reference
+        with self.lock, self.connection:
+            if not self._dataset_exists(self.dataset(table_ref.dataset_id,
+                                                     table_ref.project)):
+                raise NotFound('Not found: Dataset {}:{}'.format(
+                    table_ref.project, table_ref.dataset_id))
+            try:
+                existing = self._read_table(table_ref)
+            except NotFound:
+                existing = None
+            if existing is not None:
+                if exists_ok:
+                    return existing
+                raise Conflict('Already Exists: Table {}:{}.{}'.format(
+                    table_ref.project, table_ref.dataset_id,
+                    table_ref.table_id))
+            self._create_table(table_ref, table.schema, table.view_query)
+            return self._read_table(table_ref)
+
+    def get_table(self, table, retry=None, timeout=None):
+        self._count('tables.get')
+        with self.lock:
+            return self._read_table(self._get_table_ref(table))
+
+    def _delete_table(self, table_ref):
+        table = self._read_table(table_ref)
+        self.connection.execute(
+            'DELETE FROM _tables WHERE project = ? AND dataset_id = ? AND '
+            'table_id = ?', (table_ref.project, table_ref.dataset_id,
+                             table_ref.table_id))
+        if table.view_query is None:
+            self.connection.execute('DROP TABLE IF EXISTS {}'.format(
+                self._get_data_table(table_ref)))
+
+    def delete_table(self, table, retry=None, timeout=None,
+                     not_found_ok=False):
+        self._count('tables.delete')
+        with self.lock, self.connection:
+            try:
+                self._delete_table(self._get_table_ref(table))
+            except NotFound:
+                if not not_found_ok:
+                    raise
+
+    def list_rows(self, table, max_results=None, retry=None, timeout=None):
+        self._count('tabledata.list')
+        with self.lock:
+            table = self._read_table(self._get_table_ref(table))
+            if not table.schema:
+                return []
+            sql = 'SELECT * FROM {} ORDER BY rowid'.format(
+                self._get_data_table(table.reference))
+            if max_results is not None:
+                sql += ' LIMIT {:d}'.format(max_results)
+            rows = self.connection.execute(sql).fetchall()
+        field_to_index = {x.name: i for i, x in enumerate(table.schema)}
+        return [Row(x, field_to_index) for x in rows]
+
+    def _read_sources(self, source_uris):
+        """
+        Returns:
+            list[bytes]: contents of every file matched by the URIs
+        """
+        contents = []
+        for uri in source_uris:
+            if not uri.startswith('gs://'):
+                raise ValueError('Invalid source URI: {}'.format(uri))
+            bucket_name, _, name = uri[len('gs://'):].partition('/')
+            bucket = self.storage_client.bucket(bucket_name)
+            if '*' in name:
+                blobs = [x for x in bucket.list_blobs(
+                    prefix=name.split('*')[0])
+                    if fnmatch.fnmatchcase(x.name, name)]
+            else:
+                blobs = [bucket.blob(name)]
+            if not blobs:
+                raise NotFound('Not found: URI {}'.format(uri))
+            contents.extend(x.download_as_string() for x in blobs)
+        return contents
+
+    def _load_rows(self, table_ref, schema, contents, job_config):
+        skip_leading_rows = job_config.skip_leading_rows or 0
+        delimiter = job_config.field_delimiter or ','
+        rows = []
+        for data in contents:
+            reader = csv.reader(io.StringIO(data.decode('utf-8')),
+                                delimiter=delimiter)
+            for i, record in enumerate(reader):
+                if i < skip_leading_rows or not record:
+                    continue
+                if len(record) != len(schema):
+                    raise ValueError(
+                        'Row {} has {} columns, the table has {}'.format(
+                            i + 1, len(record), len(schema)))
+                rows.append([_parse_value(value, field)
+                             for value, field in zip(record, schema)])
+
+        self.connection.executemany('INSERT INTO {} VALUES ({})'.format(
+            self._get_data_table(table_ref), ', '.join('?' * len(schema))),
+            rows)
+        return len(rows)
+
+    def _get_autodetect_schema(self, contents, job_config):
+        delimiter = job_config.field_delimiter or ','
+        header = next(csv.reader(io.StringIO(
+            contents[0].decode('utf-8')), delimiter=delimiter))
+        if job_config.skip_leading_rows:
+            return [bigquery.SchemaField(x, 'STRING') for x in header]
+        return [bigquery.SchemaField('string_field_{}'.format(i), 'STRING')
+                for i in range(len(header))]
+
+    def load_table_from_uri(self, source_uris, destination, job_id=None,
+                            job_id_prefix=None, location=None, project=None,
+                            job_config=None, retry=None, timeout=None):
+        self._count('jobs.insert')
+        if isinstance(source_uris, str):
+            source_uris = [source_uris]
+        job_config = job_config or bigquery.LoadJobConfig()
+        table_ref = self._get_table_ref(destination)
+        job_id = job_id or '{}{}'.format(job_id_prefix or 'load_',
+                                         uuid.uuid4().hex)
+        logger.debug('Running fake load job {} into {}'.format(
+            job_id, table_ref))
+
+        output_rows, input_files, input_file_bytes = 0, 0, 0
+        try:
+            if (job_config.source_format or 'CSV') != 'CSV':
+                raise ValueError('Only CSV loads are supported')
+            contents = self._read_sources(source_uris)
+            input_files = len(contents)
+            input_file_bytes = sum(len(x) for x in contents)
+            if self.max_load_bytes is not None and \
+                    input_file_bytes > self.max_load_bytes:
+                return FakeLoadJob(
+                    job_id, source_uris, table_ref, reason='quotaExceeded',
+                    error='Load job of {} bytes exceeds the limit of {} '
+                    'bytes'.format(input_file_bytes, self.max_load_bytes))
+            with self.lock, self.connection:
+                try:
+                    table = self._read_table(table_ref)
+                except NotFound:
+                    if job_config.create_disposition == 'CREATE_NEVER':
+                        raise
+                    self._create_table(table_ref, None)
+                    table = self._read_table(table_ref)
+                if not table.schema:
+                    schema = job_config.schema or (
+                        self._get_autodetect_schema(contents, job_config)
+                        if job_config.autodetect else None)
+                    if not schema:
+                        raise ValueError('No schema specified on job or '
+                                         'table')
+                    self._set_schema(table_ref, schema)
+                    table = self._read_table(table_ref)
+                disposition = job_config.write_disposition or 'WRITE_APPEND'
+                if disposition == 'WRITE_EMPTY' and table.num_rows:
+                    raise ValueError('Already Exists: Table {} is not '
+                                     'empty'.format(table_ref.table_id))
+                if disposition == 'WRITE_TRUNCATE':
+                    self.connection.execute('DELETE FROM {}'.format(
+                        self._get_data_table(table_ref)))
+                output_rows = self._load_rows(table_ref, table.schema,
+                                              contents, job_config)
+        except (ValueError, NotFound) as error:
+            logger.debug('Fake load job {} failed: {}'.format(job_id, error))
+            return FakeLoadJob(job_id, source_uris, table_ref, error=error)
+
+        return FakeLoadJob(job_id, source_uris, table_ref,
+                           output_rows=output_rows, input_files=input_files,
+                           input_file_bytes=input_file_bytes)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, NotFound
+from gcpip.testing.latency import Latency
+
+logger = logging.getLogger(__name__)
+
+_NONCE_SIZE = 12
+
+
+class FakeKmsClient():
+    """
+    In-memory stand-in for kms_v1.KeyManagementServiceClient, for running
+    encryption code offline in tests and benchmarks. Implements the calls
+    made by gcpip: resource paths, key ring and key lookup, creation and
+    listing, encrypt and decrypt. Each crypto key wraps data with its own
+    random AES-256-GCM key, so ciphertext only decrypts under the key that
+    produced it. Calls are counted per method in `calls`.
+
+    Args:
+        key_rings (iterable, optional): Key ring resource names to create
+        crypto_keys (iterable, optional): Crypto key resource names to
+            create, their key rings are created as well
+        latency (Latency, optional): Latency injected into every call.
+            Defaults to none.
+    """
+
+    def __init__(self, key_rings=(), crypto_keys=(), latency=None):
+        self.key_rings = set()
+        self.crypto_keys = {}
+        self.calls = Counter()
+        self.latency = latency or Latency()
+        self.lock = threading.Lock()
+        for name in key_rings:
+            self.key_rings.add(name)
+        for name in crypto_keys:
+            self.key_rings.add(name.split('/cryptoKeys/')[0])
+            self.crypto_keys[name] = AESGCM.generate_key(bit_length=256)
+
+    @staticmethod
+    def location_path(project, location):
+        return 'projects/{}/locations/{}'.format(project, location)
+
+    @staticmethod
+    def key_ring_path(project, location, key_ring):
+        return 'projects/{}/locations/{}/keyRings/{}'.format(
+            project, location, key_ring)
+
+    @staticmethod
+    def crypto_key_path(project, location, key_ring, crypto_key):
+        return 'projects/{}/locations/{}/keyRings/{}/cryptoKeys/{}'.format(
+            project, location, key_ring, crypto_key)
+
+    def _count(self, method):
+        with self.lock:
+            self.calls[method] += 1
+        self.latency.wait()
+
+    def get_key_ring(self, name):
+        self._count('get_key_ring')
+        if name not in self.key_rings:
+            raise NotFound('KeyRing {} not found.'.format(name))
+        return SimpleNamespace(name=name)
+
+    def get_crypto_key(self, name):
+        self._count('get_crypto_key')
+        if name not in self.crypto_keys:
+            raise NotFound('CryptoKey {} not found.'.format(name))
+        return SimpleNamespace(name=name)
+
+    def create_key_ring(self, parent, key_ring_id, key_ring=None):
+        self._count('create_key_ring')
+        name = '{}/keyRings/{}'.format(parent, key_ring_id)
+        with self.lock:
+            if name in self.key_rings:
+                raise AlreadyExists('KeyRing {} already exists.'.format(name))
+            self.key_rings.add(name)
+        return SimpleNamespace(name=name)
+
+    def create_crypto_key(self, parent, crypto_key_id, crypto_key=None,
+                          skip_initial_version_creation=False):
+        self._count('create_crypto_key')
+        name = '{}/cryptoKeys/{}'.format(parent, crypto_key_id)
+        with self.lock:
+            if parent not in self.key_rings:
+                raise NotFound('KeyRing {} not found.'.format(parent))
+            if name in self.crypto_keys:
+                raise AlreadyExists(
+                    'CryptoKey {} already exists.'.format(name))
+            self.crypto_keys[name] = AESGCM.generate_key(bit_length=256)
+        return SimpleNamespace(name=name)
+
+    def list_key_rings(self, parent):
+        self._count('list_key_rings')
+        return [SimpleNamespace(name=x) for x in sorted(self.key_rings)
+                if x.startswith(parent + '/keyRings/')]
+
+    def list_crypto_keys(self, parent):
+        self._count('list_crypto_keys')
+        return [SimpleNamespace(name=x) for x in sorted(self.crypto_keys)
+                if x.startswith(parent + '/cryptoKeys/')]
+
+    def _get_key(self, name):
+        key = self.crypto_keys.get(name)
+        if key is None:
+            raise NotFound('CryptoKey {} not found.'.format(name))
+        return AESGCM(key)
+
+    def encrypt(self, name, plaintext):
+        self._count('encrypt')
+        nonce = os.urandom(_NONCE_SIZE)
+        ciphertext = self._get_key(name).encrypt(
+            nonce, bytes(plaintext), name.encode('utf-8'))
+        return SimpleNamespace(name=name, ciphertext=nonce + ciphertext)
+
+    def decrypt(self, name, ciphertext):
+        self._count('decrypt')
+        try:
+            plaintext = self._get_key(name).decrypt(
+                ciphertext[:_NONCE_SIZE], ciphertext[_NONCE_SIZE:],
+                name.encode('utf-8'))
+        except InvalidTag:
+            raise InvalidArgument('Decryption failed: the ciphertext is '
+                                  'invalid.')
+        return SimpleNamespace(plaintext=plaintext)
@@ -0,0 +1,49 @@
+import random
+import threading
+import time
+
+
+class Latency():
+    """
+    Injected latency of a fake backend. Every API call sleeps for a fixed
+    round trip plus uniform jitter, and calls moving data also sleep for the
+    transfer time at the given bandwidth. Jitter comes from a seeded random
+    generator, so runs with the same calls in the same order are
+    reproducible.
+
+    Args:
+        seconds (float, optional): Round trip of every call. Defaults to 0.
+        jitter (float, optional): Maximum extra seconds added to a call.
+            Defaults to 0.
+        bandwidth_mbps (float, optional): Transfer rate in MB/s for calls
+            moving data. Defaults to unlimited.
+        seed (int, optional): Seed of the jitter generator
+    """
+
+    def __init__(self, seconds=0.0, jitter=0.0, bandwidth_mbps=None, seed=0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.bandwidth_mbps = bandwidth_mbps
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def get_delay(self, nbytes=0):
+        """
+        Args:
+            nbytes (int, optional): Bytes moved by the call
+
+        Returns:
+            float: seconds the call should take
+        """
+        delay = self.seconds
+        if self.jitter:
+            with self.lock:
+                delay += self.random.uniform(0, self.jitter)
+        if self.bandwidth_mbps and nbytes:
+            delay += nbytes / (self.bandwidth_mbps * 1e6)
+        return delay
+
+    def wait(self, nbytes=0):
+        delay = self.get_delay(nbytes)
+        if delay > 0:
+            time.sleep(delay)
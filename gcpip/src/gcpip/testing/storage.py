@@ -0,0 +1,600 @@
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import Parser
+from http import HTTPStatus
+from urllib.parse import quote, unquote, urlparse
+import requests
+from google.api_core.exceptions import (
+    BadRequest, Conflict, GoogleAPICallError, NotFound)
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from gcpip.testing.latency import Latency
+from gcpip.utils.checksums import google_crc32c
+
+logger = logging.getLogger(__name__)
+
+_COPY_SIZE = 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r'bytes (?:\*|(\d+)-(\d+))/(\*|\d+)$')
+_BATCH_BOUNDARY = 'batch_fake'
+
+
+def _get_digests(path):
+
+    md5 = hashlib.md5()
+    crc32c = google_crc32c.Checksum() if google_crc32c is not None else None
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_COPY_SIZE)
+            if not data:
+                break
+            md5.update(data)
+            if crc32c is not None:
+                crc32c.update(data)
+    return {
+        'md5_hash': base64.b64encode(md5.digest()).decode('ascii'),
+        'crc32c': base64.b64encode(crc32c.digest()).decode('ascii')
+        if crc32c is not None else None,
+    }
+
+
+class FakeStorageClient(storage.Client):
+    """
+    Filesystem-backed google.cloud.storage.Client, for running gcpip
+    offline in tests and benchmarks. Implements the calls made by
+    gcpip: bucket handles, bucket creation, lookup, listing and deletion,
+    and blob uploads from files, strings and streams, full and ranged
+    downloads, metadata patches, compose and deletion. Blobs get
+    generations, MD5 (except composed blobs) and CRC32C digests like in GCS,
+    and gzip encoded blobs are decompressed unless downloaded raw.
+
+    Each bucket is a directory under root holding the blob contents and
+    their properties as JSON. Resumable upload sessions and JSON batch
+    requests are served by the fake HTTP transport in `transport`, which
+    is the HTTP session of the client and is given to gcpip in place of an
+    authorized session, so batches and library blob handles go through the
+    storage library like against GCS. Calls are counted per method in
+    `calls`.
+
+    Args:
+        root (str): Directory holding the buckets
+        project (str, optional): Project ID. Defaults to 'fake-project'.
+        latency (Latency, optional): Latency injected into every call.
+            Defaults to none.
+    """
+
+    def __init__(self, root, project='fake-project', latency=None):
+        self.root = root
+        self.latency = latency or Latency()
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.transport = FakeHttpTransport(self)
+        super().__init__(project=project,
+                         credentials=AnonymousCredentials(),
+                         _http=self.transport)
+        os.makedirs(root, exist_ok=True)
+
+    def _count(self, method, nbytes=0):
+        with self.lock:
+            self.calls[method] += 1
+        self.latency.wait(nbytes)
+
+    def _get_bucket_dir(self, bucket_name):
+        return os.path.join(self.root, quote(bucket_name, safe=''))
+
+    def bucket(self, bucket_name, user_project=None):
+        return FakeBucket(self, bucket_name)
+
+    def get_bucket(self, bucket_or_name, timeout=None):
+        bucket = self.bucket(getattr(bucket_or_name, 'name', bucket_or_name))
+        bucket.reload()
+        return bucket
+
+    def lookup_bucket(self, bucket_name, timeout=None):
+        try:
+            return self.get_bucket(bucket_name)
+        except NotFound:
+            return None
+
+    def create_bucket(self, bucket_or_name, requester_pays=None,
+                      project=None, user_project=None, location=None,
+                      timeout=None):
+        self._count('buckets.insert')
+        bucket = self.bucket(getattr(bucket_or_name, 'name', bucket_or_name))
+        path = self._get_bucket_dir(bucket.name)
+        try:
+            os.makedirs(os.path.join(path, 'data'))
+        except FileExistsError:
+            raise Conflict('Bucket {} already exists'.format(bucket.name))
+        os.makedirs(os.path.join(path, 'meta'))
+        with open(os.path.join(path, 'bucket.json'), 'w') as f:
+            json.dump({'location': location or 'US'}, f)
+        bucket.location = location or 'US'
+        return bucket
+
+    def list_buckets(self, project=None, prefix=None):
+        self._count('buckets.list')
+        names = sorted(unquote(x) for x in os.listdir(self.root))
+        return [self.bucket(x) for x in names
+                if prefix is None or x.startswith(prefix)]
+
+    def list_blobs(self, bucket_or_name, prefix=None, max_results=None,
+                   timeout=None):
+        bucket = self.bucket(getattr(bucket_or_name, 'name', bucket_or_name))
+        return bucket.list_blobs(prefix=prefix, max_results=max_results)
+
+    def download_blob_to_file(self, blob_or_uri, file_obj, start=None,
+                              end=None, raw_download=False, timeout=None,
+                              checksum='md5'):
+        blob_or_uri.download_to_file(file_obj, start=start, end=end,
+                                     raw_download=raw_download)
+
+    def expire_session(self, session_url):
+        """
+        Drops a resumable upload session, like GCS does a week after it was
+        created. Requests to it are then answered with 404.
+        """
+        with self.lock:
+            session = self.sessions.pop(session_url)
+        if os.path.exists(session['temp_path']):
+            os.remove(session['temp_path'])
+
+
+class FakeHttpTransport():
+    """
+    HTTP transport of a FakeStorageClient. It answers the PUT requests of the
+    GCS resumable upload protocol: 308 with the committed Range while the
+    upload is incomplete, 200 once the last byte is committed and 404 for
+    unknown or expired sessions, counted as 'uploads.put'. It also answers
+    JSON batch requests of object gets, patches and deletions, counted as
+    'batch' and per object call, with the status of the API error of a
+    failed call.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _response(method, url, status_code, headers=None, body=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        response.raw = io.BytesIO(
+            b'' if body is None else json.dumps(body).encode('utf-8'))
+        response.request = requests.Request(method, url).prepare()
+        response.url = url
+        return response
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if method == 'POST' and urlparse(url).path == '/batch/storage/v1':
+            return self._batch(method, url, data, headers or {})
+        data = data or b''
+        self.client._count('uploads.put', len(data))
+        match = _CONTENT_RANGE.match((headers or {}).get('Content-Range', ''))
+        with self.client.lock:
+            session = self.client.sessions.get(url)
+        if method != 'PUT' or match is None:
+            return self._response(method, url, 400, body={'error': {
+                'message': 'Invalid resumable upload request'}})
+        if session is None:
+            return self._response(method, url, 404, body={'error': {
+                'message': 'No such upload session'}})
+        if session['finished']:
+            return self._response(method, url, 200)
+
+        start, end, total = match.groups()
+        total = None if total == '*' else int(total)
+        if start is not None:
+            start, end = int(start), int(end)
+            if start > session['committed'] or \
+                    end - start + 1 != len(data):
+                return self._response(method, url, 400, body={'error': {
+                    'message': 'Invalid Content-Range'}})
+            with open(session['temp_path'], 'ab') as f:
+                f.write(data[session['committed'] - start:])
+            session['committed'] = max(session['committed'], end + 1)
+
+        if total is not None and session['committed'] == total:
+            blob = session['bucket'].blob(session['name'])
+            blob.metadata = session['metadata']
+            blob.content_type = session['content_type']
+            blob.content_encoding = session['content_encoding']
+            blob._write(session['temp_path'])
+            session['finished'] = True
+            return self._response(method, url, 200, body={
+                'bucket': blob.bucket.name, 'name': blob.name,
+                'generation': str(blob.generation)})
+        if session['committed'] == 0:
+            return self._response(method, url, 308)
+        return self._response(method, url, 308, headers={
+            'Range': 'bytes=0-{}'.format(session['committed'] - 1)})
+
+    def _run_subrequest(self, method, uri, body):
+        """
+        Returns:
+            tuple: HTTP status line and JSON body of one batched request
+        """
+        path = urlparse(uri).path
+        bucket_name, blob_name = path.split('/b/', 1)[1].split('/o/', 1)
+        blob = self.client.bucket(unquote(bucket_name)).blob(
+            unquote(blob_name))
+        try:
+            if method == 'DELETE':
+                blob.delete()
+                return '204 No Content', None
+            if method == 'PATCH':
+                blob.metadata = json.loads(body).get('metadata')
+                blob.patch()
+            elif method == 'GET':
+                blob.reload()
+            else:
+                return '405 Method Not Allowed', {'error': {
+                    'code': 405, 'message': 'Not supported by the fake'}}
+        except GoogleAPICallError as error:
+            return '{} {}'.format(
+                error.code, HTTPStatus(error.code).phrase), {'error': {
+                    'code': error.code, 'message': error.message}}
+        return '200 OK', {
+            'bucket': blob.bucket.name, 'name': blob.name,
+            'generation': str(blob.generation), 'size': str(blob.size),
+            'metadata': blob.metadata}
+
+    def _batch(self, method, url, data, headers):
+        self.client._count('batch')
+        content_type = {k.lower(): v for k, v in headers.items()}[
+            'content-type']
+        message = Parser().parsestr(
+            'Content-Type: {}\n\n{}'.format(content_type, data))
+        parts = []
+        for i, subrequest in enumerate(message.get_payload()):
+            request_line, rest = subrequest.get_payload().split('\n', 1)
+            sub_method, uri, _ = request_line.split(' ')
+            body = rest.split('\n\n', 1)[1] if '\n\n' in rest else ''
+            status, payload = self._run_subrequest(sub_method, uri, body)
+            parts.append(
+                '--{}\nContent-Type: application/http\n'
+                'Content-ID: <response-{}>\n\nHTTP/1.1 {}\n'
+                'Content-Type: application/json\n\n{}\n'.format(
+                    _BATCH_BOUNDARY, i, status,
+                    '' if payload is None else json.dumps(payload)))
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['content-type'] = \
+            'multipart/mixed; boundary={}'.format(_BATCH_BOUNDARY)
+        response.raw = io.BytesIO(
+            (''.join(parts) + '--{}--\n'.format(_BATCH_BOUNDARY))
+            .encode('utf-8'))
+        response.request = requests.Request(method, url).prepare()
+        return response
+
+
+class FakeBucket():
+    """
+    Bucket of a FakeStorageClient. Creating it makes no call, like a
+    handle from storage.Client.bucket.
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = client._get_bucket_dir(name)
+        self.location = None
+
+    def _check_exists(self):
+        if not os.path.isdir(self.path):
+            raise NotFound('Bucket {} not found'.format(self.name))
+
+    def _get_paths(self, blob_name):
+        name = quote(blob_name, safe='')
+        return (os.path.join(self.path, 'data', name),
+                os.path.join(self.path, 'meta', name + '.json'))
+
+    def exists(self):
+        self.client._count('buckets.get')
+        return os.path.isdir(self.path)
+
+    def reload(self):
+        self.client._count('buckets.get')
+        self._check_exists()
+        with open(os.path.join(self.path, 'bucket.json')) as f:
+            self.location = json.load(f)['location']
+
+    def delete(self, force=False):
+        self.client._count('buckets.delete')
+        self._check_exists()
+        if os.listdir(os.path.join(self.path, 'meta')) and not force:
+            raise Conflict('Bucket {} is not empty'.format(self.name))
+        shutil.rmtree(self.path)
+
+    def blob(self, blob_name, chunk_size=None, encryption_key=None,
+             kms_key_name=None, generation=None):
+        return FakeBlob(blob_name, self, chunk_size=chunk_size,
+                        generation=generation)
+
+    def get_blob(self, blob_name, generation=None, **kwargs):
+        blob = self.blob(blob_name, generation=generation)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob
+
+    def list_blobs(self, prefix=None, max_results=None, **kwargs):
+        self.client._count('objects.list')
+        self._check_exists()
+        names = sorted(unquote(x[:-len('.json')])
+                       for x in os.listdir(os.path.join(self.path, 'meta'))
+                       if x.endswith('.json'))
+        blobs = []
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            blob = self.blob(name)
+            try:
+                blob._load()
+            except NotFound:
+                # Deleted while listing
+                continue
+            blobs.append(blob)
+            if max_results is not None and len(blobs) == max_results:
+                break
+        return iter(blobs)
+
+    def delete_blob(self, blob_name, generation=None, **kwargs):
+        self.blob(blob_name, generation=generation).delete()
+
+
+class FakeBlob():
+    """
+    Blob of a FakeBucket. Properties are loaded by reload, get_blob and
+    list_blobs, and set by uploads.
+    """
+
+    def __init__(self, name, bucket, chunk_size=None, generation=None):
+        self.name = name
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.generation = generation
+        self.metadata = None
+        self.content_type = None
+        self.content_encoding = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.kms_key_name = None
+        self.updated = None
+        self.data_path, self.meta_path = bucket._get_paths(name)
+
+    @property
+    def client(self):
+        return self.bucket.client
+
+    @property
+    def path(self):
+        return '/b/{}/o/{}'.format(self.bucket.name, quote(self.name, safe=''))
+
+    def _read_properties(self):
+        try:
+            with open(self.meta_path) as f:
+                properties = json.load(f)
+        except FileNotFoundError:
+            raise NotFound('No such object: {}/{}'.format(
+                self.bucket.name, self.name))
+        if self.generation is not None and \
+                properties['generation'] != self.generation:
+            raise NotFound('No such object: {}/{}#{}'.format(
+                self.bucket.name, self.name, self.generation))
+        return properties
+
+    def _load(self):
+        for key, value in self._read_properties().items():
+            setattr(self, key, value)
+
+    def _write(self, temp_path, md5=True):
+        """
+        Publishes a fully written temp file as the new generation
+        """
+        self.bucket._check_exists()
+        properties = _get_digests(temp_path)
+        if not md5:
+            properties['md5_hash'] = None
+        properties.update({
+            'size': os.path.getsize(temp_path),
+            'generation': time.time_ns(),
+            'metadata': self.metadata,
+            'content_type': self.content_type,
+            'content_encoding': self.content_encoding,
+            'updated': time.time(),
+        })
+        meta_temp = self.meta_path + '.' + uuid.uuid4().hex
+        with open(meta_temp, 'w') as f:
+            json.dump(properties, f)
+        # Contents first: readers go through the properties file
+        with self.bucket.client.lock:
+            os.replace(temp_path, self.data_path)
+            os.replace(meta_temp, self.meta_path)
+        self.generation = None
+        self._load()
+
+    def _get_temp_path(self):
+        return self.data_path + '.' + uuid.uuid4().hex
+
+    def exists(self, client=None, **kwargs):
+        self.client._count('objects.get')
+        try:
+            self._read_properties()
+        except NotFound:
+            return False
+        return True
+
+    def reload(self, client=None, **kwargs):
+        self.client._count('objects.get')
+        self._load()
+
+    def patch(self, client=None, **kwargs):
+        self.client._count('objects.patch')
+        properties = self._read_properties()
+        metadata = dict(properties['metadata'] or {})
+        for key, value in (self.metadata or {}).items():
+            if value is None:
+                metadata.pop(key, None)
+            else:
+                metadata[key] = value
+        properties['metadata'] = metadata or None
+        with self.bucket.client.lock:
+            with open(self.meta_path, 'w') as f:
+                json.dump(properties, f)
+        self._load()
+
+    def delete(self, client=None, **kwargs):
+        self.client._count('objects.delete')
+        self._read_properties()
+        with self.bucket.client.lock:
+            try:
+                os.remove(self.meta_path)
+            except FileNotFoundError:
+                raise NotFound('No such object: {}/{}'.format(
+                    self.bucket.name, self.name))
+            os.remove(self.data_path)
+
+    def upload_from_file(self, file_obj, rewind=False, size=None,
+                         content_type=None, client=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        if content_type is not None:
+            self.content_type = content_type
+        temp_path = self._get_temp_path()
+        nbytes = 0
+        with open(temp_path, 'wb') as f:
+            while size is None or nbytes < size:
+                read_size = _COPY_SIZE if size is None else \
+                    min(_COPY_SIZE, size - nbytes)
+                data = file_obj.read(read_size)
+                if not data:
+                    break
+                f.write(data)
+                nbytes += len(data)
+        self.client._count('objects.insert', nbytes)
+        self._write(temp_path)
+
+    def upload_from_filename(self, filename, content_type=None, client=None,
+                             **kwargs):
+        # The library guesses the type of a file from its name
+        if content_type is None:
+            content_type = mimetypes.guess_type(filename)[0]
+        with open(filename, 'rb') as file_obj:
+            self.upload_from_file(file_obj, content_type=content_type)
+
+    def upload_from_string(self, data, content_type='text/plain',
+                           client=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.client._count('objects.insert', len(data))
+        temp_path = self._get_temp_path()
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self.content_type = content_type
+        self._write(temp_path)
+
+    def create_resumable_upload_session(self, content_type=None, size=None,
+                                        origin=None, client=None, **kwargs):
+        self.client._count('objects.insert')
+        self.bucket._check_exists()
+        session_url = (
+            'https://storage.googleapis.com/upload/storage/v1/b/{}/o'
+            '?uploadType=resumable&upload_id={}'.format(
+                quote(self.bucket.name, safe=''), uuid.uuid4().hex))
+        temp_path = self._get_temp_path()
+        open(temp_path, 'wb').close()
+        with self.client.lock:
+            self.client.sessions[session_url] = {
+                'bucket': self.bucket, 'name': self.name,
+                'metadata': self.metadata, 'content_type': content_type,
+                'content_encoding': self.content_encoding,
+                'temp_path': temp_path, 'committed': 0, 'finished': False}
+        return session_url
+
+    def compose(self, sources, client=None, **kwargs):
+        self.client._count('objects.compose')
+        if not 0 < len(sources) <= 32:
+            raise BadRequest('Compose takes 1 to 32 source objects, got '
+                             '{}'.format(len(sources)))
+        temp_path = self._get_temp_path()
+        with open(temp_path, 'wb') as f:
+            for source in sources:
+                source._read_properties()
+                with open(source.data_path, 'rb') as part:
+                    shutil.copyfileobj(part, f, _COPY_SIZE)
+        # Composite objects have no MD5 in GCS
+        self._write(temp_path, md5=False)
+
+    def _open(self):
+        """
+        Opens the contents of the requested or current generation
+        """
+        properties = self._read_properties()
+        f = open(self.data_path, 'rb')
+        # The contents may have been replaced after reading the properties
+        if os.fstat(f.fileno()).st_size != properties['size']:
+            f.close()
+            raise NotFound('Generation of {} changed'.format(self.name))
+        return f, properties
+
+    def download_to_file(self, file_obj, client=None, start=None, end=None,
+                         raw_download=False, checksum='md5', **kwargs):
+        f, properties = self._open()
+        with f:
+            if properties['content_encoding'] == 'gzip' and \
+                    not raw_download:
+                # Decompressive transcoding ignores ranges
+                data = gzip.decompress(f.read())
+                self.client._count('objects.get_media', len(data))
+                file_obj.write(data)
+                return
+            start = start or 0
+            end = properties['size'] - 1 if end is None else \
+                min(end, properties['size'] - 1)
+            remaining = end - start + 1
+            self.client._count('objects.get_media', max(remaining, 0))
+            f.seek(start)
+            while remaining > 0:
+                data = f.read(min(_COPY_SIZE, remaining))
+                if not data:
+                    break
+                file_obj.write(data)
+                remaining -= len(data)
+
+    def download_to_filename(self, filename, client=None, start=None,
+                             end=None, raw_download=False, **kwargs):
+        with open(filename, 'wb') as file_obj:
+            self.download_to_file(file_obj, start=start, end=end,
+                                  raw_download=raw_download)
+
+    def download_as_bytes(self, client=None, start=None, end=None,
+                          raw_download=False, **kwargs):
+        f, properties = self._open()
+        with f:
+            if properties['content_encoding'] == 'gzip' and \
+                    not raw_download:
+                data = gzip.decompress(f.read())
+            else:
+                start = start or 0
+                f.seek(start)
+                data = f.read() if end is None else f.read(end - start + 1)
+        self.client._count('objects.get_media', len(data))
+        return data
+
+    download_as_string = download_as_bytes
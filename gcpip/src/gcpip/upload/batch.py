@@ -0,0 +1,472 @@
+import fnmatch
+import glob
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from gcpip.upload.encryption import dek_cache
+from gcpip.utils.storage import get_bucket_handle, delete_blobs
+from gcpip.upload.defaults import DEFAULT_WORKERS, COMPOSITE_THRESHOLD
+from gcpip.upload.gcp_upload import (
+    upload_file, encrypt_upload_file, create_upload_session, decrypt_blob,
+    SKIPPED, SESSION_DEK_METADATA)
+
+logger = logging.getLogger(__name__)
+
+
+def is_batch_source(source, manifest=None):
+    """
+    Checks whether an upload source refers to more than a single file
+
+    Args:
+        source (str): Local file, directory or glob pattern
+        manifest (str, optional): Path to a manifest file
+
+    Returns:
+        bool: True for directories, glob patterns and manifests
+    """
+
+    return manifest is not None or os.path.isdir(source) \
+        or glob.has_magic(source)
+
+
+def read_manifest(manifest):
+    """
+    Reads local file paths from a manifest, one per line. Blank lines and
+    lines starting with # are ignored.
+
+    Args:
+        manifest (str): Path to the manifest file
+
+    Returns:
+        list[str]: Local file paths
+    """
+
+    with open(manifest) as file:
+        lines = [line.strip() for line in file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def resolve_sources(source=None, manifest=None):
+    """
+    Expands an upload source into local files and their names relative to
+    the source root. The relative names are appended to the destination
+    prefix when uploading.
+
+    Args:
+        source (str, optional): Local file, directory or glob pattern
+        manifest (str, optional): Path to a manifest file
+
+    Returns:
+        list[tuple]: (local path, relative name) pairs
+
+    Raises:
+        FileNotFoundError: if a directory, glob pattern or manifest holds
+            no files
+    """
+
+    if manifest is not None:
+        paths = read_manifest(manifest)
+    elif os.path.isdir(source):
+        paths = [os.path.join(root, name)
+                 for root, _, files in os.walk(source) for name in files]
+    elif glob.has_magic(source):
+        paths = [x for x in glob.glob(source, recursive=True)
+                 if os.path.isfile(x)]
+    else:
+        return [(source, os.path.basename(source))]
+
+    paths = sorted(set(os.path.normpath(x) for x in paths))
+    if not paths:
+        raise FileNotFoundError('No files to upload in {}'.format(
+            manifest if manifest is not None else source))
+
+    if os.path.isdir(source or ''):
+        root = source
+    else:
+        root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(x)) for x in paths])
+
+    return [(x, os.path.relpath(os.path.abspath(x), os.path.abspath(root))
+             .replace(os.sep, '/')) for x in paths]
+
+
+def get_destination_name(destination_prefix, relative_name):
+    """
+    Joins a destination prefix and a relative file name into a blob name
+
+    Args:
+        destination_prefix (str): Blob name prefix
+        relative_name (str): File name relative to the source root
+
+    Returns:
+        str: Blob name
+    """
+
+    if not destination_prefix:
+        return relative_name
+    return destination_prefix.rstrip('/') + '/' + relative_name
+
+
+def upload_one(storage_client, bucket_name, source_file_name,
+               destination_name, encrypt=False, kms_client=None,
+               project_id=None, location_id=None, key_ring_id=None,
+               key_id=None, streaming=False,
+               composite_threshold=COMPOSITE_THRESHOLD, session=None,
+               encryption_workers=1, compression=None, skip_unchanged=False,
+               journal=None, transport=None):
+    """
+    Uploads one file and records its timing. Errors are caught and reported
+    in the result so one failing file does not stop a batch.
+
+    Returns:
+        dict: source, destination, status ('uploaded', 'skipped' or
+            'failed'), bytes, seconds and error of the upload
+    """
+
+    result = {'source': source_file_name, 'destination': destination_name,
+              'status': 'failed', 'bytes': 0, 'seconds': 0.0, 'error': None}
+    start = time.perf_counter()
+    try:
+        result['bytes'] = os.path.getsize(source_file_name)
+        if encrypt:
+            result['status'] = encrypt_upload_file(
+                storage_client, kms_client, bucket_name, source_file_name,
+                destination_name, project_id, location_id, key_ring_id,
+                key_id, streaming=streaming,
+                composite_threshold=composite_threshold, session=session,
+                encryption_workers=encryption_workers,
+                compression=compression, skip_unchanged=skip_unchanged,
+                journal=journal, transport=transport)
+        else:
+            result['status'] = upload_file(
+                storage_client, bucket_name, source_file_name,
+                destination_name, composite_threshold=composite_threshold,
+                compression=compression, skip_unchanged=skip_unchanged,
+                journal=journal, transport=transport)
+    except Exception as error:
+        logger.error('Upload of {} failed: {}'.format(
+            source_file_name, error))
+        result['error'] = error
+    result['seconds'] = time.perf_counter() - start
+
+    if result['status'] == SKIPPED:
+        logger.info('Skipped {}: unchanged at {}'.format(
+            source_file_name, destination_name))
+    elif result['error'] is None:
+        logger.info('Uploaded {} to {}: {:.1f} MB in {:.2f}s ({:.1f} MB/s)'
+                    .format(source_file_name, destination_name,
+                            result['bytes'] / 1e6, result['seconds'],
+                            get_throughput(result['bytes'],
+                                           result['seconds'])))
+    return result
+
+
+def get_throughput(num_bytes, seconds):
+    """
+    Returns:
+        float: Throughput in MB/s
+    """
+
+    if seconds <= 0:
+        return 0.0
+    return num_bytes / 1e6 / seconds
+
+
+def upload_files(storage_client, bucket_name, sources, destination_prefix,
+                 workers=DEFAULT_WORKERS, encrypt=False, kms_client=None,
+                 project_id=None, location_id=None, key_ring_id=None,
+                 key_id=None, streaming=False,
+                 composite_threshold=COMPOSITE_THRESHOLD, session_keys=False,
+                 encryption_workers=1, compression=None,
+                 skip_unchanged=False, journal=None, transport=None):
+    """
+    Uploads many files concurrently on a bounded thread pool sharing one
+    storage client (and KMS client for encrypted uploads).
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        bucket_name (str): Name of bucket to upload files into
+        sources (list[tuple]): (local path, relative name) pairs, see
+            resolve_sources
+        destination_prefix (str): Blob name prefix for uploaded files
+        workers (int, optional): Number of concurrent uploads.
+            Defaults to DEFAULT_WORKERS.
+        encrypt (bool, optional): Encrypt files before upload.
+        kms_client (kms_v1.KeyManagementServiceClient, optional): KMS client,
+            required for encrypted uploads
+        project_id (str, optional): Name of GCP project
+        location_id (str, optional): KMS key location
+        key_ring_id (str, optional): KMS key ring ID
+        key_id (str, optional): KMS key ID
+        streaming (bool, optional): Stream encrypted uploads
+        composite_threshold (int, optional): Size in bytes from which files
+            are sent as parallel composite uploads. None disables them.
+        session_keys (bool, optional): Encrypt every file with a key derived
+            from one KMS-wrapped session key, so the batch costs a single
+            KMS call instead of one per file.
+        encryption_workers (int, optional): Segments sealed concurrently
+            for each encrypted file.
+        compression (str, optional): Compress files before upload, 'gzip'
+            or 'zstd'. Plain uploads only support gzip.
+        skip_unchanged (bool, optional): Skip files whose blob already holds
+            the same content, compared by checksum.
+        journal (UploadJournal, optional): Journal making each upload
+            resumable. Files it records as complete are skipped.
+        transport (requests.Session, optional): Authorized HTTP transport
+            of journaled uploads, e.g. from get_http_session. Required with
+            journal.
+
+    Returns:
+        dict: per file results and aggregate counts, bytes and throughput.
+            Skipped files are not counted in bytes and throughput.
+    """
+
+    logger.info('Uploading {} files to bucket: {} with {} workers'.format(
+        len(sources), bucket_name, workers))
+
+    start = time.perf_counter()
+    session = None
+    if encrypt and session_keys:
+        session = create_upload_session(
+            storage_client, kms_client, bucket_name, destination_prefix,
+            project_id, location_id, key_ring_id, key_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                upload_one, storage_client, bucket_name, source,
+                get_destination_name(destination_prefix, relative_name),
+                encrypt=encrypt, kms_client=kms_client,
+                project_id=project_id, location_id=location_id,
+                key_ring_id=key_ring_id, key_id=key_id, streaming=streaming,
+                composite_threshold=composite_threshold, session=session,
+                encryption_workers=encryption_workers,
+                compression=compression, skip_unchanged=skip_unchanged,
+                journal=journal, transport=transport)
+            for source, relative_name in sources]
+        results = [x.result() for x in futures]
+    elapsed = time.perf_counter() - start
+
+    uploaded = [x for x in results if x['status'] == 'uploaded']
+    summary = {
+        'files': results,
+        'uploaded': len(uploaded),
+        'skipped': sum(x['status'] == SKIPPED for x in results),
+        'failed': sum(x['error'] is not None for x in results),
+        'bytes': sum(x['bytes'] for x in uploaded),
+        'seconds': elapsed,
+    }
+    summary['throughput'] = get_throughput(summary['bytes'], elapsed)
+
+    logger.info('Uploaded {} files ({} skipped, {} failed): {:.1f} MB in '
+                '{:.2f}s ({:.1f} MB/s aggregate)'.format(
+                    summary['uploaded'], summary['skipped'],
+                    summary['failed'],
+                    summary['bytes'] / 1e6, elapsed,
+                    summary['throughput']))
+
+    return summary
+
+
+def is_batch_blob_source(source):
+    """
+    Checks whether a decryption source refers to more than a single blob
+
+    Args:
+        source (str): Blob path, prefix ending with / or glob pattern
+
+    Returns:
+        bool: True for prefixes and glob patterns
+    """
+
+    return source.endswith('/') or glob.has_magic(source)
+
+
+def get_listing_prefix(source):
+    """
+    Returns:
+        str: Longest blob name prefix before any glob character of source
+    """
+
+    for i, char in enumerate(source):
+        if char in '*?[':
+            return source[:i]
+    return source
+
+
+def pair_encrypted_blobs(blobs, source):
+    """
+    Selects the encrypted blobs matching a prefix or glob pattern and checks
+    that each has its data encryption key, either a .dek sibling or a session
+    key named in its metadata.
+
+    Args:
+        blobs (iterable[storage.Blob]): Blobs listed under the source prefix
+        source (str): Blob prefix ending with / or glob pattern
+
+    Returns:
+        tuple: list of encrypted blobs with a key, and a dict mapping the
+            names of blobs without one to an error message
+    """
+
+    blobs = list(blobs)
+    names = set(x.name for x in blobs)
+
+    paired, missing = [], {}
+    for blob in blobs:
+        if not blob.name.endswith('.encrypted'):
+            continue
+        if glob.has_magic(source) and not fnmatch.fnmatchcase(
+                blob.name, source):
+            continue
+        dek_name = blob.name[:-len('.encrypted')] + '.dek'
+        if SESSION_DEK_METADATA in (blob.metadata or {}) or \
+                dek_name in names:
+            paired.append(blob)
+        else:
+            missing[blob.name] = 'Missing DEK blob: {}'.format(dek_name)
+    return paired, missing
+
+
+def decrypt_one(storage_client, kms_client, bucket_name, blob, project_id,
+                location_id, key_ring_id, key_id, streaming=False,
+                temp_data='temp_dir'):
+    """
+    Decrypts one blob and records its timing. Errors are caught and reported
+    in the result so one failing blob does not stop a batch. Each blob gets
+    its own temp directory, blobs with the same file name in different
+    folders can be decrypted concurrently. The encrypted blobs are not
+    deleted, their names are returned for a batched deletion.
+
+    Returns:
+        dict: blob, bytes, seconds, error and obsolete blobs of the
+            decryption
+    """
+
+    result = {'blob': blob.name, 'bytes': blob.size or 0, 'seconds': 0.0,
+              'error': None, 'obsolete': []}
+    blob_temp_data = os.path.join(temp_data, uuid.uuid4().hex)
+    start = time.perf_counter()
+    try:
+        result['obsolete'] = decrypt_blob(
+            storage_client, kms_client, bucket_name, blob.name, project_id,
+            location_id, key_ring_id, key_id, temp_data=blob_temp_data,
+            streaming=streaming, delete=False, blob=blob)
+    except Exception as error:
+        logger.error('Decryption of {} failed: {}'.format(blob.name, error))
+        result['error'] = error
+    finally:
+        shutil.rmtree(blob_temp_data, ignore_errors=True)
+    result['seconds'] = time.perf_counter() - start
+
+    if result['error'] is None:
+        logger.info('Decrypted {}: {:.1f} MB in {:.2f}s ({:.1f} MB/s)'.format(
+            blob.name, result['bytes'] / 1e6, result['seconds'],
+            get_throughput(result['bytes'], result['seconds'])))
+    return result
+
+
+def delete_obsolete_blobs(storage_client, bucket_name, results):
+    """
+    Deletes the blobs made obsolete by successful decryptions in batch
+    requests. A decryption whose encrypted blobs could not be deleted is
+    marked as failed.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        bucket_name (str): Name of bucket containing the blobs
+        results (list[dict]): Results from decrypt_one, updated in place
+    """
+
+    owners = {}
+    for result in results:
+        if result['error'] is None:
+            for name in result['obsolete']:
+                owners[name] = result
+
+    for deletion in delete_blobs(storage_client, bucket_name, list(owners)):
+        result = owners[deletion['blob']]
+        if deletion['error'] is not None and result['error'] is None:
+            logger.error('Deleting {} failed: {}'.format(
+                deletion['blob'], deletion['error']))
+            result['error'] = deletion['error']
+
+
+def decrypt_blobs(storage_client, kms_client, bucket_name, source,
+                  project_id, location_id, key_ring_id, key_id,
+                  workers=DEFAULT_WORKERS, streaming=False,
+                  temp_data='temp_dir'):
+    """
+    Decrypts every encrypted blob under a prefix or matching a glob pattern
+    concurrently on a bounded thread pool sharing one storage and KMS client.
+    The encrypted and DEK blobs of decrypted blobs are then removed with
+    batched deletions.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        kms_client (kms_v1.KeyManagementServiceClient): GCP KMS client object
+        bucket_name (str): Name of bucket containing the blobs
+        source (str): Blob prefix ending with / or glob pattern, for example
+            "landing/2020-*/*.encrypted"
+        project_id (str): Name of GCP project
+        location_id (str): KMS key location
+        key_ring_id (str): KMS key ring ID
+        key_id (str): KMS key ID
+        workers (int, optional): Number of concurrent decryptions.
+            Defaults to DEFAULT_WORKERS.
+        streaming (bool, optional): Decrypt without local temp files
+        temp_data (str, optional): Local directory for temporary files
+
+    Returns:
+        dict: per blob results, aggregate counts, bytes, throughput and DEK
+            cache statistics
+    """
+
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blobs, missing = pair_encrypted_blobs(
+        bucket.list_blobs(prefix=get_listing_prefix(source)), source)
+
+    logger.info('Decrypting {} blobs in bucket: {} with {} workers'.format(
+        len(blobs), bucket_name, workers))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                decrypt_one, storage_client, kms_client, bucket_name, blob,
+                project_id, location_id, key_ring_id, key_id,
+                streaming=streaming, temp_data=temp_data)
+            for blob in blobs]
+        results = [x.result() for x in futures]
+    delete_obsolete_blobs(storage_client, bucket_name, results)
+    elapsed = time.perf_counter() - start
+
+    for name, error in sorted(missing.items()):
+        logger.error('Skipping {}: {}'.format(name, error))
+        results.append({'blob': name, 'bytes': 0, 'seconds': 0.0,
+                        'error': error, 'obsolete': []})
+
+    decrypted = [x for x in results if x['error'] is None]
+    summary = {
+        'blobs': results,
+        'decrypted': len(decrypted),
+        'failed': len(results) - len(decrypted),
+        'bytes': sum(x['bytes'] for x in decrypted),
+        'seconds': elapsed,
+        'dek_cache': dek_cache.get_stats(),
+    }
+    summary['throughput'] = get_throughput(summary['bytes'], elapsed)
+
+    logger.info('Decrypted {} blobs ({} failed): {:.1f} MB in {:.2f}s '
+                '({:.1f} MB/s aggregate), DEK cache hit rate {:.0%}'.format(
+                    summary['decrypted'], summary['failed'],
+                    summary['bytes'] / 1e6, elapsed, summary['throughput'],
+                    summary['dek_cache']['hit_rate']))
+    for result in results:
+        if result['error'] is not None:
+            logger.error('  {}: {}'.format(result['blob'], result['error']))
+
+    return summary
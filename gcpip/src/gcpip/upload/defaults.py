@@ -0,0 +1,12 @@
+# Defaults of the upload and decrypt commands, kept apart from the upload
+# modules so the runner builds its parser without importing cryptography
+# and the compression libraries for the commands that do not need them.
+
+# Files uploaded or blobs decrypted at once in batches
+DEFAULT_WORKERS = 8
+
+# Files at least this large are uploaded as parallel composite uploads
+COMPOSITE_THRESHOLD = 256 * 1024 * 1024
+
+# Compressions applied before upload
+COMPRESSIONS = ('gzip', 'zstd')
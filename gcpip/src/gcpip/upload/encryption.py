@@ -1,10 +1,160 @@
 # https://nitratine.net/blog/post/encryption-and-decryption-in-python/
+import base64
+import hashlib
+import io
 import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from gcpip.utils.compression import compress_stream, decompress_stream
 from gcpip.utils.encryption import get_kms_key_path
+from gcpip.utils.streams import IteratorReader
 
 logger = logging.getLogger(__name__)
 
+# Chunked file format: a fixed header followed by framed segments, each one
+# sealed independently with AES-256-GCM.
+#   header:  magic (8) | version (1) | chunk size (4) | nonce prefix (7)
+#   segment: ciphertext length (4) | ciphertext + tag
+# The segment nonce is the nonce prefix, a 4 byte segment counter and a 1 byte
+# flag set on the final segment, so reordered, dropped or truncated segments
+# fail authentication. The header is passed as associated data to every
+# segment.
+CHUNK_MAGIC = b'GCPIPENC'
+CHUNK_FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+_HEADER = struct.Struct('>8sBI7s')
+_FRAME = struct.Struct('>I')
+
+# Session keys: one KMS-wrapped master DEK per upload batch, from which a
+# unique key per file is derived with HKDF, a random per-file salt and the
+# blob name, so a blob copied to another name does not decrypt
+SESSION_SALT_SIZE = 16
+_SESSION_KDF_INFO = b'gcpip session file key v1'
+
+# Executors for sealing segments on several cores. Thread pools rely on
+# the cipher releasing the GIL, process pools do not but copy every chunk.
+ENCRYPTION_EXECUTORS = {'thread': ThreadPoolExecutor,
+                        'process': ProcessPoolExecutor}
+
+# Unwrapped DEK cache defaults
+DEK_CACHE_SIZE = 256
+DEK_CACHE_TTL = 300
+
+
+class DekCache():
+    """
+    Thread-safe LRU cache of unwrapped data encryption keys, keyed by the
+    wrapped DEK and the KEK resource name, so blobs sharing a wrapped DEK
+    (session keys, reprocessing jobs) need one KMS decrypt call.
+
+    Cached keys are held in bytearrays. With zeroise enabled they are
+    overwritten with zeros when evicted, expired or cleared; copies already
+    handed to callers are not affected.
+
+    Args:
+        maxsize (int): Maximum number of cached keys
+        ttl (float): Seconds a key stays in the cache
+        zeroise (bool): Overwrite keys with zeros when they leave the cache
+    """
+
+    def __init__(self, maxsize=DEK_CACHE_SIZE, ttl=DEK_CACHE_TTL,
+                 zeroise=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.zeroise = zeroise
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_cache_key(wrapped_dek, kek_path):
+        return hashlib.sha256(wrapped_dek).digest(), kek_path
+
+    def get(self, wrapped_dek, kek_path):
+        """
+        Args:
+            wrapped_dek (bytes): KMS encrypted DEK
+            kek_path (str): KMS key resource name
+
+        Returns (bytes): Plaintext DEK, or None if not cached
+
+        """
+        cache_key = self.get_cache_key(wrapped_dek, kek_path)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(cache_key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return bytes(entry[0])
+
+    def put(self, wrapped_dek, kek_path, dek):
+        """
+        Args:
+            wrapped_dek (bytes): KMS encrypted DEK
+            kek_path (str): KMS key resource name
+            dek (bytes): Plaintext DEK
+        """
+        cache_key = self.get_cache_key(wrapped_dek, kek_path)
+        with self.lock:
+            if cache_key in self.entries:
+                self._remove(cache_key)
+            self.entries[cache_key] = (
+                bytearray(dek), time.monotonic() + self.ttl)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, cache_key):
+        value, _ = self.entries.pop(cache_key)
+        if self.zeroise:
+            value[:] = bytes(len(value))
+
+    def clear(self):
+        """
+        Drop every cached key
+        """
+        with self.lock:
+            for cache_key in list(self.entries):
+                self._remove(cache_key)
+
+    @property
+    def hit_rate(self):
+        """
+        Returns (float): Share of lookups served from the cache
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self):
+        """
+        Returns (dict): size, hits, misses, evictions and hit rate
+        """
+        return {'size': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hit_rate}
+
+
+# Process-wide cache used by decrypt_dek
+dek_cache = DekCache()
+
 
 def generate_key():
     """
@@ -19,6 +169,32 @@ def generate_key():
     return Fernet.generate_key()
 
 
+def generate_salt():
+    """
+    Generates a random salt for deriving a per-file key from a session key.
+    Returns (bytes): SESSION_SALT_SIZE random bytes
+
+    """
+    return os.urandom(SESSION_SALT_SIZE)
+
+
+def derive_file_key(session_key, salt, name):
+    """
+    Derives the data encryption key of one file from a session key.
+    Args:
+        session_key (bytes): Session master key, a URL-safe base64-encoded
+            32-byte key as returned by generate_key
+        salt (bytes): Per-file random salt
+        name (str): Name of the encrypted blob the key is bound to
+
+    Returns (bytes): A URL-safe base64-encoded 32-byte key
+
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt,
+                info=_SESSION_KDF_INFO + b'\x00' + name.encode('utf-8'))
+    return base64.urlsafe_b64encode(hkdf.derive(get_aead_key(session_key)))
+
+
 def write_key_into_file(key, filename):
     """
     It writes the key into a file.
@@ -34,51 +210,387 @@ def write_key_into_file(key, filename):
     file.close()
 
 
-def encrypt_file(input_file, key):
+def get_aead_key(key):
+    """
+    Converts a Fernet key into the raw 256 bit key used by the chunked format.
+    Args:
+        key (bytes): A URL-safe base64-encoded 32-byte key
+
+    Returns (bytes): 32 raw key bytes
+
+    """
+    raw_key = base64.urlsafe_b64decode(key)
+    if len(raw_key) != 32:
+        raise ValueError('Data encryption key must decode to 32 bytes')
+    return raw_key
+
+
+def build_header(chunk_size=DEFAULT_CHUNK_SIZE, nonce_prefix=None):
+    """
+    Builds the header of a chunked encrypted file.
+    Args:
+        chunk_size (int): Plaintext bytes sealed in each segment.
+        nonce_prefix (bytes, optional): 7 byte nonce prefix. A random prefix
+            is generated if not given.
+
+    Returns (bytes): Header bytes
+
+    """
+    if nonce_prefix is None:
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    return _HEADER.pack(CHUNK_MAGIC, CHUNK_FORMAT_VERSION, chunk_size,
+                        nonce_prefix)
+
+
+def parse_header(header):
+    """
+    Parses the header of a chunked encrypted file.
+    Args:
+        header (bytes): First bytes of the encrypted file.
+
+    Returns (tuple): chunk size and nonce prefix
+
+    """
+    if len(header) < _HEADER.size:
+        raise ValueError('Encrypted file header is truncated')
+    magic, version, chunk_size, nonce_prefix = _HEADER.unpack(
+        header[:_HEADER.size])
+    if magic != CHUNK_MAGIC:
+        raise ValueError('Not a chunked encrypted file')
+    if version != CHUNK_FORMAT_VERSION:
+        raise ValueError(
+            'Unsupported encrypted file version: {}'.format(version))
+    return chunk_size, nonce_prefix
+
+
+def is_chunked_format(data):
+    """
+    Checks whether the given leading bytes belong to a chunked encrypted file.
+    Legacy Fernet tokens never start with the chunked format magic.
+    Args:
+        data (bytes): Leading bytes of an encrypted file.
+
+    Returns (bool): True for the chunked format
+
+    """
+    return data[:len(CHUNK_MAGIC)] == CHUNK_MAGIC
+
+
+def _segment_nonce(nonce_prefix, index, last):
+    return nonce_prefix + struct.pack('>I?', index, last)
+
+
+def _read_full(input_obj, size):
+    """
+    Reads up to size bytes, only returning less at the end of the stream.
+    """
+    data = input_obj.read(size)
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        part = input_obj.read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return b''.join(parts)
+
+
+def seal_segment(aead, header, nonce_prefix, index, last, data):
+    """
+    Seals a single plaintext segment and frames it.
+    Args:
+        aead (AESGCM): Cipher built from the data encryption key
+        header (bytes): File header, authenticated with every segment
+        nonce_prefix (bytes): Nonce prefix from the header
+        index (int): Segment counter
+        last (bool): True for the final segment of the file
+        data (bytes): Plaintext of the segment
+
+    Returns (bytes): Length-prefixed ciphertext
+
+    """
+    sealed = aead.encrypt(
+        _segment_nonce(nonce_prefix, index, last), data, header)
+    return _FRAME.pack(len(sealed)) + sealed
+
+
+def _seal_chunk(raw_key, header, nonce_prefix, index, last, data):
+    return seal_segment(AESGCM(raw_key), header, nonce_prefix, index, last,
+                        data)
+
+
+def _iter_flagged_chunks(input_obj, chunk_size, final):
+    """
+    Reads a stream in chunks, flagging the chunk that ends the file.
+    """
+    data = _read_full(input_obj, chunk_size)
+    while True:
+        next_data = _read_full(input_obj, chunk_size)
+        last = not next_data
+        if last and not final:
+            if data:
+                yield data, False
+            return
+        yield data, last
+        if last:
+            return
+        data = next_data
+
+
+def iter_sealed_segments(input_obj, key, header, first_index=0, final=True,
+                         workers=1, executor='thread'):
     """
-    Encrypt a file using given key. The result of this encryption is known as
-    a “Fernet token” and has strong privacy and authenticity guarantees.
+    Seals a plaintext stream into framed segments without writing the header.
+    Used directly to encrypt byte ranges of a file independently: each range
+    must start on a chunk boundary and only the range at the end of the file
+    is marked final. Concatenating the header and the segments of every range
+    in order gives a valid chunked encrypted file.
+
+    With several workers, segments are sealed concurrently in a pool while
+    keeping their order, holding at most two chunks per worker in memory.
+    Args:
+        input_obj (file object): Binary stream with the plaintext range
+        key (bytes): A URL-safe base64-encoded 32-byte key
+        header (bytes): File header, see build_header
+        first_index (int): Counter of the first segment of the range
+        final (bool): True if the range ends the file
+        workers (int): Number of segments sealed concurrently
+        executor (str): 'thread' or 'process' pool, see ENCRYPTION_EXECUTORS
+
+    Returns (generator): Framed segments
+
+    """
+    chunk_size, nonce_prefix = parse_header(header)
+    raw_key = get_aead_key(key)
+    chunks = enumerate(
+        _iter_flagged_chunks(input_obj, chunk_size, final), first_index)
+
+    if workers <= 1:
+        aead = AESGCM(raw_key)
+        for index, (data, last) in chunks:
+            yield seal_segment(aead, header, nonce_prefix, index, last, data)
+        return
+
+    pending = deque()
+    with ENCRYPTION_EXECUTORS[executor](max_workers=workers) as pool:
+        for index, (data, last) in chunks:
+            pending.append(pool.submit(
+                _seal_chunk, raw_key, header, nonce_prefix, index, last,
+                data))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_encrypted_segments(input_obj, key, chunk_size=DEFAULT_CHUNK_SIZE,
+                            nonce_prefix=None, workers=1, executor='thread'):
+    """
+    Encrypts a binary stream into the chunked format, one segment at a time.
+    At most two plaintext chunks are held in memory whatever the stream size.
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        key (bytes): A URL-safe base64-encoded 32-byte key
+        chunk_size (int): Plaintext bytes sealed in each segment
+        nonce_prefix (bytes, optional): 7 byte nonce prefix
+        workers (int): Number of segments sealed concurrently
+        executor (str): 'thread' or 'process' pool
+
+    Returns (generator): Header bytes followed by framed segments
+
+    """
+    header = build_header(chunk_size, nonce_prefix)
+    yield header
+    for segment in iter_sealed_segments(input_obj, key, header,
+                                        workers=workers, executor=executor):
+        yield segment
+
+
+def iter_encrypted_segments_at(input_obj, key, offset, nonce_prefix,
+                               chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+                               executor='thread'):
+    """
+    Starts encrypting a seekable file at the last segment boundary before an
+    offset of the encrypted stream. With the same key and nonce prefix the
+    output is identical to the matching part of iter_encrypted_segments, so
+    an interrupted upload can resume without re-encrypting the whole file.
+    Args:
+        input_obj (file object): Seekable binary stream opened for reading
+        key (bytes): A URL-safe base64-encoded 32-byte key
+        offset (int): Byte offset in the encrypted stream
+        nonce_prefix (bytes): 7 byte nonce prefix of the stream
+        chunk_size (int): Plaintext bytes sealed in each segment
+        workers (int): Number of segments sealed concurrently
+        executor (str): 'thread' or 'process' pool
+
+    Returns (tuple): generator of encrypted bytes and the offset in the
+        encrypted stream it starts at
+
+    """
+    header = build_header(chunk_size, nonce_prefix)
+    frame_size = _FRAME.size + chunk_size + TAG_SIZE
+
+    # The final segment always holds data unless the file is empty
+    size = input_obj.seek(0, io.SEEK_END)
+    last_index = max(0, size - 1) // chunk_size
+    index = min(max(0, offset - len(header)) // frame_size, last_index)
+
+    if index == 0:
+        input_obj.seek(0)
+        return iter_encrypted_segments(
+            input_obj, key, chunk_size, nonce_prefix, workers,
+            executor), 0
+
+    input_obj.seek(index * chunk_size)
+    return iter_sealed_segments(
+        input_obj, key, header, first_index=index, workers=workers,
+        executor=executor), len(header) + index * frame_size
+
+
+def iter_decrypted_segments(input_obj, key):
+    """
+    Decrypts a chunked encrypted binary stream one segment at a time.
+    Args:
+        input_obj (file object): Binary stream positioned at the header
+        key (bytes): A URL-safe base64-encoded 32-byte key
+
+    Returns (generator): Plaintext chunks
+
+    """
+    header = _read_full(input_obj, _HEADER.size)
+    chunk_size, nonce_prefix = parse_header(header)
+    aead = AESGCM(get_aead_key(key))
+    max_frame = chunk_size + TAG_SIZE
+
+    index = 0
+    frame = _read_full(input_obj, _FRAME.size)
+    while True:
+        if len(frame) != _FRAME.size:
+            raise ValueError('Encrypted file is truncated')
+        sealed_size, = _FRAME.unpack(frame)
+        if sealed_size > max_frame:
+            raise ValueError('Encrypted segment exceeds chunk size')
+        sealed = _read_full(input_obj, sealed_size)
+        if len(sealed) != sealed_size:
+            raise ValueError('Encrypted file is truncated')
+        frame = _read_full(input_obj, _FRAME.size)
+        last = not frame
+        yield aead.decrypt(
+            _segment_nonce(nonce_prefix, index, last), sealed, header)
+        if last:
+            break
+        index += 1
+
+
+def encrypt_stream(input_obj, output_obj, key, chunk_size=DEFAULT_CHUNK_SIZE,
+                   workers=1, executor='thread'):
+    """
+    Encrypts a binary stream into another one using the chunked format.
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        output_obj (file object): Binary stream opened for writing
+        key (bytes): A URL-safe base64-encoded 32-byte key
+        chunk_size (int): Plaintext bytes sealed in each segment
+        workers (int): Number of segments sealed concurrently
+        executor (str): 'thread' or 'process' pool
+    """
+    for segment in iter_encrypted_segments(
+            input_obj, key, chunk_size, workers=workers, executor=executor):
+        output_obj.write(segment)
+
+
+def decrypt_stream(input_obj, output_obj, key):
+    """
+    Decrypts a chunked encrypted binary stream into another one.
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        output_obj (file object): Binary stream opened for writing
+        key (bytes): A URL-safe base64-encoded 32-byte key
+    """
+    for data in iter_decrypted_segments(input_obj, key):
+        output_obj.write(data)
+
+
+def encrypt_file(input_file, key, chunk_size=DEFAULT_CHUNK_SIZE,
+                 legacy=False, workers=1, executor='thread', compression=None):
+    """
+    Encrypt a file using given key. The file is streamed through fixed-size
+    buffers and written in the chunked AES-GCM format, so memory use does not
+    depend on the file size.
     Args:
         input_file (str): Full path to the input file.
         key (str): A URL-safe base64-encoded 32-byte key
+        chunk_size (int): Plaintext bytes sealed in each segment.
+        legacy (bool): Write a single whole-file Fernet token instead.
+        workers (int): Number of segments sealed concurrently. The output
+            is identical whatever the number of workers.
+        executor (str): 'thread' or 'process' pool
+        compression (str, optional): Compress the plaintext with 'gzip' or
+            'zstd' before encrypting it.
 
     Returns: Encrypted file and write an new file with .encrypted extension
     added to the original file.
 
     """
     output_file = '{}.encrypted'.format(input_file)
-    with open(input_file, 'rb') as f:
-        data = f.read()
 
-    fernet = Fernet(key)
-    encrypted = fernet.encrypt(data)
+    if legacy:
+        if compression is not None:
+            raise ValueError('Compression needs the chunked format')
+        with open(input_file, 'rb') as f:
+            data = f.read()
+        encrypted = Fernet(key).encrypt(data)
+        with open(output_file, 'wb') as f:
+            f.write(encrypted)
+        return output_file
 
-    with open(output_file, 'wb') as f:
-        f.write(encrypted)
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        encrypt_stream(compress_stream(f_in, compression), f_out, key,
+                       chunk_size, workers=workers, executor=executor)
 
+    return output_file
 
-def decrypt_file(input_file, key):
+
+def decrypt_file(input_file, key, compression=None):
     """
-    Decrypt a file using given key.
+    Decrypt a file using given key. Both the chunked format and legacy
+    whole-file Fernet tokens are supported.
     Args:
         input_file: Full path to the input file.
         key: A URL-safe base64-encoded 32-byte key
+        compression (str, optional): Compression applied before encryption,
+            'gzip' or 'zstd'. The decrypted data is decompressed.
 
     Returns: Decrypted file and write it as a new file. If .encrypted  exist in
     the name of file it remove it and if it doesn't exist it add .decrypted
     extension.
     """
+    if '.encrypted' in input_file:
+        output_file = input_file.replace('.encrypted', '')
+    else:
+        output_file = '{}.decrypted'.format(input_file)
+
+    with open(input_file, 'rb') as f:
+        chunked = is_chunked_format(f.read(len(CHUNK_MAGIC)))
+
+    if chunked:
+        with open(input_file, 'rb') as f_in, \
+                open(output_file, 'wb') as f_out:
+            decrypted = IteratorReader(iter_decrypted_segments(f_in, key))
+            shutil.copyfileobj(
+                decompress_stream(decrypted, compression), f_out,
+                DEFAULT_CHUNK_SIZE)
+        return output_file
+
     with open(input_file, 'rb') as f:
         data = f.read()
 
     fernet = Fernet(key)
     decrypted = fernet.decrypt(data)
 
-    if '.encrypted' in input_file:
-        output_file = input_file.replace('.encrypted', '')
-    else:
-        output_file = '{}.decrypted'.format(input_file)
-
     with open(output_file, 'wb') as f:
         f.write(decrypted)
 
@@ -108,7 +620,8 @@ def encrypt_dek(kms_client, dek, project_id, location_id, key_ring_id, key_id):
     return response.ciphertext
 
 
-def decrypt_dek(kms_client, dek, project_id, location_id, key_ring_id, key_id):
+def decrypt_dek(kms_client, dek, project_id, location_id, key_ring_id, key_id,
+                cache=dek_cache):
     """
     Decrypt data encryption key (DEK) using GCP KMS key
 
@@ -117,15 +630,27 @@ def decrypt_dek(kms_client, dek, project_id, location_id, key_ring_id, key_id):
             KMS client object
         dek (bytes): DEK
         kms_key (str): KMS key resource name
+        cache (DekCache, optional): Cache of unwrapped DEKs consulted before
+            calling KMS. Defaults to the process-wide dek_cache, None
+            disables caching.
 
     Returns:
         bytes: Plaintext DEK
     """
 
-    logger.debug("Encrypting DEK via GCP KMS")
+    logger.debug("Decrypting DEK via GCP KMS")
 
     kms_key = get_kms_key_path(
         kms_client, project_id, location_id, key_ring_id, key_id)
 
+    if cache is not None:
+        plaintext = cache.get(dek, kms_key)
+        if plaintext is not None:
+            logger.debug("Using cached DEK")
+            return plaintext
+
     response = kms_client.decrypt(kms_key, dek)
+
+    if cache is not None:
+        cache.put(dek, kms_key, response.plaintext)
     return response.plaintext
@@ -1,40 +1,493 @@
+import base64
 import logging
+import mimetypes
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from google.api_core.exceptions import NotFound
+from gcpip.upload.defaults import COMPOSITE_THRESHOLD
 from gcpip.upload.encryption import (
-    generate_key, encrypt_file, encrypt_dek, decrypt_dek, decrypt_file)
-from gcpip.utils.encryption import (
-    create_kms_key, create_kms_key_ring, get_kms_key_rings, get_kms_keys)
+    generate_key, generate_salt, derive_file_key, encrypt_file, encrypt_dek,
+    decrypt_dek, decrypt_file,
+    iter_encrypted_segments, iter_decrypted_segments, iter_sealed_segments,
+    iter_encrypted_segments_at, is_chunked_format, build_header,
+    CHUNK_MAGIC, DEFAULT_CHUNK_SIZE, NONCE_PREFIX_SIZE)
+from gcpip.utils.encryption import ensure_kms_key
 from gcpip.utils.storage import (
-    download_gcs_file, load_gcs_object, delete_blob)
+    download_gcs_file, load_gcs_object, delete_blobs, iter_blob_ranges,
+    get_bucket_handle, invalidate_object_cache, api_calls)
+from gcpip.utils.compression import (
+    compress_stream, decompress_stream, iter_compressed)
+from gcpip.utils.streams import IteratorReader, SeekableIteratorReader
+from gcpip.upload.journal import get_fingerprint, COMPLETE
+from gcpip.upload.resumable import ResumableSession
+from gcpip.utils.checksums import (
+    compute_checksums, get_plaintext_metadata, checksums_match)
 
 logger = logging.getLogger(__name__)
 
+# Bytes buffered per request of a streaming resumable upload. Must be a
+# multiple of 256 KB.
+STREAM_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-def upload_file(storage_client, bucket_name, source_file_name,
-                destination_name):
+# GCS compose accepts at most 32 source objects per request
+COMPOSITE_MAX_PARTS = 32
+COMPOSITE_MIN_PART_SIZE = 32 * 1024 * 1024
+COMPOSITE_WORKERS = 8
+
+# Custom metadata on blobs encrypted with a key derived from a session key
+SESSION_DEK_METADATA = 'gcpip-session-dek'
+SESSION_SALT_METADATA = 'gcpip-key-salt'
+# Custom metadata naming the compression applied before encryption
+COMPRESSION_METADATA = 'gcpip-compression'
+
+# Upload outcomes reported by upload_file and encrypt_upload_file
+UPLOADED = 'uploaded'
+SKIPPED = 'skipped'
+
+
+def use_composite_upload(source_file_name, composite_threshold):
+    """
+    Checks whether a file should be sent as a parallel composite upload.
+    Empty files have no part to compose, they are uploaded as one blob.
+
+    Args:
+        source_file_name (str): Local file to upload
+        composite_threshold (int): Size in bytes from which composite uploads
+            are used. None disables them.
+
+    Returns:
+        bool: True if the file is not empty and reaches the threshold
+    """
+
+    if composite_threshold is None:
+        return False
+    size = os.path.getsize(source_file_name)
+    return size > 0 and size >= composite_threshold
+
+
+def get_part_ranges(size, max_parts=COMPOSITE_MAX_PARTS,
+                    min_part_size=COMPOSITE_MIN_PART_SIZE, alignment=1):
+    """
+    Splits a file size into contiguous byte ranges for a composite upload.
+
+    Args:
+        size (int): File size in bytes
+        max_parts (int, optional): Maximum number of ranges
+        min_part_size (int, optional): Minimum range size in bytes
+        alignment (int, optional): Ranges start on multiples of alignment
+
+    Returns:
+        list[tuple]: (start, length) of each range
+    """
+
+    part_size = max(min_part_size, -(-size // max_parts), 1)
+    part_size = -(-part_size // alignment) * alignment
+    return [(start, min(part_size, size - start))
+            for start in range(0, size, part_size)]
+
+
+def iter_file_range(file_name, start, length,
+                    chunk_size=STREAM_UPLOAD_CHUNK_SIZE):
+    """
+    Reads a byte range of a local file in chunks.
+
+    Args:
+        file_name (str): Local file
+        start (int): Offset of the first byte
+        length (int): Number of bytes to read
+        chunk_size (int, optional): Bytes per read
+
+    Returns:
+        generator: file contents as bytes chunks
+    """
+
+    with open(file_name, 'rb') as file_obj:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = file_obj.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def compose_upload(storage_client, bucket_name, destination_name,
+                   part_streams, workers=COMPOSITE_WORKERS, metadata=None):
+    """
+    Uploads parts concurrently as temporary blobs, composes them into the
+    destination blob and removes the temporary blobs.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        bucket_name (str): Name of bucket to upload files into
+        destination_name (str): Name of the composed blob
+        part_streams (list[callable]): One function per part returning a
+            file object with the part contents, in order
+        workers (int, optional): Number of concurrent part uploads
+        metadata (dict, optional): Custom metadata of the composed blob
     """
-    This method upload a given file into google bucket storage.
+
+    if not part_streams:
+        raise ValueError('Composite uploads need at least one part')
+    if len(part_streams) > COMPOSITE_MAX_PARTS:
+        raise ValueError('Composite uploads support at most {} parts'
+                         .format(COMPOSITE_MAX_PARTS))
+
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    token = uuid.uuid4().hex[:8]
+    part_blobs = [bucket.blob('{}.part-{}-{:02d}'.format(
+        destination_name, token, i)) for i in range(len(part_streams))]
+
+    def upload_part(i):
+        part_blobs[i].chunk_size = STREAM_UPLOAD_CHUNK_SIZE
+        part_blobs[i].upload_from_file(part_streams[i]())
+
+    logger.debug('Uploading {} parts of {} with {} workers'.format(
+        len(part_blobs), destination_name, workers))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(upload_part, range(len(part_blobs))))
+        destination = bucket.blob(destination_name)
+        if metadata is not None:
+            destination.metadata = metadata
+        destination.compose(part_blobs)
+    finally:
+        results = delete_blobs(storage_client, bucket_name,
+                               [x.name for x in part_blobs],
+                               ignore_missing=True)
+        for result in results:
+            if result['error'] is not None:
+                logger.warning('Could not delete part {}: {}'.format(
+                    result['blob'], result['error']))
+
+
+def upload_file_composite(storage_client, bucket_name, source_file_name,
+                          destination_name, workers=COMPOSITE_WORKERS):
+    """
+    Uploads a large file as concurrent byte range parts joined with GCS
+    compose.
 
     Args:
         storage_client(storage.Client): client object
         bucket_name (str): Google Cloud Bucket Name
         source_file_name (str): Input file to upload.
         destination_name (str): Destination directory and file name.
+        workers (int, optional): Number of concurrent part uploads
+    """
+
+    ranges = get_part_ranges(os.path.getsize(source_file_name))
+    part_streams = [
+        lambda start=start, length=length: IteratorReader(
+            iter_file_range(source_file_name, start, length))
+        for start, length in ranges]
+    compose_upload(storage_client, bucket_name, destination_name,
+                   part_streams, workers)
+
+
+def upload_file_encrypted_composite(
+        storage_client, bucket_name, source_file_name, destination_name, dek,
+        workers=COMPOSITE_WORKERS, metadata=None):
+    """
+    Encrypts and uploads a large file as concurrent parts joined with GCS
+    compose. Parts are cut on segment boundaries and encrypted independently
+    so the composed blob is a single chunked encrypted file.
+
+    Args:
+        storage_client(storage.Client): client object
+        bucket_name (str): Google Cloud Bucket Name
+        source_file_name (str): Input file to upload.
+        destination_name (str): Name of the encrypted blob
+        dek (bytes): Data encryption key
+        workers (int, optional): Number of concurrent part uploads
+        metadata (dict, optional): Custom metadata of the encrypted blob
+    """
+
+    header = build_header(DEFAULT_CHUNK_SIZE)
+    ranges = get_part_ranges(os.path.getsize(source_file_name),
+                             alignment=DEFAULT_CHUNK_SIZE)
+
+    def encrypted_part(i):
+        start, length = ranges[i]
+        segments = iter_sealed_segments(
+            IteratorReader(iter_file_range(source_file_name, start, length)),
+            dek, header, first_index=start // DEFAULT_CHUNK_SIZE,
+            final=i == len(ranges) - 1)
+        if i == 0:
+            return IteratorReader(_prepend(header, segments))
+        return IteratorReader(segments)
+
+    part_streams = [lambda i=i: encrypted_part(i) for i in range(len(ranges))]
+    compose_upload(storage_client, bucket_name, destination_name,
+                   part_streams, workers, metadata=metadata)
+
+
+def is_blob_unchanged(bucket, blob_name, checksums, compression=None,
+                      encrypted=False):
     """
+    Checks whether a blob already holds the content of a local file, so the
+    upload can be skipped. Encrypted and compressed blobs are compared with
+    the plaintext digests recorded in their metadata and must have been
+    stored with the same compression.
+
+    Args:
+        bucket (storage.Bucket): Bucket holding the blob
+        blob_name (str): Name of the blob to compare
+        checksums (dict): Local digests from compute_checksums
+        compression (str, optional): Compression the upload would use
+        encrypted (bool, optional): Whether the blob is encrypted
+
+    Returns:
+        bool: True if the blob exists with matching content
+    """
+
+    blob = bucket.get_blob(blob_name)
+    if blob is None:
+        return False
+
+    if encrypted:
+        metadata = blob.metadata or {}
+        if metadata.get(COMPRESSION_METADATA) != compression:
+            return False
+        # A blob whose own .dek never made it to the bucket is unusable
+        if SESSION_DEK_METADATA not in metadata and bucket.get_blob(
+                ".".join(blob_name.split(".")[:-1]) + ".dek") is None:
+            return False
+        return checksums_match(blob, checksums, plaintext=True)
+
+    if blob.content_encoding != ('gzip' if compression else None):
+        return False
+    return checksums_match(blob, checksums, plaintext=compression is not None)
+
+
+def _prepend(first, iterable):
+    yield first
+    for item in iterable:
+        yield item
+
+
+def upload_resumable(storage_client, transport, uploader, stream, journal,
+                     source_file_name, fingerprint, state=None, size=None,
+                     content_type=None):
+    """
+    Uploads a seekable stream through a resumable session recorded in the
+    upload journal. The committed offset is journaled after every chunk, so
+    if the process dies the next call with the same fingerprint resumes the
+    session where GCS left it instead of starting from byte zero.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        transport (requests.Session): Authorized HTTP transport carrying the
+            session requests, e.g. from get_http_session
+        uploader (storage.Blob): Destination blob, with any metadata set
+        stream (file object): Seekable binary stream starting at offset 0
+            that always yields the same bytes
+        journal (UploadJournal): Upload journal
+        source_file_name (str): Local file the stream is generated from
+        fingerprint (str): Fingerprint of the source file
+        state (dict, optional): Stream state saved in the journal, needed
+            to regenerate the stream on resume
+        size (int, optional): Stream size in bytes if known
+        content_type (str, optional): Content type of the blob
+    """
+
+    bucket_name, blob_name = uploader.bucket.name, uploader.name
+    entry = journal.get(bucket_name, blob_name, fingerprint)
+
+    upload = None
+    if entry is not None and entry['session_url'] is not None:
+        upload = ResumableSession(transport, entry['session_url'], stream,
+                                  size, STREAM_UPLOAD_CHUNK_SIZE)
+        try:
+            upload.recover()
+        except NotFound:
+            logger.warning('Upload session of {} expired, restarting'.format(
+                source_file_name))
+            stream.seek(0)
+            upload = None
+        else:
+            if upload.finished:
+                logger.info('Upload of {} already finished'.format(
+                    source_file_name))
+                journal.complete(bucket_name, blob_name)
+                return
+            logger.info('Resuming upload of {} at byte {}'.format(
+                source_file_name, upload.bytes_uploaded))
+
+    if upload is None:
+        session_url = uploader.create_resumable_upload_session(
+            content_type=content_type, size=size, client=storage_client)
+        journal.start(bucket_name, blob_name, source_file_name, fingerprint,
+                      session_url, state)
+        upload = ResumableSession(transport, session_url, stream, size,
+                                  STREAM_UPLOAD_CHUNK_SIZE)
+
+    while not upload.finished:
+        upload.transmit_next_chunk()
+        journal.set_committed(bucket_name, blob_name, upload.bytes_uploaded)
+    journal.complete(bucket_name, blob_name)
+
 
-    bucket = storage_client.get_bucket(bucket_name)
+def upload_file(storage_client, bucket_name, source_file_name,
+                destination_name, composite_threshold=COMPOSITE_THRESHOLD,
+                workers=COMPOSITE_WORKERS, compression=None,
+                skip_unchanged=False, journal=None, transport=None):
+    """
+    This method upload a given file into google bucket storage.
+    Files larger than composite_threshold are uploaded as parallel
+    composite uploads.
+    With gzip compression the file is compressed while uploading and stored
+    with Content-Encoding: gzip, which BigQuery loads directly.
 
-    uploader = bucket.blob(destination_name)
-    uploader.upload_from_filename(source_file_name)
+    Args:
+        storage_client(storage.Client): client object
+        bucket_name (str): Google Cloud Bucket Name
+        source_file_name (str): Input file to upload.
+        destination_name (str): Destination directory and file name.
+        composite_threshold (int, optional): Size in bytes from which
+            parallel composite uploads are used. None disables them.
+        workers (int, optional): Number of concurrent part uploads
+        compression (str, optional): 'gzip' to compress the upload.
+            Compressed uploads are never composite.
+        skip_unchanged (bool, optional): Compare local checksums with the
+            existing blob and skip the upload if they match. Compressed
+            uploads record the plaintext digests only when this is set.
+        journal (UploadJournal, optional): Upload through a journaled
+            resumable session that a later call can resume. Files the journal
+            records as complete are skipped. Journaled uploads are never
+            composite.
+        transport (requests.Session, optional): Authorized HTTP transport
+            of journaled uploads, e.g. from get_http_session. Required with
+            journal.
+
+    Returns:
+        str: UPLOADED, or SKIPPED if the blob was unchanged
+    """
 
+    if compression is not None and compression != 'gzip':
+        raise ValueError('Plain uploads only support gzip Content-Encoding')
+    if journal is not None and transport is None:
+        raise ValueError('Journaled uploads need an HTTP transport')
+    api_calls.record('buckets.get', saved=True)
+
+    if journal is not None:
+        fingerprint = get_fingerprint(source_file_name,
+                                      compression=compression)
+        if journal.is_complete(bucket_name, destination_name, fingerprint):
+            logger.info('File {} already uploaded to {}, skipping.'.format(
+                source_file_name, destination_name))
+            return SKIPPED
+
+    checksums = None
+    if skip_unchanged:
+        checksums = compute_checksums(source_file_name)
+        bucket = get_bucket_handle(storage_client, bucket_name)
+        if is_blob_unchanged(bucket, destination_name, checksums,
+                             compression=compression):
+            logger.info('File {} unchanged at {}, skipping upload.'.format(
+                source_file_name, destination_name))
+            return SKIPPED
+
+    if journal is not None:
+        bucket = get_bucket_handle(storage_client, bucket_name)
+
+        uploader = bucket.blob(destination_name)
+        content_type = mimetypes.guess_type(source_file_name)[0]
+        with open(source_file_name, 'rb') as file_obj:
+            if compression is None:
+                stream = file_obj
+                size = os.path.getsize(source_file_name)
+            else:
+                uploader.content_encoding = 'gzip'
+                if checksums is not None:
+                    uploader.metadata = get_plaintext_metadata(checksums)
+
+                def open_at(offset):
+                    file_obj.seek(0)
+                    return iter_compressed(file_obj, compression), 0
+
+                stream = SeekableIteratorReader(open_at)
+                size = None
+            upload_resumable(storage_client, transport, uploader, stream,
+                             journal, source_file_name, fingerprint,
+                             size=size, content_type=content_type)
+    elif compression is not None:
+        bucket = get_bucket_handle(storage_client, bucket_name)
+
+        uploader = bucket.blob(destination_name)
+        uploader.content_encoding = 'gzip'
+        if checksums is not None:
+            uploader.metadata = get_plaintext_metadata(checksums)
+        uploader.chunk_size = STREAM_UPLOAD_CHUNK_SIZE
+        content_type = mimetypes.guess_type(source_file_name)[0]
+        with open(source_file_name, 'rb') as file_obj:
+            uploader.upload_from_file(
+                IteratorReader(iter_compressed(file_obj, compression)),
+                content_type=content_type)
+    elif use_composite_upload(source_file_name, composite_threshold):
+        upload_file_composite(storage_client, bucket_name, source_file_name,
+                              destination_name, workers)
+    else:
+        bucket = get_bucket_handle(storage_client, bucket_name)
+
+        uploader = bucket.blob(destination_name)
+        uploader.upload_from_filename(source_file_name)
+
+    invalidate_object_cache(bucket_name, [destination_name])
     logger.info('File {} uploaded to {}.'.format(
         source_file_name, destination_name))
+    return UPLOADED
+
+
+def create_upload_session(
+        storage_client, kms_client, bucket_name, destination_prefix,
+        project_id, location_id, key_ring_id, key_id):
+    """
+    Creates a session key for encrypting a batch of files with one KMS call.
+    A master DEK is wrapped with the KMS key and uploaded once under the
+    batch prefix. Each file is then encrypted with its own key derived from
+    the master DEK and a random salt stored in the blob metadata.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        kms_client (kms_v1.KeyManagementServiceClient): GCP KMS client object
+        bucket_name (str): Name of bucket to upload files into
+        destination_prefix (str): Blob name prefix of the batch
+        project_id (str): Name of GCP project
+        location_id (str): KMS key location
+        key_ring_id (str): KMS key ring ID
+        key_id (str): KMS key ID
+
+    Returns:
+        dict: plaintext master DEK and path of its wrapped copy in the bucket
+    """
+
+    dek = generate_key()
+    ensure_kms_key(kms_client, project_id, location_id, key_ring_id, key_id)
+    dek_encrypted = encrypt_dek(kms_client, dek, project_id, location_id,
+                                key_ring_id, key_id)
+
+    # Unique name so a new batch never replaces a key older blobs rely on
+    dek_blob_path = '.gcpip-session-{}.dek'.format(uuid.uuid4().hex)
+    if destination_prefix:
+        dek_blob_path = destination_prefix.rstrip('/') + '/' + dek_blob_path
+
+    logger.info("Uploading session DEK to: {}".format(dek_blob_path))
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    bucket.blob(dek_blob_path).upload_from_string(dek_encrypted)
+    invalidate_object_cache(bucket_name, [dek_blob_path])
+
+    return {'dek': dek, 'dek_blob_path': dek_blob_path}
 
 
 def encrypt_upload_file(
         storage_client, kms_client, bucket_name, source_file_name,
-        destination_name, project_id, location_id, key_ring_id, key_id):
+        destination_name, project_id, location_id, key_ring_id, key_id,
+        streaming=False, composite_threshold=COMPOSITE_THRESHOLD,
+        workers=COMPOSITE_WORKERS, session=None, encryption_workers=1,
+        compression=None, skip_unchanged=False, journal=None, transport=None):
     """
     Encrypts a file and uploads the file and wrapped data encryption key (DEK)
         to google cloud storage.
@@ -54,64 +507,203 @@ def encrypt_upload_file(
         location_id (str): KMS key location
         key_ring_id (str): KMS key ring ID
         key_id (str): KMS key ID
+        streaming (bool, optional): Encrypt while uploading through a GCS
+            resumable upload session instead of writing a local
+            .encrypted copy first. Defaults to False.
+        composite_threshold (int, optional): Size in bytes from which the
+            encrypted file is uploaded as a parallel composite upload.
+            None disables them.
+        workers (int, optional): Number of concurrent part uploads
+        session (dict, optional): Session key from create_upload_session.
+            The file key is derived from it instead of wrapping a new DEK
+            with KMS, and no .dek blob is uploaded.
+        encryption_workers (int, optional): Number of segments sealed
+            concurrently on the local machine. Defaults to 1.
+        compression (str, optional): Compress the file with 'gzip' or 'zstd'
+            before encrypting it. Recorded in the blob metadata so
+            decrypt_blob can decompress. Compressed uploads are never
+            composite.
+        skip_unchanged (bool, optional): Skip the upload if the encrypted
+            blob already exists with the same plaintext digest. The
+            plaintext digests are only computed and recorded when set.
+        journal (UploadJournal, optional): Encrypt while uploading through
+            a journaled resumable session. The wrapped DEK and nonce prefix
+            are journaled so a later call regenerates identical ciphertext
+            and resumes from the committed offset. Files the journal records
+            as complete are skipped. Journaled uploads are never composite.
+        transport (requests.Session, optional): Authorized HTTP transport
+            of journaled uploads, e.g. from get_http_session. Required with
+            journal.
+
+    Returns:
+        str: UPLOADED, or SKIPPED if the blob was unchanged
     """
 
+    if journal is not None and transport is None:
+        raise ValueError('Journaled uploads need an HTTP transport')
+
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob_name = destination_name + ".encrypted"
+
+    state = None
+    if journal is not None:
+        fingerprint = get_fingerprint(source_file_name, encrypted=True,
+                                      compression=compression)
+        entry = journal.get(bucket_name, blob_name, fingerprint)
+        if entry is not None and entry['status'] == COMPLETE:
+            logger.info('File {} already uploaded to {}, skipping.'.format(
+                source_file_name, blob_name))
+            return SKIPPED
+        if entry is not None:
+            state = entry['state']
+
+    checksums = None
+    if state is None and skip_unchanged:
+        # Plaintext digests let later runs detect unchanged files
+        checksums = compute_checksums(source_file_name)
+        if is_blob_unchanged(
+                bucket, blob_name, checksums, compression=compression,
+                encrypted=True):
+            logger.info('File {} unchanged at {}, skipping upload.'.format(
+                source_file_name, blob_name))
+            return SKIPPED
+
     logger.info(
         "Uploading encrypted data: {} and DEK to GCS bucket: {}"
         .format(source_file_name, bucket_name))
 
-    # Create DEK
-    dek = generate_key()
-
-    # Encrypt target file
-    encrypt_file(source_file_name, dek)
-
-    # Check key ring exists and create if not
-    key_rings = get_kms_key_rings(
-        kms_client, project=project_id, location_id=location_id)
-    if key_ring_id not in key_rings:
-        create_kms_key_ring(kms_client, project_id, location_id,
-                            key_ring_id)
-
-    # Check key exists and create if not
-    keys = get_kms_keys(kms_client, project=project_id,
-                        location_id=location_id, key_ring_id=key_ring_id)
-    if key_id not in keys:
-        create_kms_key(kms_client, project_id, location_id,
-                       key_ring_id, key_id)
-
-    # Encrypt DEK
-    dek_encrypted = encrypt_dek(kms_client, dek, project_id, location_id,
-                                key_ring_id, key_id)
-
-    # Upload encrypted file to GCS bucket
-    logger.debug("Uploading encrypted file to bucket")
-    bucket = storage_client.get_bucket(bucket_name)
-    uploader = bucket.blob(destination_name + ".encrypted")
-    uploader.upload_from_filename(source_file_name + ".encrypted")
-
-    # Upload encrypted DEK and KEK path to GCS bucket
-    logger.debug("Uploading encrypted DEK to bucket")
-
-    # kms_key_path = get_kms_key_path(
-    #     kms_client, project_id, location_id, key_ring_id, key_id)
+    if state is not None:
+        # Resume with the key and nonce prefix the upload started with
+        metadata = state['metadata']
+        dek, dek_encrypted = _restore_dek(
+            storage_client, kms_client, bucket_name, blob_name, state,
+            project_id, location_id, key_ring_id, key_id)
+    else:
+        metadata = {} if checksums is None else \
+            get_plaintext_metadata(checksums)
+        if compression is not None:
+            metadata[COMPRESSION_METADATA] = compression
+
+        if session is None:
+            # Create DEK
+            dek = generate_key()
+
+            # Check key ring and key exist and create if not
+            ensure_kms_key(
+                kms_client, project_id, location_id, key_ring_id, key_id)
+
+            # Encrypt DEK
+            dek_encrypted = encrypt_dek(kms_client, dek, project_id,
+                                        location_id, key_ring_id, key_id)
+        else:
+            # Derive file key from session key, no KMS call needed
+            salt = generate_salt()
+            dek = derive_file_key(session['dek'], salt, blob_name)
+            dek_encrypted = None
+            metadata[SESSION_DEK_METADATA] = session['dek_blob_path']
+            metadata[SESSION_SALT_METADATA] = base64.b64encode(salt).decode(
+                'ascii')
+
+    # Upload encrypted DEK first, so an encrypted blob never exists without
+    # the key to decrypt it
+    if dek_encrypted is not None:
+        logger.debug("Uploading encrypted DEK to bucket")
+        dek_blob = bucket.blob(destination_name + ".dek")
+        dek_blob.upload_from_string(dek_encrypted)
+        invalidate_object_cache(bucket_name, [dek_blob.name])
+
+    uploader = bucket.blob(blob_name)
+    uploader.metadata = metadata
+
+    if journal is not None:
+        # Deterministic encryption lets a resumed session regenerate the
+        # bytes GCS expects from the committed offset onwards
+        logger.debug("Uploading encrypted file through journaled session")
+        if state is None:
+            state = {
+                'nonce_prefix': os.urandom(NONCE_PREFIX_SIZE).hex(),
+                'dek': None if dek_encrypted is None else
+                base64.b64encode(dek_encrypted).decode('ascii'),
+                'metadata': metadata}
+        nonce_prefix = bytes.fromhex(state['nonce_prefix'])
+
+        with open(source_file_name, 'rb') as file_obj:
+            def open_at(offset):
+                if compression is None:
+                    return iter_encrypted_segments_at(
+                        file_obj, dek, offset, nonce_prefix,
+                        workers=encryption_workers)
+                file_obj.seek(0)
+                return iter_encrypted_segments(
+                    compress_stream(file_obj, compression), dek,
+                    nonce_prefix=nonce_prefix,
+                    workers=encryption_workers), 0
+
+            upload_resumable(storage_client, transport, uploader,
+                             SeekableIteratorReader(open_at), journal,
+                             source_file_name, fingerprint, state=state)
+    elif compression is None and \
+            use_composite_upload(source_file_name, composite_threshold):
+        logger.debug("Uploading encrypted file as composite upload")
+        upload_file_encrypted_composite(
+            storage_client, bucket_name, source_file_name, blob_name, dek,
+            workers, metadata=metadata)
+    elif streaming:
+        # Encrypt segments as the resumable upload asks for them
+        logger.debug("Streaming encrypted file to bucket")
+        uploader.chunk_size = STREAM_UPLOAD_CHUNK_SIZE
+        with open(source_file_name, 'rb') as file_obj:
+            uploader.upload_from_file(
+                IteratorReader(iter_encrypted_segments(
+                    compress_stream(file_obj, compression), dek,
+                    workers=encryption_workers)))
+    else:
+        # Encrypt target file
+        encrypted_file_name = encrypt_file(
+            source_file_name, dek, workers=encryption_workers,
+            compression=compression)
+
+        # Upload encrypted file to GCS bucket
+        logger.debug("Uploading encrypted file to bucket")
+        uploader.upload_from_filename(encrypted_file_name)
+
+        # Remove encrypted file
+        logger.debug("Removing encrypted file: {}".format(
+            encrypted_file_name))
+        os.remove(encrypted_file_name)
+
+    invalidate_object_cache(bucket_name, [blob_name])
+    return UPLOADED
+
+
+def _restore_dek(storage_client, kms_client, bucket_name, blob_name, state,
+                 project_id, location_id, key_ring_id, key_id):
+    """
+    Recovers the data encryption key of an interrupted journaled upload.
 
-    # dek_kek = dek_encrypted + b" " + bytes(kms_key_path, 'utf-8')
-    # dek_kek = dek_encrypted + bytes(kms_key_path, 'utf-8')
+    Returns:
+        tuple: DEK and its wrapped copy, which is None for session keys
+    """
 
-    dek_blob = bucket.blob(destination_name + ".dek")
-    dek_blob.upload_from_string(dek_encrypted)
-    # kek_blob = bucket.blob(destination_name + ".kek")
-    # kek_blob.upload_from_string(kms_key_path)
+    metadata = state['metadata']
+    if SESSION_DEK_METADATA in metadata:
+        session_dek = decrypt_dek(
+            kms_client, load_gcs_object(
+                storage_client, bucket_name, metadata[SESSION_DEK_METADATA]),
+            project_id, location_id, key_ring_id, key_id)
+        salt = base64.b64decode(metadata[SESSION_SALT_METADATA])
+        return derive_file_key(session_dek, salt, blob_name), None
 
-    # Remove encrypted file
-    logger.debug("Removing encrypted file: {}".format(source_file_name))
-    os.remove(source_file_name + ".encrypted")
+    dek_encrypted = base64.b64decode(state['dek'])
+    return decrypt_dek(kms_client, dek_encrypted, project_id, location_id,
+                       key_ring_id, key_id), dek_encrypted
 
 
 def decrypt_blob(
         storage_client, kms_client, bucket_name, blob_path,
-        project_id, location_id, key_ring_id, key_id, temp_data='temp_dir'):
+        project_id, location_id, key_ring_id, key_id, temp_data='temp_dir',
+        streaming=False, metadata=None, delete=True, blob=None):
     """
     Decrypts an encrypted blob and saves decrypted data to GCS
     File must have been uploaded to GCS w/ wrapped DEK key
@@ -127,24 +719,46 @@ def decrypt_blob(
         location_id (str): KMS key location
         key_ring_id (str): KMS key ring ID
         key_id (str): KMS key ID
+        temp_data (str, optional): Local directory for temporary files
+        streaming (bool, optional): Pipe ranged downloads through the
+            decryptor into a resumable upload instead of using local temp
+            files. Blobs in the legacy Fernet format fall back to temp files.
+            Defaults to False.
+        metadata (dict, optional): Custom metadata of the blob when already
+            known, for example from a listing. Saves one lookup.
+        delete (bool, optional): Delete the encrypted blob and its DEK blob
+            once decrypted, in one batch request. Set to False to batch the
+            deletions of many blobs. Defaults to True.
+        blob (storage.Blob, optional): The blob with its properties loaded,
+            for example from a listing. Saves the metadata lookup, and the
+            size lookup of downloads via temp files.
+
+    Returns:
+        list[str]: encrypted blobs made obsolete by the decryption
     """
 
     logger.info(
         "Decrypting data: {} in bucket: {}"
         .format(blob_path, bucket_name))
 
-    # Create temp directory if not exists
-    temp_data_path = Path(temp_data)
-    if not temp_data_path.exists():
-        os.makedirs(temp_data_path)
-
-    # Download file to local disk
-    file_name = blob_path.split("/")[-1]
-    destination_path = temp_data_path / file_name
-    download_gcs_file(storage_client, bucket_name, blob_path, destination_path)
+    # Blobs encrypted with a session key name it in their metadata
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    if metadata is None:
+        if blob is None:
+            blob = bucket.get_blob(blob_path)
+        if blob is None:
+            raise FileNotFoundError("Blob {} not found in bucket {}".format(
+                blob_path, bucket_name))
+        metadata = blob.metadata
+    metadata = metadata or {}
+    session_dek_path = metadata.get(SESSION_DEK_METADATA)
+    compression = metadata.get(COMPRESSION_METADATA)
 
     # Load encrypted DEK + KEK path
-    dek_blob_path = ".".join(blob_path.split(".")[:-1]) + ".dek"
+    if session_dek_path is None:
+        dek_blob_path = ".".join(blob_path.split(".")[:-1]) + ".dek"
+    else:
+        dek_blob_path = session_dek_path
     dek = load_gcs_object(storage_client,
                           bucket_name, dek_blob_path)
     # kek_blob_path = ".".join(blob_path.split(".")[:-1]) + ".kek"
@@ -154,19 +768,86 @@ def decrypt_blob(
     # Decrypt DEK
     dek = decrypt_dek(kms_client, dek, project_id,
                       location_id, key_ring_id, key_id)
+    if session_dek_path is not None:
+        dek = derive_file_key(
+            dek, base64.b64decode(metadata[SESSION_SALT_METADATA]),
+            blob_path)
+
+    destination_blob_path = blob_path.replace(".encrypted", "")
+
+    encrypted = None
+    if streaming:
+        encrypted = IteratorReader(
+            iter_blob_ranges(storage_client, bucket_name, blob_path))
+        if not is_chunked_format(encrypted.peek(len(CHUNK_MAGIC))):
+            logger.info("Blob: {} uses the legacy format, decrypting via "
+                        "local temp files".format(blob_path))
+            encrypted.close()
+            encrypted = None
+
+    if encrypted is not None:
+        # Copy decrypted stream to GCS
+        uploader = bucket.blob(destination_blob_path)
+        uploader.chunk_size = STREAM_UPLOAD_CHUNK_SIZE
+        decrypted = IteratorReader(iter_decrypted_segments(encrypted, dek))
+        uploader.upload_from_file(
+            decompress_stream(decrypted, compression),
+            content_type=mimetypes.guess_type(destination_blob_path)[0])
+        invalidate_object_cache(bucket_name, [destination_blob_path])
+    else:
+        decrypt_blob_via_disk(storage_client, bucket_name, blob_path,
+                              destination_blob_path, dek, temp_data,
+                              compression=compression, blob=blob)
+
+    # Remove encrypted blobs, session DEKs are shared by the whole batch
+    obsolete = [blob_path]
+    if session_dek_path is None:
+        obsolete.append(dek_blob_path)
+    if delete:
+        for result in delete_blobs(storage_client, bucket_name, obsolete):
+            if result['error'] is not None:
+                raise result['error']
+    return obsolete
+
+
+def decrypt_blob_via_disk(storage_client, bucket_name, blob_path,
+                          destination_blob_path, dek, temp_data='temp_dir',
+                          compression=None, blob=None):
+    """
+    Downloads an encrypted blob to local disk, decrypts it and uploads the
+    decrypted copy to GCS.
+
+    Args:
+        storage_client (storage.Client): GCS client object
+        bucket_name (str): Name of bucket containing the blob
+        blob_path (str): Path to encrypted blob within bucket
+        destination_blob_path (str): Path for decrypted blob within bucket
+        dek (bytes): Plaintext DEK
+        temp_data (str, optional): Local directory for temporary files
+        compression (str, optional): Compression applied before encryption
+        blob (storage.Blob, optional): The encrypted blob with its
+            properties loaded, saves a lookup
+    """
+
+    # Create temp directory if not exists
+    temp_data_path = Path(temp_data)
+    if not temp_data_path.exists():
+        os.makedirs(temp_data_path)
+
+    # Download file to local disk
+    file_name = blob_path.split("/")[-1]
+    destination_path = temp_data_path / file_name
+    download_gcs_file(storage_client, bucket_name, blob_path, destination_path,
+                      blob=blob)
 
     # Decrypt file
-    decrypted_file_path = decrypt_file(str(destination_path), dek)
+    decrypted_file_path = decrypt_file(str(destination_path), dek,
+                                       compression=compression)
 
     # Copy file to GCS
-    destination_blob_path = blob_path.replace(".encrypted", "")
     upload_file(storage_client, bucket_name,
                 decrypted_file_path, destination_blob_path)
 
     # Remove local temp files
     os.remove(destination_path)
     os.remove(decrypted_file_path)
-
-    # Remove encrypted blobs
-    delete_blob(storage_client, bucket_name, blob_path)
-    delete_blob(storage_client, bucket_name, dek_blob_path)
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.gcpip')
+JOURNAL_FILE = 'uploads.sqlite'
+
+# Journal entry statuses
+IN_PROGRESS = 'in_progress'
+COMPLETE = 'complete'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS uploads (
+    bucket TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    source TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    session_url TEXT,
+    committed INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    state TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (bucket, destination)
+)
+'''
+
+
+def get_fingerprint(source_file_name, **options):
+    """
+    Identifies a local file version and the upload options applied to it.
+    A journal entry is only reused if the fingerprint is unchanged.
+
+    Args:
+        source_file_name (str): Local file path
+        **options: Upload options changing the uploaded bytes, such as
+            encryption or compression
+
+    Returns:
+        str: fingerprint of path, size, modification time and options
+    """
+
+    stat = os.stat(source_file_name)
+    return json.dumps({
+        'path': os.path.abspath(source_file_name),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'options': options,
+    }, sort_keys=True)
+
+
+class UploadJournal():
+    """
+    Local SQLite journal of resumable uploads. For each destination blob it
+    records the resumable session URI, the bytes committed by GCS and any
+    state needed to regenerate the same upload stream (for encrypted files,
+    the wrapped DEK and nonce prefix). Safe to share between the threads of
+    a batch upload.
+
+    Args:
+        state_dir (str): Directory holding the journal database
+    """
+
+    def __init__(self, state_dir=DEFAULT_STATE_DIR):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(_SCHEMA)
+
+    def get(self, bucket_name, destination_name, fingerprint):
+        """
+        Args:
+            bucket_name (str): Bucket name
+            destination_name (str): Blob name
+            fingerprint (str): Current fingerprint of the source file
+
+        Returns (dict): session_url, committed, status and state of the
+            upload, or None if there is no entry for this file version
+
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT fingerprint, session_url, committed, status, state '
+                'FROM uploads WHERE bucket = ? AND destination = ?',
+                (bucket_name, destination_name)).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        return {'session_url': row[1], 'committed': row[2],
+                'status': row[3],
+                'state': json.loads(row[4]) if row[4] else None}
+
+    def is_complete(self, bucket_name, destination_name, fingerprint):
+        """
+        Returns (bool): True if this file version was fully uploaded
+
+        """
+        entry = self.get(bucket_name, destination_name, fingerprint)
+        return entry is not None and entry['status'] == COMPLETE
+
+    def start(self, bucket_name, destination_name, source_file_name,
+              fingerprint, session_url, state=None):
+        """
+        Records a new resumable session, replacing any previous entry.
+        Args:
+            bucket_name (str): Bucket name
+            destination_name (str): Blob name
+            source_file_name (str): Local file path
+            fingerprint (str): Fingerprint of the source file
+            session_url (str): Resumable upload session URI
+            state (dict, optional): JSON serialisable stream state
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO uploads (bucket, destination, '
+                'source, fingerprint, session_url, committed, status, state, '
+                'updated) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)',
+                (bucket_name, destination_name, source_file_name,
+                 fingerprint, session_url, IN_PROGRESS,
+                 json.dumps(state) if state is not None else None,
+                 time.time()))
+
+    def set_committed(self, bucket_name, destination_name, committed):
+        """
+        Records the number of bytes persisted by GCS.
+        """
+        self._update(bucket_name, destination_name, 'committed = ?',
+                     (committed,))
+
+    def complete(self, bucket_name, destination_name):
+        """
+        Marks an upload as finished. Its session URI is no longer needed.
+        """
+        self._update(bucket_name, destination_name,
+                     'status = ?, session_url = NULL', (COMPLETE,))
+
+    def discard(self, bucket_name, destination_name):
+        """
+        Removes the entry of a destination blob.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM uploads WHERE bucket = ? AND destination = ?',
+                (bucket_name, destination_name))
+
+    def _update(self, bucket_name, destination_name, assignments, values):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE uploads SET {}, updated = ? '
+                'WHERE bucket = ? AND destination = ?'.format(assignments),
+                values + (time.time(), bucket_name, destination_name))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
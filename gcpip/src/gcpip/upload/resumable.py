@@ -0,0 +1,96 @@
+import logging
+from google.api_core.exceptions import NotFound, from_http_response
+
+logger = logging.getLogger(__name__)
+
+# Bytes sent per request. GCS needs every chunk but the last to be a
+# multiple of 256 KB.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# GCS status of a session that has committed part of the upload
+RESUME_INCOMPLETE = 308
+
+
+class ResumableSession():
+    """
+    Uploads a stream through an existing GCS resumable upload session,
+    following the documented protocol: the committed offset is queried with
+    an empty PUT and chunks are sent with a Content-Range header. Unlike
+    google.resumable_media uploads, a session created by an earlier process
+    can be picked up from its URL alone.
+
+    Args:
+        transport (requests.Session): Authorized HTTP transport, for example
+            from gcpip.utils.clients.get_http_session
+        session_url (str): URL of the resumable upload session
+        stream (file object): Seekable binary stream starting at offset 0
+        size (int, optional): Stream size in bytes if known
+        chunk_size (int, optional): Bytes sent per request.
+            Defaults to DEFAULT_CHUNK_SIZE.
+    """
+
+    def __init__(self, transport, session_url, stream, size=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.transport = transport
+        self.session_url = session_url
+        self.stream = stream
+        self.size = size
+        self.chunk_size = chunk_size
+        self.bytes_uploaded = 0
+        self.finished = False
+
+    def _put(self, data, content_range):
+        response = self.transport.request(
+            'PUT', self.session_url, data=data,
+            headers={'Content-Range': content_range})
+        if response.status_code in (200, 201):
+            self.finished = True
+        elif response.status_code == RESUME_INCOMPLETE:
+            # Range is missing while no byte has been committed
+            committed = response.headers.get('Range')
+            self.bytes_uploaded = 0 if committed is None else \
+                int(committed.split('-')[-1]) + 1
+        elif response.status_code in (404, 410):
+            raise NotFound('Resumable upload session {} expired'.format(
+                self.session_url), response=response)
+        else:
+            raise from_http_response(response)
+
+    def recover(self):
+        """
+        Asks GCS for the committed offset and seeks the stream to it. Sets
+        finished if the upload already completed.
+
+        Raises:
+            NotFound: if the session expired or was cancelled
+        """
+
+        self._put(b'', 'bytes */{}'.format(
+            '*' if self.size is None else self.size))
+        if not self.finished:
+            logger.debug('Session committed {} bytes'.format(
+                self.bytes_uploaded))
+            self.stream.seek(self.bytes_uploaded)
+
+    def transmit_next_chunk(self):
+        """
+        Sends the chunk at the committed offset. GCS may commit less than
+        it was sent, the stream is moved back to the committed offset.
+        """
+
+        start = self.bytes_uploaded
+        data = self.stream.read(self.chunk_size)
+        total = self.size
+        if total is None and len(data) < self.chunk_size:
+            total = start + len(data)
+
+        if data:
+            content_range = 'bytes {}-{}/{}'.format(
+                start, start + len(data) - 1, '*' if total is None else total)
+        else:
+            content_range = 'bytes */{}'.format(start)
+        self._put(data, content_range)
+
+        if not self.finished and \
+                self.bytes_uploaded != start + len(data):
+            self.stream.seek(self.bytes_uploaded)
@@ -1,32 +1,17 @@
 # TODO logging
 
 import logging
-from google.oauth2 import service_account
 from google.cloud import bigquery
+from gcpip.utils.clients import get_bq_client  # noqa: F401
 from gcpip.utils.storage import get_gcs_url
 
 logger = logging.getLogger(__name__)
 
-
-def get_bq_client(key_file):
-    """
-    Get authenticated BQ client object
-
-    Args:
-        key_file (str): Path to GCP authentication file
-
-    Returns:
-        google.cloud.bigquery.Client: BQ client object
-    """
-
-    logger.debug("Get Big Query Client")
-
-    credentials = service_account.Credentials.from_service_account_file(
-        key_file, scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    client = bigquery.Client(credentials=credentials,
-                             project=credentials.project_id)
-
-    return client
+# Limits of one BigQuery load job: source URIs (a wildcard URI counts once)
+# and total bytes of CSV files, see
+# https://cloud.google.com/bigquery/quotas#load_jobs
+MAX_LOAD_URIS = 10000
+MAX_LOAD_BYTES = 15 * 1000 ** 4
 
 
 def get_datasets(bq_client, project_id):
@@ -261,10 +246,28 @@ def gcs_csv_to_bq(bq_client, project_id, bucket_id,
         bq_client, project_id, dataset_id, table_id)
 
     # Setup load job
-    job_config = bigquery.LoadJobConfig()
-    job_config.skip_leading_rows = skip_leading_rows
-    job_config.source_format = 'CSV'
-    job_config.write_disposition = 'WRITE_EMPTY'
+    job_config = get_csv_load_job_config(skip_leading_rows)
 
     return bq_client.load_table_from_uri(gcs_url, table_reference,
                                          job_config=job_config)
+
+
+def get_csv_load_job_config(skip_leading_rows,
+                            write_disposition='WRITE_EMPTY'):
+    """
+    Get the job config of CSV load jobs
+
+    Args:
+        skip_leading_rows (int): Header rows to skip in every file
+        write_disposition (str, optional): Defaults to WRITE_EMPTY, failing
+            if the table has data.
+
+    Returns:
+        google.cloud.bigquery.job.LoadJobConfig: Load job config
+    """
+
+    job_config = bigquery.LoadJobConfig()
+    job_config.skip_leading_rows = skip_leading_rows
+    job_config.source_format = 'CSV'
+    job_config.write_disposition = write_disposition
+    return job_config
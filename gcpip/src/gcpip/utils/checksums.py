@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import logging
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Custom metadata holding digests of the plaintext for blobs whose stored
+# bytes differ from the local file (encrypted or compressed uploads)
+PLAINTEXT_CRC32C_METADATA = 'gcpip-plaintext-crc32c'
+PLAINTEXT_MD5_METADATA = 'gcpip-plaintext-md5'
+
+
+def compute_checksums(file_name, chunk_size=CHECKSUM_CHUNK_SIZE,
+                      algorithms=('md5', 'crc32c')):
+    """
+    Computes the MD5 and CRC32C digests of a local file in one streaming
+    pass. Digests are base64 encoded like the md5_hash and crc32c properties
+    of GCS blobs. CRC32C is only computed when google-crc32c is installed.
+
+    Args:
+        file_name (str): Local file path
+        chunk_size (int, optional): Bytes read per step
+        algorithms (tuple, optional): Digests to compute, 'md5' and/or
+            'crc32c'. Defaults to both.
+
+    Returns:
+        dict: base64 digests keyed by 'md5' and 'crc32c'
+    """
+
+    md5 = None
+    if 'md5' in algorithms:
+        md5 = hashlib.md5()
+    crc32c = None
+    if 'crc32c' in algorithms and google_crc32c is not None:
+        crc32c = google_crc32c.Checksum()
+
+    with open(file_name, 'rb') as file_obj:
+        while True:
+            data = file_obj.read(chunk_size)
+            if not data:
+                break
+            if md5 is not None:
+                md5.update(data)
+            if crc32c is not None:
+                crc32c.update(data)
+
+    checksums = {}
+    if md5 is not None:
+        checksums['md5'] = base64.b64encode(md5.digest()).decode('ascii')
+    if crc32c is not None:
+        checksums['crc32c'] = base64.b64encode(
+            crc32c.digest()).decode('ascii')
+    return checksums
+
+
+def get_plaintext_metadata(checksums):
+    """
+    Args:
+        checksums (dict): Digests from compute_checksums
+
+    Returns:
+        dict: custom blob metadata recording the plaintext digests
+    """
+
+    metadata = {PLAINTEXT_MD5_METADATA: checksums['md5']}
+    if 'crc32c' in checksums:
+        metadata[PLAINTEXT_CRC32C_METADATA] = checksums['crc32c']
+    return metadata
+
+
+def checksums_match(blob, checksums, plaintext=False):
+    """
+    Compares local digests with a blob. CRC32C is preferred, MD5 is used when
+    CRC32C is unavailable on either side (composite blobs have no MD5).
+
+    Args:
+        blob (storage.Blob): Blob with its properties loaded
+        checksums (dict): Digests from compute_checksums
+        plaintext (bool, optional): Compare with the plaintext digests in the
+            custom metadata instead of the stored bytes. Defaults to False.
+
+    Returns:
+        bool: True if the blob holds the same content as the local file
+    """
+
+    if plaintext:
+        metadata = blob.metadata or {}
+        remote = {'crc32c': metadata.get(PLAINTEXT_CRC32C_METADATA),
+                  'md5': metadata.get(PLAINTEXT_MD5_METADATA)}
+    else:
+        remote = {'crc32c': blob.crc32c, 'md5': blob.md5_hash}
+
+    for name in ('crc32c', 'md5'):
+        if remote[name] is not None and name in checksums:
+            return remote[name] == checksums[name]
+
+    logger.debug('No comparable checksum on blob: {}'.format(blob.name))
+    return False
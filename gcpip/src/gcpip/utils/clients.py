@@ -0,0 +1,215 @@
+import logging
+import threading
+import google.auth
+import requests
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCOPES = ("https://www.googleapis.com/auth/cloud-platform",)
+
+# Connections kept per host by the shared HTTP session. Sized for the thread
+# pools of batch uploads and decryptions, each running composite uploads.
+HTTP_POOL_SIZE = 32
+
+# Registry of credentials, HTTP sessions and clients. Credentials are keyed
+# by key file and scopes, clients additionally by project (and region for
+# Dataproc), so every caller with the same settings shares one token, one
+# connection pool per HTTP API and one gRPC channel per gRPC API.
+_credentials = {}
+_sessions = {}
+_clients = {}
+_lock = threading.RLock()
+
+# Clients returned for every key file, project and region instead of real
+# ones, keyed by kind ('storage', 'bigquery', 'kms', 'dataproc' or 'http'
+# for the HTTP session). Used to run gcpip against the local fakes of
+# gcpip.testing.
+_overrides = {}
+
+
+def get_credentials(key_file=None, scopes=DEFAULT_SCOPES):
+    """
+    Get shared credentials. The key file is parsed once and the token is
+    refreshed once for every client built on the credentials.
+
+    Args:
+        key_file (str, optional): Path to GCP service account key file.
+            Application default credentials are used if not given.
+        scopes (tuple, optional): OAuth scopes
+
+    Returns:
+        tuple: credentials and their default project ID
+    """
+
+    cache_key = (key_file, tuple(scopes))
+    with _lock:
+        if cache_key not in _credentials:
+            if key_file is None:
+                logger.debug("Loading application default credentials")
+                credentials, project = google.auth.default(
+                    scopes=list(scopes))
+            else:
+                logger.debug("Loading credentials from: {}".format(key_file))
+                credentials = service_account.Credentials \
+                    .from_service_account_file(key_file, scopes=list(scopes))
+                project = credentials.project_id
+            _credentials[cache_key] = (credentials, project)
+        return _credentials[cache_key]
+
+
+def get_http_session(key_file=None, scopes=DEFAULT_SCOPES):
+    """
+    Get the authorized HTTP session shared by the JSON API clients (GCS and
+    BigQuery) of a set of credentials, with a connection pool large enough
+    for threaded use.
+
+    Returns:
+        google.auth.transport.requests.AuthorizedSession: HTTP session
+    """
+
+    cache_key = (key_file, tuple(scopes))
+    with _lock:
+        if 'http' in _overrides:
+            return _overrides['http']
+        if cache_key not in _sessions:
+            credentials, _ = get_credentials(key_file, scopes)
+            session = AuthorizedSession(credentials)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            _sessions[cache_key] = session
+        return _sessions[cache_key]
+
+
+def _get_client(kind, key_file, project, scopes, build, extra=None):
+
+    cache_key = (kind, key_file, project, tuple(scopes), extra)
+    with _lock:
+        if kind in _overrides:
+            return _overrides[kind]
+        if cache_key not in _clients:
+            logger.debug("Creating {} client".format(kind))
+            credentials, default_project = get_credentials(key_file, scopes)
+            _clients[cache_key] = build(credentials,
+                                        project or default_project)
+        return _clients[cache_key]
+
+
+def get_storage_client(key_file=None, project=None, scopes=DEFAULT_SCOPES):
+    """
+    Get the shared GCS client for a key file, project and scopes
+
+    Args:
+        key_file (str, optional): Path to GCP service account key file.
+            Application default credentials are used if not given.
+        project (str, optional): Project ID. Defaults to the project of the
+            credentials.
+        scopes (tuple, optional): OAuth scopes
+
+    Returns:
+        google.cloud.storage.Client: GCS client object
+    """
+
+    # Client libraries are imported by the getters, so a command only loads
+    # those of the APIs it uses: BigQuery and Dataproc alone take most of a
+    # second to import
+    from google.cloud import storage
+
+    return _get_client(
+        'storage', key_file, project, scopes,
+        lambda credentials, project: storage.Client(
+            project=project, credentials=credentials,
+            _http=get_http_session(key_file, scopes)))
+
+
+def get_bq_client(key_file=None, project=None, scopes=DEFAULT_SCOPES):
+    """
+    Get the shared BigQuery client for a key file, project and scopes
+
+    Returns:
+        google.cloud.bigquery.Client: BQ client object
+    """
+
+    from google.cloud import bigquery
+
+    return _get_client(
+        'bigquery', key_file, project, scopes,
+        lambda credentials, project: bigquery.Client(
+            project=project, credentials=credentials,
+            _http=get_http_session(key_file, scopes)))
+
+
+def get_kms_client(key_file=None, scopes=DEFAULT_SCOPES):
+    """
+    Get the shared KMS client for a key file and scopes. The client keeps one
+    gRPC channel, which multiplexes concurrent calls from many threads.
+
+    Returns:
+        google.cloud.kms_v1.KeyManagementServiceClient: KMS client object
+    """
+
+    from google.cloud import kms_v1
+
+    return _get_client(
+        'kms', key_file, None, scopes,
+        lambda credentials, project: kms_v1.KeyManagementServiceClient(
+            credentials=credentials))
+
+
+def get_dataproc_job_client(region, key_file=None, scopes=DEFAULT_SCOPES):
+    """
+    Get the shared Dataproc job client of a region
+
+    Args:
+        region (str): Dataproc region, e.g. europe-west2
+        key_file (str, optional): Path to GCP service account key file
+        scopes (tuple, optional): OAuth scopes
+
+    Returns:
+        google.cloud.dataproc_v1.JobControllerClient: Dataproc job client
+    """
+
+    from google.cloud import dataproc_v1
+    from google.cloud.dataproc_v1.gapic.transports import (
+        job_controller_grpc_transport)
+
+    return _get_client(
+        'dataproc', key_file, None, scopes,
+        lambda credentials, project: dataproc_v1.JobControllerClient(
+            job_controller_grpc_transport.JobControllerGrpcTransport(
+                address='{}-dataproc.googleapis.com:443'.format(region),
+                credentials=credentials)),
+        extra=region)
+
+
+def override_client(kind, client):
+    """
+    Make every getter of a kind of client return the given client, for
+    example a fake from gcpip.testing. Cleared by clear_clients.
+
+    Args:
+        kind (str): 'storage', 'bigquery', 'kms', 'dataproc' or 'http'
+        client: Client to return, None removes the override
+    """
+
+    with _lock:
+        if client is None:
+            _overrides.pop(kind, None)
+        else:
+            _overrides[kind] = client
+
+
+def clear_clients():
+    """
+    Drop every cached client, HTTP session, credentials and override
+    """
+
+    with _lock:
+        _overrides.clear()
+        for session in _sessions.values():
+            session.close()
+        _clients.clear()
+        _sessions.clear()
+        _credentials.clear()
@@ -0,0 +1,124 @@
+import logging
+import zlib
+from gcpip.upload.defaults import COMPRESSIONS
+from gcpip.utils.streams import IteratorReader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _check_compression(compression):
+
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unsupported compression: {}. Use one of {}'.format(
+            compression, ', '.join(COMPRESSIONS)))
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError(
+            'zstd compression requires the zstandard package')
+
+
+def iter_compressed(input_obj, compression, chunk_size=COMPRESSION_CHUNK_SIZE):
+    """
+    Compresses a binary stream chunk by chunk
+
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        compression (str): 'gzip' or 'zstd'
+        chunk_size (int, optional): Bytes read per step
+
+    Returns:
+        generator: compressed bytes
+    """
+
+    _check_compression(compression)
+    if compression == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    else:
+        compressor = zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL).compressobj()
+
+    while True:
+        data = input_obj.read(chunk_size)
+        if not data:
+            break
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_decompressed(input_obj, compression,
+                      chunk_size=COMPRESSION_CHUNK_SIZE):
+    """
+    Decompresses a binary stream chunk by chunk
+
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        compression (str): 'gzip' or 'zstd'
+        chunk_size (int, optional): Bytes read per step
+
+    Returns:
+        generator: decompressed bytes
+    """
+
+    _check_compression(compression)
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(31)
+    else:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    while True:
+        data = input_obj.read(chunk_size)
+        if not data:
+            break
+        decompressed = decompressor.decompress(data)
+        if decompressed:
+            yield decompressed
+    if compression == 'gzip':
+        remaining = decompressor.flush()
+        if remaining:
+            yield remaining
+
+
+def compress_stream(input_obj, compression=None):
+    """
+    Wraps a binary stream so reads return compressed data
+
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        compression (str, optional): 'gzip', 'zstd' or None for no
+            compression
+
+    Returns:
+        file object: Compressed stream, or input_obj if compression is None
+    """
+
+    if compression is None:
+        return input_obj
+    return IteratorReader(iter_compressed(input_obj, compression))
+
+
+def decompress_stream(input_obj, compression=None):
+    """
+    Wraps a binary stream so reads return decompressed data
+
+    Args:
+        input_obj (file object): Binary stream opened for reading
+        compression (str, optional): 'gzip', 'zstd' or None for no
+            compression
+
+    Returns:
+        file object: Decompressed stream, or input_obj if compression is None
+    """
+
+    if compression is None:
+        return input_obj
+    return IteratorReader(iter_decompressed(input_obj, compression))
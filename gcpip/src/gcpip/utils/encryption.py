@@ -1,30 +1,23 @@
 import logging
-from google.cloud import kms_v1
-from google.cloud.kms_v1 import enums
-from google.oauth2 import service_account
-from google.cloud import storage
+import threading
+import time
+from google.api_core.exceptions import AlreadyExists, NotFound
+from gcpip.utils.clients import get_kms_client  # noqa: F401
+from gcpip.utils.storage import get_bucket_handle, api_calls
 
 logger = logging.getLogger(__name__)
 
+# Seconds a key ring or key is trusted to exist after it was last checked
+KMS_CACHE_TTL = 3600
 
-def get_kms_client(key_file):
-    """
-    Get authenticated KMS client object
-
-    Args:
-        key_file (str): Path to GCP authentication file
-
-    Returns:
-        google.cloud.kms_v1.KeyManagementServiceClient: KMS client object
-    """
-
-    logger.debug("Creating KMS client")
-
-    credentials = service_account.Credentials.from_service_account_file(
-        key_file, scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    client = kms_v1.KeyManagementServiceClient(credentials=credentials)
-
-    return client
+# Process-wide cache of KMS resource names known to exist, mapped to the
+# time they expire from the cache, and names created by this process.
+# _kms_cache_lock only guards these dicts and is never held across a KMS
+# call; checks of one resource are serialized by its own lock in _kms_locks.
+_kms_cache = {}
+_kms_created = set()
+_kms_locks = {}
+_kms_cache_lock = threading.Lock()
 
 
 def get_kms_key_ring_path(kms_client, project_id, location_id, key_ring_id):
@@ -112,10 +105,11 @@ def create_kms_key(kms_client, project_id, location_id, key_ring_id, key_id):
         str: key ring resource name
     """
 
+    from google.cloud.kms_v1 import enums
+
     logger.debug("Creating KMS key: {}".format(key_id))
 
     key_ring = kms_client.key_ring_path(project_id, location_id, key_ring_id)
-
     purpose = enums.CryptoKey.CryptoKeyPurpose.ENCRYPT_DECRYPT
     key_params = {'purpose': purpose}
     response = kms_client.create_crypto_key(
@@ -163,9 +157,114 @@ def get_kms_keys(kms_client, project, location_id, key_ring_id):
     return [x.name.split("/")[-1] for x in kms_client.list_crypto_keys(parent)]
 
 
+def invalidate_kms_cache(resource_name=None):
+    """
+    Forget cached KMS key rings and keys, forcing the next check to go to KMS.
+    Resources created by this process are forgotten as well, so they may be
+    created again.
+
+    Args:
+        resource_name (str, optional): Key ring or key resource name to
+            forget. Forgets everything if not given.
+    """
+
+    with _kms_cache_lock:
+        if resource_name is None:
+            _kms_cache.clear()
+            _kms_created.clear()
+        else:
+            _kms_cache.pop(resource_name, None)
+            _kms_created.discard(resource_name)
+
+
+def _is_cached(resource_name):
+    expiry = _kms_cache.get(resource_name)
+    return expiry is not None and expiry > time.monotonic()
+
+
+def _get_resource_lock(resource_name):
+    with _kms_cache_lock:
+        return _kms_locks.setdefault(resource_name, threading.Lock())
+
+
+def _ensure_kms_resource(resource_name, get_resource, create_resource, ttl):
+    """
+    Checks a KMS resource exists, creating it if missing. Positive results are
+    cached for ttl seconds and a resource is created at most once per process.
+    Concurrent callers wait for a check of the same resource only, checks of
+    other resources go ahead.
+    """
+
+    if _is_cached(resource_name):
+        return
+
+    with _get_resource_lock(resource_name):
+        if _is_cached(resource_name):
+            return
+        try:
+            get_resource(resource_name)
+        except NotFound:
+            with _kms_cache_lock:
+                created = resource_name in _kms_created
+            if created:
+                raise RuntimeError(
+                    "KMS resource {} was created by this process but no "
+                    "longer exists".format(resource_name))
+            try:
+                create_resource()
+            except AlreadyExists:
+                pass
+            with _kms_cache_lock:
+                _kms_created.add(resource_name)
+        with _kms_cache_lock:
+            _kms_cache[resource_name] = time.monotonic() + ttl
+
+
+def ensure_kms_key(kms_client, project_id, location_id, key_ring_id, key_id,
+                   ttl=KMS_CACHE_TTL):
+    """
+    Make sure a KMS key ring and key exist, creating them if missing.
+    Uses single resource lookups instead of listing, and remembers keys known
+    to exist for ttl seconds so repeated uploads make no KMS calls.
+
+    Args:
+        kms_client (kms_v1.KeyManagementServiceClient): KMS client object
+        project_id (str): Name of GCP project
+        location_id (str): KMS key location
+        key_ring_id (str): KMS key ring ID
+        key_id (str): KMS key ID
+        ttl (int, optional): Seconds to cache a positive check.
+            Defaults to KMS_CACHE_TTL.
+
+    Returns:
+        str: KMS key resource name
+    """
+
+    key_ring_name = get_kms_key_ring_path(
+        kms_client, project_id, location_id, key_ring_id)
+    key_name = get_kms_key_path(
+        kms_client, project_id, location_id, key_ring_id, key_id)
+
+    if _is_cached(key_name):
+        return key_name
+
+    _ensure_kms_resource(
+        key_ring_name, kms_client.get_key_ring,
+        lambda: create_kms_key_ring(
+            kms_client, project_id, location_id, key_ring_id), ttl)
+    _ensure_kms_resource(
+        key_name, kms_client.get_crypto_key,
+        lambda: create_kms_key(
+            kms_client, project_id, location_id, key_ring_id, key_id), ttl)
+
+    return key_name
+
+
 def get_blob_kek_details(storage_client, bucket_name, blob_path):
 
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = storage.Blob(blob_path, bucket)
+    # The object GET loads the key name, an unloaded Blob would return None
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob = bucket.get_blob(blob_path)
 
     return blob.kms_key_name
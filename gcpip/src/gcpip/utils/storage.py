@@ -1,30 +1,243 @@
 import logging
+import os
+import random
+import threading
+import time
 import datetime as dt
-import numpy as np
-from google.cloud import storage
-from google.oauth2 import service_account
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions
 from google.api_core.exceptions import Conflict
+from google.cloud import storage
+from google.cloud.storage.batch import Batch
+from google.resumable_media import DataCorruption
+from gcpip.utils.clients import get_storage_client  # noqa: F401
+from gcpip.utils.checksums import (
+    compute_checksums, checksums_match, google_crc32c)
 
 
 logger = logging.getLogger(__name__)
 
+# Bytes fetched per ranged GET when streaming a blob
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Blobs from this size are downloaded as concurrent ranged slices
+SLICED_DOWNLOAD_THRESHOLD = 256 * 1024 * 1024
+SLICE_SIZE = 64 * 1024 * 1024
+SLICED_DOWNLOAD_WORKERS = 8
+
+# Operations sent per GCS JSON batch request, the documented maximum
+BATCH_SIZE = 100
+
+# Seconds loaded bucket metadata stays cached
+BUCKET_CACHE_TTL = 300
+
+# Process-wide cache of loaded buckets, keyed by project and bucket name and
+# mapped to the time they expire from the cache and the bucket
+_bucket_cache = {}
+_bucket_cache_lock = threading.Lock()
+
+# Process-wide cache of object lookups, keyed by project, bucket and blob
+# name and mapped to the time they expire from the cache and the object
+# generation, None for objects that do not exist
+_object_cache = {}
+_object_cache_lock = threading.Lock()
+
+
+class ApiCallCounter():
+    """
+    Thread-safe count of GCS API calls by kind: calls saved compared with
+    the bucket GET that object operations used to start with, the bucket
+    and object caches and batch requests, and the lookups made in place of
+    the saved calls, such as cache misses. Other requests of the storage
+    library are not counted.
+    """
+
+    def __init__(self):
+        self.made = Counter()
+        self.saved = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, kind, saved=False):
+        """
+        Args:
+            kind (str): API call, e.g. 'buckets.get'
+            saved (bool, optional): The call was avoided. Defaults to False.
+        """
+        with self.lock:
+            if saved:
+                self.saved[kind] += 1
+            else:
+                self.made[kind] += 1
+
+    def snapshot(self):
+        """
+        Returns (dict): copies of the made and saved counts
+
+        """
+        with self.lock:
+            return {'made': dict(self.made), 'saved': dict(self.saved)}
+
+    def reset(self):
+        with self.lock:
+            self.made.clear()
+            self.saved.clear()
+
+    def summary(self):
+        """
+        Returns (str): saved counts per kind of call. Made counts are left
+            out, they miss the requests the storage library makes.
+
+        """
+        saved = self.snapshot()['saved']
+        return ', '.join('{}: {} saved'.format(kind, saved[kind])
+                         for kind in sorted(saved)) or 'none'
+
+
+# API calls of the running command, logged by the runner when it finishes
+api_calls = ApiCallCounter()
 
-def get_storage_client(key_file):
+
+def get_bucket_handle(storage_client, bucket_name):
     """
-    This method create google storage client connection.
+    Gets a bucket handle without loading the bucket. Object operations on
+    the handle go straight to the object endpoints, so a missing bucket only
+    surfaces as NotFound from the first of them. Use get_bucket_metadata
+    when bucket properties are needed.
+
     Args:
-        key_file (JSON): Google Cloud Key (Credential) file
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+
+    Returns:
+        storage.Bucket: Bucket handle
+    """
+
+    return storage_client.bucket(bucket_name)
+
+
+def get_bucket_metadata(storage_client, bucket_name, ttl=BUCKET_CACHE_TTL):
+    """
+    Gets a bucket with its properties loaded, such as location, storage
+    class or default KMS key. Buckets are cached for ttl seconds.
 
-    Returns (storage.Client): client object.
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        ttl (float, optional): Seconds the bucket stays cached.
+            Defaults to BUCKET_CACHE_TTL.
 
+    Returns:
+        storage.Bucket: Loaded bucket
     """
 
-    credentials = service_account.Credentials.from_service_account_file(
-        key_file, scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    client = storage.Client(
-        project=credentials.project_id, credentials=credentials)
+    cache_key = (storage_client.project, bucket_name)
+    with _bucket_cache_lock:
+        entry = _bucket_cache.get(cache_key)
+    if entry is not None and entry[0] > time.monotonic():
+        api_calls.record('buckets.get', saved=True)
+        return entry[1]
+
+    logger.debug("Loading bucket metadata: {}".format(bucket_name))
+    api_calls.record('buckets.get')
+    bucket = storage_client.get_bucket(bucket_name)
+    with _bucket_cache_lock:
+        _bucket_cache[cache_key] = (time.monotonic() + ttl, bucket)
+    return bucket
 
-    return client
+
+def invalidate_bucket_cache(bucket_name=None):
+    """
+    Forget cached bucket metadata, forcing the next lookup to go to GCS.
+
+    Args:
+        bucket_name (str, optional): Bucket to forget. Defaults to all.
+    """
+
+    with _bucket_cache_lock:
+        if bucket_name is None:
+            _bucket_cache.clear()
+        else:
+            for cache_key in [k for k in _bucket_cache
+                              if k[1] == bucket_name]:
+                del _bucket_cache[cache_key]
+
+
+def get_blob_generation(storage_client, bucket_name, blob_path, ttl=0):
+    """
+    Looks up one object with a single metadata request, whatever the number
+    of objects in the bucket. With a ttl, lookups, including of missing
+    objects, are cached for ttl seconds. Without one the lookup always goes
+    to GCS. Deletions and uploads made through gcpip drop cached entries.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_path (str): Path to blob within bucket
+        ttl (float, optional): Seconds the lookup stays cached.
+            Defaults to 0, not cached.
+
+    Returns:
+        int: generation of the object, None if it does not exist
+    """
+
+    cache_key = (storage_client.project, bucket_name, blob_path)
+    if ttl > 0:
+        with _object_cache_lock:
+            entry = _object_cache.get(cache_key)
+        if entry is not None and entry[0] > time.monotonic():
+            api_calls.record('objects.get', saved=True)
+            return entry[1]
+
+    logger.debug("Looking up blob: {} in bucket: {}".format(
+        blob_path, bucket_name))
+    api_calls.record('objects.get')
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob = bucket.get_blob(blob_path)
+    generation = None if blob is None else blob.generation
+    if ttl > 0:
+        with _object_cache_lock:
+            _object_cache[cache_key] = (time.monotonic() + ttl, generation)
+    return generation
+
+
+def blob_exists(storage_client, bucket_name, blob_path, ttl=0):
+    """
+    Checks whether one object exists, see get_blob_generation.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_path (str): Path to blob within bucket
+        ttl (float, optional): Seconds the lookup stays cached.
+            Defaults to 0, not cached.
+
+    Returns:
+        bool: True if the object exists
+    """
+
+    return get_blob_generation(storage_client, bucket_name, blob_path,
+                               ttl=ttl) is not None
+
+
+def invalidate_object_cache(bucket_name=None, blob_paths=None):
+    """
+    Forget cached object lookups, forcing the next lookup to go to GCS.
+
+    Args:
+        bucket_name (str, optional): Bucket to forget. Defaults to all.
+        blob_paths (list[str], optional): Objects of the bucket to forget.
+            Defaults to all.
+    """
+
+    with _object_cache_lock:
+        if bucket_name is None:
+            _object_cache.clear()
+            return
+        blob_paths = None if blob_paths is None else set(blob_paths)
+        for cache_key in [k for k in _object_cache if k[1] == bucket_name
+                          and (blob_paths is None or k[2] in blob_paths)]:
+            del _object_cache[cache_key]
 
 
 def create_bucket(storage_client, project_name, bucket_name, location=None,
@@ -53,7 +266,7 @@ def create_bucket(storage_client, project_name, bucket_name, location=None,
     except Conflict:
         bucket_name = (
             bucket_name + project_name + str(dt.datetime.now().date())
-            + str(np.random.randint(1000, 9999)))
+            + str(random.randrange(1000, 10000)))
         response = storage_client.create_bucket(
             bucket_name, project=project_name)
 
@@ -73,33 +286,173 @@ def delete_bucket(storage_client, project_name, bucket_name, force=False):
     """
 
     logger.debug("Deleting bucket: {}".format(bucket_name))
+    api_calls.record('buckets.get', saved=True)
 
-    bucket = storage_client.get_bucket(bucket_name)
+    invalidate_bucket_cache(bucket_name)
+    invalidate_object_cache(bucket_name)
+    bucket = get_bucket_handle(storage_client, bucket_name)
     bucket.delete(force=force)
 
 
 def download_gcs_file(storage_client, bucket_name, blob_path,
-                      destination_path):
+                      destination_path,
+                      sliced_threshold=SLICED_DOWNLOAD_THRESHOLD,
+                      workers=SLICED_DOWNLOAD_WORKERS, blob=None, size=None):
     """
-    Downloads GCS blob as local file
+    Downloads GCS blob as local file. Blobs of sliced_threshold bytes or
+    more are downloaded with download_blob_sliced. Choosing needs the blob
+    size, which costs one lookup unless the blob or its size is given.
 
     Args:
         storage_client (storage.Client): GCP storage client object
         bucket_name (str): Bucket name
         blob_path (str): Path to blob within bucket
         destination_file_name (str): Local path to download file
+        sliced_threshold (int, optional): Size in bytes from which the blob
+            is downloaded as concurrent slices. None disables them.
+        workers (int, optional): Number of concurrent slice downloads
+        blob (storage.Blob, optional): The blob with its properties loaded,
+            for example from a listing
+        size (int, optional): Blob size in bytes when known. Blobs below
+            sliced_threshold are then downloaded without a lookup.
     """
 
     logger.debug("Downloading blob: {} to: {}".format(
         blob_path, destination_path))
 
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = storage.Blob(blob_path, bucket)
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    sliced = sliced_threshold is not None and hasattr(os, 'pwrite')
+    if sliced and blob is None and (size is None or size >= sliced_threshold):
+        # The size is needed to choose, the loaded blob is downloaded
+        api_calls.record('objects.get')
+        blob = bucket.get_blob(blob_path)
+        if blob is None:
+            raise FileNotFoundError("Blob {} not found in bucket {}".format(
+                blob_path, bucket_name))
+    elif sliced:
+        api_calls.record('objects.get', saved=True)
+
+    # Ranges of gzip encoded blobs would be served decompressed
+    if sliced and blob is not None and blob.size >= sliced_threshold \
+            and not blob.content_encoding:
+        download_blob_sliced(blob, destination_path, workers=workers)
+        return
+    if blob is None:
+        blob = bucket.blob(blob_path)
 
     with open(destination_path, "wb") as file_obj:
         storage_client.download_blob_to_file(blob, file_obj)
 
 
+class _PositionedWriter():
+    """
+    File-like object writing at increasing offsets of a file descriptor with
+    os.pwrite, so slices can be written to one file concurrently
+    """
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        return len(data)
+
+
+def download_blob_sliced(blob, destination_path,
+                         workers=SLICED_DOWNLOAD_WORKERS,
+                         slice_size=SLICE_SIZE):
+    """
+    Downloads a blob as concurrent ranged GETs written with positioned
+    writes into a preallocated file, then verifies the CRC32C of the whole
+    file (MD5 if google-crc32c is not installed). Slices are pinned to the
+    generation of the blob. The file is removed if a slice fails or the
+    checksum does not match.
+
+    Args:
+        blob (storage.Blob): Blob with its properties loaded
+        destination_path (str): Local path to download file
+        workers (int, optional): Number of concurrent slice downloads
+        slice_size (int, optional): Bytes per ranged GET
+
+    Raises:
+        DataCorruption: the file does not match the blob checksum
+    """
+
+    ranges = [(start, min(start + slice_size, blob.size) - 1)
+              for start in range(0, blob.size, slice_size)]
+    logger.debug("Downloading {} slices of {} with {} workers".format(
+        len(ranges), blob.name, workers))
+
+    def download_slice(byte_range):
+        part = blob.bucket.blob(blob.name, generation=blob.generation)
+        part.download_to_file(
+            _PositionedWriter(fd, byte_range[0]), start=byte_range[0],
+            end=byte_range[1], raw_download=True, checksum=None)
+
+    fd = os.open(destination_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 0o666)
+    try:
+        os.ftruncate(fd, blob.size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(download_slice, ranges))
+    except BaseException:
+        os.remove(destination_path)
+        raise
+    finally:
+        os.close(fd)
+
+    algorithms = ('crc32c',) if google_crc32c is not None else ('md5',)
+    if google_crc32c is None and blob.md5_hash is None:
+        logger.warning("Cannot verify {}: google-crc32c is not installed and "
+                       "the blob has no MD5".format(blob.name))
+        return
+    checksums = compute_checksums(destination_path, algorithms=algorithms)
+    if not checksums_match(blob, checksums):
+        os.remove(destination_path)
+        raise DataCorruption(None, "Checksum of {} does not match blob {}"
+                             .format(destination_path, blob.name))
+
+
+def iter_blob_ranges(storage_client, bucket_name, blob_path,
+                     chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Streams a blob as consecutive ranged downloads, so only one chunk is held
+    in memory at a time. Reads are pinned to the blob generation seen when
+    the stream starts.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_path (str): Path to blob within bucket
+        chunk_size (int, optional): Bytes per ranged download.
+            Defaults to DOWNLOAD_CHUNK_SIZE.
+
+    Returns:
+        generator: blob contents as bytes chunks
+    """
+
+    logger.debug("Streaming blob: {} in chunks of {} bytes".format(
+        blob_path, chunk_size))
+
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob = bucket.get_blob(blob_path)
+    if blob is None:
+        raise FileNotFoundError(
+            "Blob {} not found in bucket {}".format(blob_path, bucket_name))
+
+    start = 0
+    while start < blob.size:
+        end = min(start + chunk_size, blob.size) - 1
+        yield blob.download_as_string(start=start, end=end)
+        start = end + 1
+
+
 def load_gcs_object(storage_client, bucket_name, blob_path):
     """
     Loads blob object as bytes
@@ -116,8 +469,9 @@ def load_gcs_object(storage_client, bucket_name, blob_path):
     logger.debug("Loading GCS object: {}".format(
         blob_path))
 
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = storage.Blob(blob_path, bucket)
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob = bucket.blob(blob_path)
 
     return blob.download_as_string()
 
@@ -135,9 +489,189 @@ def delete_blob(storage_client, bucket_name, blob_path):
     logger.debug("Deleting blob: {} from bucket: {}".format(
         bucket_name, blob_path))
 
-    bucket = storage_client.get_bucket(bucket_name)
-    blob = storage.Blob(blob_path, bucket)
+    api_calls.record('buckets.get', saved=True)
+    bucket = get_bucket_handle(storage_client, bucket_name)
+    blob = bucket.blob(blob_path)
     blob.delete()
+    invalidate_object_cache(bucket_name, [blob_path])
+
+
+class _CollectingBatch(Batch):
+    """
+    Batch keeping the response of every deferred request. The library batch
+    raises on the first failed request, losing the status of the others.
+    It relies on Batch.finish handing the responses to _finish_futures, as
+    google-cloud-storage does since 1.0.
+    """
+
+    def __init__(self, client):
+        if not hasattr(Batch, '_finish_futures'):
+            raise RuntimeError(
+                'google-cloud-storage {} does not pass batch responses to '
+                'Batch._finish_futures'.format(storage.__version__))
+        super().__init__(client)
+
+    def _finish_futures(self, responses, raise_exception=True):
+        self.responses = responses
+        for target_object, response in zip(self._target_objects, responses):
+            if target_object is not None and \
+                    200 <= response.status_code < 300:
+                target_object._properties = response.json()
+
+
+def _run_batches(storage_client, bucket_name, blob_paths, kind, operation,
+                 batch_size=BATCH_SIZE):
+    """
+    Runs one deferred operation per blob in GCS JSON batch requests of up to
+    batch_size operations. The batch stack of a client is thread-local, so
+    other threads using storage_client are never deferred into the batches.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_paths (list[str]): Paths to blobs within bucket
+        kind (str): API call of the operation, e.g. 'objects.delete'
+        operation (callable): Issues the request of one blob
+        batch_size (int, optional): Operations per batch request
+
+    Returns:
+        list[tuple]: blob, and response or exception of its request, in the
+            order of blob_paths
+    """
+
+    bucket = storage.Bucket(storage_client, name=bucket_name)
+
+    outcomes = []
+    for start in range(0, len(blob_paths), batch_size):
+        blobs = [bucket.blob(x) for x in blob_paths[start:start + batch_size]]
+        logger.debug("Sending batch of {} {} requests".format(
+            len(blobs), kind))
+        batch = _CollectingBatch(storage_client)
+        api_calls.record('batch')
+        try:
+            with batch:
+                for blob in blobs:
+                    operation(blob)
+                    api_calls.record(kind, saved=True)
+        except exceptions.GoogleAPICallError as error:
+            # The batch request itself failed, every operation in it did
+            outcomes.extend((blob, error) for blob in blobs)
+            continue
+        outcomes.extend(zip(blobs, batch.responses))
+    return outcomes
+
+
+def _get_batch_error(outcome):
+    """
+    Returns the exception of a failed operation, None if it succeeded
+    """
+
+    if isinstance(outcome, Exception):
+        return outcome
+    if 200 <= outcome.status_code < 300:
+        return None
+    return exceptions.from_http_response(outcome)
+
+
+def delete_blobs(storage_client, bucket_name, blob_paths,
+                 ignore_missing=False, batch_size=BATCH_SIZE):
+    """
+    Deletes blobs with batch requests of up to batch_size deletions each.
+    A failed deletion does not stop the others, it is reported in its
+    result.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_paths (list[str]): Paths to blobs within bucket
+        ignore_missing (bool, optional): Do not report blobs that do not
+            exist. Defaults to False.
+        batch_size (int, optional): Operations per batch request.
+            Defaults to BATCH_SIZE.
+
+    Returns:
+        list[dict]: blob and error (None on success) of every deletion, in
+            the order of blob_paths
+    """
+
+    logger.debug("Deleting {} blobs from bucket: {}".format(
+        len(blob_paths), bucket_name))
+
+    blob_paths = list(blob_paths)
+    outcomes = _run_batches(storage_client, bucket_name, blob_paths,
+                            'objects.delete', lambda blob: blob.delete(),
+                            batch_size)
+    invalidate_object_cache(bucket_name, blob_paths)
+    results = []
+    for blob, outcome in outcomes:
+        error = _get_batch_error(outcome)
+        if ignore_missing and isinstance(error, exceptions.NotFound):
+            error = None
+        results.append({'blob': blob.name, 'error': error})
+    return results
+
+
+def patch_blobs_metadata(storage_client, bucket_name, metadata,
+                         batch_size=BATCH_SIZE):
+    """
+    Updates the custom metadata of blobs with batch requests of up to
+    batch_size patches each. Keys set to None are removed from a blob.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        metadata (dict): Custom metadata to set, keyed by blob path
+        batch_size (int, optional): Operations per batch request.
+            Defaults to BATCH_SIZE.
+
+    Returns:
+        list[dict]: blob and error (None on success) of every patch
+    """
+
+    logger.debug("Patching metadata of {} blobs in bucket: {}".format(
+        len(metadata), bucket_name))
+
+    def patch(blob):
+        blob.metadata = metadata[blob.name]
+        blob.patch()
+
+    outcomes = _run_batches(storage_client, bucket_name, list(metadata),
+                            'objects.patch', patch, batch_size)
+    return [{'blob': blob.name, 'error': _get_batch_error(outcome)}
+            for blob, outcome in outcomes]
+
+
+def blobs_exist(storage_client, bucket_name, blob_paths,
+                batch_size=BATCH_SIZE):
+    """
+    Checks which blobs exist with batch requests of up to batch_size
+    lookups each.
+
+    Args:
+        storage_client (storage.Client): GCP storage client object
+        bucket_name (str): Bucket name
+        blob_paths (list[str]): Paths to blobs within bucket
+        batch_size (int, optional): Operations per batch request.
+            Defaults to BATCH_SIZE.
+
+    Returns:
+        list[dict]: blob, exists and error of every lookup, in the order of
+            blob_paths. exists is None when the lookup failed.
+    """
+
+    outcomes = _run_batches(storage_client, bucket_name, list(blob_paths),
+                            'objects.get', lambda blob: blob.reload(),
+                            batch_size)
+    results = []
+    for blob, outcome in outcomes:
+        error = _get_batch_error(outcome)
+        result = {'blob': blob.name, 'exists': error is None, 'error': error}
+        if isinstance(error, exceptions.NotFound):
+            result['error'] = None
+        elif error is not None:
+            result['exists'] = None
+        results.append(result)
+    return results
 
 
 def get_gcs_url(source_bucket, source_path):
@@ -0,0 +1,125 @@
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes generated per step when seeking forward by discarding data
+SKIP_SIZE = 1024 * 1024
+
+
+class IteratorReader():
+    """
+    Read-only binary file object over an iterator of byte strings.
+    Lets generator pipelines (encryption, decryption, compression) be handed
+    to APIs expecting a file object, such as GCS resumable uploads, while only
+    buffering the bytes requested by the caller.
+
+    Args:
+        iterable: Iterable yielding bytes
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.buffer = bytearray()
+        self.position = 0
+        self.exhausted = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        """
+        Returns (int): Number of bytes read so far
+        """
+        return self.position
+
+    def _fill(self, size):
+        while not self.exhausted and (size < 0 or len(self.buffer) < size):
+            try:
+                self.buffer.extend(next(self.iterator))
+            except StopIteration:
+                self.exhausted = True
+
+    def peek(self, size):
+        """
+        Return up to size bytes without consuming them.
+        Args:
+            size (int): Number of bytes to look ahead
+
+        Returns (bytes): Data at the current position
+        """
+        self._fill(size)
+        return bytes(self.buffer[:size])
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes. Less bytes are only returned at the end of the
+        stream.
+        Args:
+            size (int): Number of bytes to read, -1 reads everything
+
+        Returns (bytes): Data read
+        """
+        self._fill(size)
+
+        if size < 0 or size >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer = bytearray()
+        else:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.buffer = bytearray()
+        self.exhausted = True
+
+
+class SeekableIteratorReader(IteratorReader):
+    """
+    IteratorReader over a deterministic pipeline that can seek by restarting
+    the pipeline. Used to resume uploads of generated data, such as encrypted
+    or compressed files, from the offset committed by the server.
+
+    Args:
+        open_at (callable): Takes a byte offset and returns an iterable of
+            bytes together with the offset it starts at, which must not be
+            after the requested one. Bytes up to the requested offset are
+            generated and discarded.
+    """
+
+    def __init__(self, open_at):
+        super().__init__(())
+        self.open_at = open_at
+        self.seek(0)
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Moves to an absolute byte offset.
+        Args:
+            offset (int): Byte offset from the start of the stream
+            whence (int): Only io.SEEK_SET is supported
+
+        Returns (int): New position
+        """
+        if whence != io.SEEK_SET:
+            raise ValueError('Only absolute seeks are supported')
+
+        iterable, position = self.open_at(offset)
+        self.iterator = iter(iterable)
+        self.buffer = bytearray()
+        self.position = position
+        self.exhausted = False
+
+        while self.position < offset:
+            if not self.read(min(offset - self.position, SKIP_SIZE)):
+                break
+        return self.position
@@ -1,10 +1,37 @@
 # -*- coding: utf-8 -*-
 """
-    Dummy conftest.py for gcpip.
+    Fixtures shared by the tests running against the local fakes of
+    gcpip.testing.
 
-    If you don't know what this is for, just leave it empty.
     Read more about conftest.py under:
     https://pytest.org/latest/plugins.html
 """
 
-# import pytest
+import pytest
+from gcpip.testing.backends import (
+    install_fake_backends, remove_fake_backends)
+
+# Project, location, key ring and key of the fake KMS key tests encrypt with
+KMS_KEY = ('fake-project', 'europe-west2', 'ring', 'key')
+
+
+@pytest.fixture
+def fakes(tmp_path):
+    """
+    Fake GCS, BigQuery and KMS backends returned by the shared client
+    getters, storing buckets under tmp_path. Test modules needing buckets or
+    datasets override it, building on this fixture.
+    """
+    yield install_fake_backends(str(tmp_path / 'fakes'))
+    remove_fake_backends()
+
+
+@pytest.fixture
+def schema_config():
+    """
+    Schema config of the name and amount columns of the CSVs tests load
+    """
+    return {
+        'field1': {'name': 'name', 'type': 'STRING', 'mode': 'required'},
+        'field2': {'name': 'amount', 'type': 'INTEGER', 'mode': 'nullable'},
+    }
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from google.api_core.exceptions import NotFound
+from gcpip.aio import AsyncGcp
+
+
+def test_run_limits_concurrency():
+
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def work(i):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.01)
+        with lock:
+            state['running'] -= 1
+        return i
+
+    async def main():
+        async with AsyncGcp(storage_client=object(), bq_client=object(),
+                            concurrency=4) as gcp:
+            return await asyncio.gather(*[gcp.run(work, i)
+                                          for i in range(40)])
+
+    assert asyncio.run(main()) == list(range(40))
+    assert state['peak'] == 4
+
+
+class FakeJob():
+
+    job_id = 'load-1'
+
+    def __init__(self, checks, error=None):
+        self.checks = checks
+        self.error = error
+
+    def done(self):
+        self.checks -= 1
+        return self.checks <= 0
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self
+
+
+def test_wait_for_job_polls_until_done():
+
+    async def main(job, **kwargs):
+        async with AsyncGcp(storage_client=object(), bq_client=object(),
+                            concurrency=2) as gcp:
+            return await gcp.wait_for_job(job, poll_interval=0, **kwargs)
+
+    job = FakeJob(checks=3)
+    assert asyncio.run(main(job)) is job
+    assert job.checks == 0
+
+    with pytest.raises(NotFound):
+        asyncio.run(main(FakeJob(checks=1, error=NotFound('no table'))))
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main(FakeJob(checks=100), timeout=0))
+
+
+def test_table_exists():
+
+    def get_table(table_ref):
+        if table_ref.endswith('missing'):
+            raise NotFound('no table')
+        return table_ref
+
+    dataset = SimpleNamespace(table=lambda table_id: 'p.d.' + table_id)
+    bq_client = SimpleNamespace(
+        dataset=lambda dataset_id, project: (project, dataset_id),
+        get_dataset=lambda dataset_ref: dataset, get_table=get_table)
+
+    async def main():
+        async with AsyncGcp(storage_client=object(),
+                            bq_client=bq_client) as gcp:
+            return await asyncio.gather(gcp.table_exists('p', 'd', 'sales'),
+                                        gcp.table_exists('p', 'd', 'missing'))
+
+    assert asyncio.run(main()) == [True, False]
@@ -0,0 +1,103 @@
+import pytest
+from types import SimpleNamespace
+from gcpip.upload.batch import (
+    is_batch_source, resolve_sources, get_destination_name,
+    is_batch_blob_source, get_listing_prefix, pair_encrypted_blobs)
+
+
+def make_tree(tmp_path):
+
+    (tmp_path / "day1").mkdir()
+    (tmp_path / "day1" / "a.csv").write_text("a")
+    (tmp_path / "day1" / "b.csv").write_text("b")
+    (tmp_path / "day2").mkdir()
+    (tmp_path / "day2" / "c.csv").write_text("c")
+    (tmp_path / "notes.txt").write_text("n")
+
+
+def test_resolve_directory(tmp_path):
+
+    make_tree(tmp_path)
+    sources = resolve_sources(str(tmp_path))
+
+    assert [x[1] for x in sources] == [
+        "day1/a.csv", "day1/b.csv", "day2/c.csv", "notes.txt"]
+    assert is_batch_source(str(tmp_path))
+
+
+def test_resolve_glob(tmp_path):
+
+    make_tree(tmp_path)
+    sources = resolve_sources(str(tmp_path / "day*" / "*.csv"))
+
+    assert [x[1] for x in sources] == ["day1/a.csv", "day1/b.csv",
+                                       "day2/c.csv"]
+
+
+def test_resolve_manifest(tmp_path):
+
+    make_tree(tmp_path)
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# daily files\n{}\n\n{}\n".format(
+        tmp_path / "day1" / "a.csv", tmp_path / "day2" / "c.csv"))
+    sources = resolve_sources(manifest=str(manifest))
+
+    assert [x[1] for x in sources] == ["day1/a.csv", "day2/c.csv"]
+    assert get_destination_name("landing/", sources[1][1]) == \
+        "landing/day2/c.csv"
+
+
+def test_resolve_nothing_raises(tmp_path):
+
+    make_tree(tmp_path)
+    (tmp_path / "empty").mkdir()
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# no files today\n")
+
+    with pytest.raises(FileNotFoundError):
+        resolve_sources(str(tmp_path / "empty"))
+    with pytest.raises(FileNotFoundError):
+        resolve_sources(str(tmp_path / "day*" / "*.parquet"))
+    with pytest.raises(FileNotFoundError):
+        resolve_sources(manifest=str(manifest))
+
+
+def test_single_file_is_not_batch(tmp_path):
+
+    make_tree(tmp_path)
+    assert not is_batch_source(str(tmp_path / "notes.txt"))
+
+
+def make_blob(name, metadata=None):
+
+    return SimpleNamespace(name=name, metadata=metadata, size=1)
+
+
+def test_pair_encrypted_blobs():
+
+    blobs = [
+        make_blob('landing/day1/a.csv.encrypted'),
+        make_blob('landing/day1/a.csv.dek'),
+        make_blob('landing/day1/b.csv.encrypted'),
+        make_blob('landing/day2/c.csv.encrypted',
+                  {'gcpip-session-dek': 'landing/.gcpip-session-1.dek'}),
+        make_blob('landing/day2/plain.csv'),
+    ]
+
+    paired, missing = pair_encrypted_blobs(blobs, 'landing/')
+    assert [x.name for x in paired] == [
+        'landing/day1/a.csv.encrypted', 'landing/day2/c.csv.encrypted']
+    assert list(missing) == ['landing/day1/b.csv.encrypted']
+
+    paired, missing = pair_encrypted_blobs(blobs, 'landing/day2/*')
+    assert [x.name for x in paired] == ['landing/day2/c.csv.encrypted']
+    assert missing == {}
+
+
+def test_blob_source_detection():
+
+    assert is_batch_blob_source('landing/')
+    assert is_batch_blob_source('landing/2020-*/*.encrypted')
+    assert not is_batch_blob_source('landing/a.csv.encrypted')
+    assert get_listing_prefix('landing/2020-*/*.encrypted') == \
+        'landing/2020-'
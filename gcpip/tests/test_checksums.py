@@ -0,0 +1,63 @@
+import base64
+import hashlib
+from types import SimpleNamespace
+import pytest
+from gcpip.utils.checksums import (
+    compute_checksums, get_plaintext_metadata, checksums_match)
+
+
+@pytest.fixture
+def check_file(tmp_path):
+
+    path = tmp_path / "check.csv"
+    path.write_bytes(b'123456789')
+    return str(path)
+
+
+def test_compute_checksums_matches_gcs_encoding(check_file):
+
+    checksums = compute_checksums(check_file, chunk_size=4)
+
+    assert checksums['md5'] == base64.b64encode(
+        hashlib.md5(b'123456789').digest()).decode('ascii')
+    if 'crc32c' in checksums:
+        # CRC32C check value of "123456789" is 0xE3069283
+        assert checksums['crc32c'] == base64.b64encode(
+            bytes.fromhex('e3069283')).decode('ascii')
+
+
+def test_compute_selected_checksums(check_file):
+
+    assert set(compute_checksums(check_file, algorithms=('md5',))) == \
+        {'md5'}
+    assert 'md5' not in compute_checksums(check_file, algorithms=('crc32c',))
+
+
+def test_checksums_match_stored_bytes(check_file):
+
+    checksums = compute_checksums(check_file)
+    blob = SimpleNamespace(name='check.csv', metadata=None,
+                           crc32c=checksums.get('crc32c'),
+                           md5_hash=checksums['md5'])
+    assert checksums_match(blob, checksums)
+
+    # Composite blobs only carry a CRC32C
+    blob.md5_hash = None
+    assert checksums_match(blob, checksums) == ('crc32c' in checksums)
+
+    blob.crc32c, blob.md5_hash = 'AAAAAA==', checksums['md5']
+    assert not checksums_match(blob, checksums)
+
+
+def test_checksums_match_plaintext_metadata(check_file):
+
+    checksums = compute_checksums(check_file)
+    blob = SimpleNamespace(name='check.csv.encrypted', crc32c='AAAAAA==',
+                           md5_hash=None,
+                           metadata=get_plaintext_metadata(checksums))
+
+    assert checksums_match(blob, checksums, plaintext=True)
+    assert not checksums_match(blob, checksums)
+
+    blob.metadata = None
+    assert not checksums_match(blob, checksums, plaintext=True)
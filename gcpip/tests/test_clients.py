@@ -0,0 +1,69 @@
+import json
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from gcpip.utils.clients import (
+    get_credentials, get_http_session, get_storage_client, get_bq_client,
+    get_kms_client, clear_clients, HTTP_POOL_SIZE)
+
+
+@pytest.fixture
+def key_file(tmp_path):
+
+    private_key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode('ascii')
+    path = tmp_path / "key.json"
+    path.write_text(json.dumps({
+        'type': 'service_account',
+        'project_id': 'test-project',
+        'private_key_id': '1',
+        'private_key': pem,
+        'client_email': 'gcpip@test-project.iam.gserviceaccount.com',
+        'client_id': '1',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    }))
+
+    clear_clients()
+    yield str(path)
+    clear_clients()
+
+
+def test_clients_are_shared_per_key_file(key_file):
+
+    storage_client = get_storage_client(key_file)
+    assert get_storage_client(key_file) is storage_client
+    assert storage_client.project == 'test-project'
+    assert get_kms_client(key_file) is get_kms_client(key_file)
+
+    # A different project gets its own client on the same credentials
+    other = get_storage_client(key_file, project='other-project')
+    assert other is not storage_client
+    assert other.project == 'other-project'
+
+
+def test_credentials_and_session_are_shared(key_file):
+
+    credentials, project = get_credentials(key_file)
+    assert project == 'test-project'
+
+    storage_client = get_storage_client(key_file)
+    bq_client = get_bq_client(key_file)
+    assert storage_client._credentials is credentials
+    assert bq_client._credentials is credentials
+    assert storage_client._http is bq_client._http is \
+        get_http_session(key_file)
+
+    adapter = get_http_session(key_file).get_adapter('https://')
+    assert adapter._pool_maxsize == HTTP_POOL_SIZE
+
+
+def test_scopes_are_part_of_the_key(key_file):
+
+    read_only = ('https://www.googleapis.com/auth/devstorage.read_only',)
+    assert get_credentials(key_file, read_only)[0] is not \
+        get_credentials(key_file)[0]
+    assert get_storage_client(key_file, scopes=read_only) is not \
+        get_storage_client(key_file)
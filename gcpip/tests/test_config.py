@@ -0,0 +1,59 @@
+import io
+import os
+import pytest
+from google.api_core.exceptions import NotFound
+from gcpip.config.config_cache import load_gcs_config, clear_config_cache
+from gcpip.config.config_reader import (
+    LoadConfig, FeatureEngineeringConfig, SubmissionConfig)
+from gcpip.testing.storage import FakeStorageClient
+from gcpip.utils.storage import invalidate_object_cache
+
+TEST_DIR = os.path.dirname(__file__)
+
+
+@pytest.mark.parametrize('config_class, file_name', [
+    (LoadConfig, 'test_fe_load.yaml'),
+    (FeatureEngineeringConfig, 'test_fe.yaml'),
+    (SubmissionConfig, 'test_fe_submission.yaml')])
+def test_config_from_bytes_and_stream(config_class, file_name):
+
+    path = os.path.join(TEST_DIR, 'test_fe', file_name)
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    from_file = config_class(path)
+    assert config_class(content).__dict__ == \
+        dict(from_file.__dict__, configfile=content)
+    from_stream = config_class(io.BytesIO(content))
+    assert from_stream.configs == from_file.configs
+
+
+def test_gcs_config_cached_by_generation(tmp_path):
+
+    client = FakeStorageClient(str(tmp_path))
+    bucket = client.create_bucket('landing')
+    blob = bucket.blob('submissions/load.yaml')
+    blob.upload_from_string('submissions: {s1: {action: load}}\n')
+    clear_config_cache()
+    invalidate_object_cache()
+    client.calls.clear()
+
+    config = load_gcs_config(client, 'landing', 'submissions/load.yaml',
+                             SubmissionConfig)
+    assert config.get_submissions() == {'s1': {'action': 'load'}}
+    assert load_gcs_config(client, 'landing', 'submissions/load.yaml',
+                           SubmissionConfig) is config
+    assert client.calls['objects.get'] == 2
+    assert client.calls['objects.get_media'] == 1
+
+    # A new generation is downloaded and parsed again
+    blob.upload_from_string('submissions: {s1: {action: view}}\n')
+    config = load_gcs_config(client, 'landing', 'submissions/load.yaml',
+                             SubmissionConfig)
+    assert config.get_submissions() == {'s1': {'action': 'view'}}
+    assert client.calls['objects.get_media'] == 2
+
+    with pytest.raises(NotFound):
+        load_gcs_config(client, 'landing', 'submissions/missing.yaml',
+                        SubmissionConfig)
+    clear_config_cache()
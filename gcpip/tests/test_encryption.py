@@ -0,0 +1,258 @@
+import gzip
+import io
+import os
+import pytest
+from cryptography.exceptions import InvalidTag
+from gcpip.upload.encryption import (
+    generate_key, encrypt_file, decrypt_file, encrypt_stream, decrypt_stream,
+    is_chunked_format, iter_encrypted_segments, iter_sealed_segments,
+    build_header, generate_salt, derive_file_key, DekCache,
+    iter_encrypted_segments_at)
+from gcpip.upload.gcp_upload import get_part_ranges, iter_file_range
+from gcpip.utils.compression import compress_stream, decompress_stream
+from gcpip.utils.streams import IteratorReader, SeekableIteratorReader
+
+
+@pytest.fixture
+def plain_file(tmp_path):
+
+    path = tmp_path / "plain.csv"
+    path.write_bytes(os.urandom(10 * 1024 + 7))
+    return path
+
+
+def test_chunked_round_trip(plain_file):
+
+    key = generate_key()
+    encrypted_file = encrypt_file(str(plain_file), key, chunk_size=1024)
+
+    with open(encrypted_file, 'rb') as f:
+        assert is_chunked_format(f.read(8))
+
+    original = plain_file.read_bytes()
+    os.remove(str(plain_file))
+    decrypted_file = decrypt_file(encrypted_file, key)
+
+    assert decrypted_file == str(plain_file)
+    assert plain_file.read_bytes() == original
+
+
+def test_chunked_empty_stream():
+
+    key = generate_key()
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(b''), encrypted, key)
+
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted, key)
+    assert decrypted.getvalue() == b''
+
+
+def test_legacy_fernet_still_readable(plain_file):
+
+    key = generate_key()
+    encrypted_file = encrypt_file(str(plain_file), key, legacy=True)
+
+    with open(encrypted_file, 'rb') as f:
+        assert not is_chunked_format(f.read(8))
+
+    original = plain_file.read_bytes()
+    os.remove(str(plain_file))
+    decrypt_file(encrypted_file, key)
+    assert plain_file.read_bytes() == original
+
+
+def test_truncated_stream_is_rejected():
+
+    key = generate_key()
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(os.urandom(4096)), encrypted, key,
+                   chunk_size=1024)
+
+    # Drop the final segment: 4 byte frame + 1024 byte chunk + 16 byte tag
+    truncated = encrypted.getvalue()[:-(4 + 1024 + 16)]
+    with pytest.raises(InvalidTag):
+        decrypt_stream(io.BytesIO(truncated), io.BytesIO(), key)
+
+
+def test_tampered_segment_is_rejected():
+
+    key = generate_key()
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(os.urandom(4096)), encrypted, key,
+                   chunk_size=1024)
+
+    tampered = bytearray(encrypted.getvalue())
+    tampered[100] ^= 0x01
+    with pytest.raises(InvalidTag):
+        decrypt_stream(io.BytesIO(bytes(tampered)), io.BytesIO(), key)
+
+
+def test_encrypted_reader_matches_chunk_reads():
+
+    key = generate_key()
+    reader = IteratorReader(
+        iter_encrypted_segments(io.BytesIO(os.urandom(5000)), key,
+                                chunk_size=1024))
+
+    # Resumable uploads expect full reads until the end of the stream
+    chunks = []
+    while True:
+        data = reader.read(256)
+        chunks.append(data)
+        assert reader.tell() == sum(len(x) for x in chunks)
+        if len(data) < 256:
+            break
+
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(b''.join(chunks)), decrypted, key)
+    assert len(decrypted.getvalue()) == 5000
+
+
+def test_independently_encrypted_parts_compose(plain_file):
+
+    key = generate_key()
+    header = build_header(chunk_size=1024)
+    size = plain_file.stat().st_size
+    ranges = get_part_ranges(size, max_parts=4, min_part_size=1,
+                             alignment=1024)
+    assert len(ranges) == 4
+
+    # Encrypt each range on its own, as parallel composite uploads do
+    composed = [header]
+    for i, (start, length) in enumerate(ranges):
+        part = IteratorReader(iter_file_range(str(plain_file), start, length))
+        composed.extend(iter_sealed_segments(
+            part, key, header, first_index=start // 1024,
+            final=i == len(ranges) - 1))
+
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(b''.join(composed)), decrypted, key)
+    assert decrypted.getvalue() == plain_file.read_bytes()
+
+
+def test_derived_file_keys():
+
+    session_key = generate_key()
+    salt1, salt2 = generate_salt(), generate_salt()
+
+    name = 'in/data.csv.encrypted'
+    assert derive_file_key(session_key, salt1, name) == \
+        derive_file_key(session_key, salt1, name)
+    assert derive_file_key(session_key, salt1, name) != \
+        derive_file_key(session_key, salt2, name)
+    assert derive_file_key(session_key, salt1, name) != \
+        derive_file_key(session_key, salt1, 'in/other.csv.encrypted')
+
+    # Derived keys are regular data encryption keys
+    file_key = derive_file_key(session_key, salt1, name)
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(b'market data'), encrypted, file_key)
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted,
+                   derive_file_key(session_key, salt1, name))
+    assert decrypted.getvalue() == b'market data'
+
+
+def test_dek_cache_lru_and_stats():
+
+    cache = DekCache(maxsize=2, ttl=60)
+    cache.put(b'wrapped1', 'kek', b'dek1')
+    cache.put(b'wrapped2', 'kek', b'dek2')
+
+    assert cache.get(b'wrapped1', 'kek') == b'dek1'
+    assert cache.get(b'wrapped1', 'other-kek') is None
+
+    # wrapped2 is least recently used and gets evicted
+    evicted = cache.entries[DekCache.get_cache_key(b'wrapped2', 'kek')][0]
+    cache.put(b'wrapped3', 'kek', b'dek3')
+    assert cache.get(b'wrapped2', 'kek') is None
+    assert evicted == bytearray(4)
+
+    stats = cache.get_stats()
+    assert stats['size'] == 2
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    assert cache.hit_rate == pytest.approx(1 / 3)
+
+
+def test_dek_cache_ttl():
+
+    cache = DekCache(ttl=0)
+    cache.put(b'wrapped', 'kek', b'dek')
+    assert cache.get(b'wrapped', 'kek') is None
+    assert cache.get_stats()['size'] == 0
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_encryption_is_deterministic(executor):
+
+    key = generate_key()
+    data = os.urandom(20 * 1024 + 3)
+    nonce_prefix = os.urandom(7)
+
+    outputs = []
+    for workers in (1, 4):
+        output = b''.join(iter_encrypted_segments(
+            io.BytesIO(data), key, chunk_size=1024, nonce_prefix=nonce_prefix,
+            workers=workers, executor=executor))
+        outputs.append(output)
+
+    assert outputs[0] == outputs[1]
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(outputs[1]), decrypted, key)
+    assert decrypted.getvalue() == data
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_round_trip(tmp_path, compression):
+
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+
+    path = tmp_path / "market_data.csv"
+    path.write_bytes(b'date,ticker,price\n' * 5000)
+    original = path.read_bytes()
+
+    key = generate_key()
+    encrypted_file = encrypt_file(str(path), key, chunk_size=1024,
+                                  compression=compression)
+    assert os.path.getsize(encrypted_file) < len(original) // 5
+
+    os.remove(str(path))
+    decrypt_file(encrypted_file, key, compression=compression)
+    assert path.read_bytes() == original
+
+
+def test_gzip_stream_is_standard_gzip():
+
+    data = os.urandom(3000) * 4
+    reader = compress_stream(io.BytesIO(data), 'gzip')
+    assert gzip.decompress(reader.read()) == data
+    assert decompress_stream(io.BytesIO(gzip.compress(data)), 'gzip') \
+        .read() == data
+
+
+@pytest.mark.parametrize("size", [0, 1024, 5000])
+def test_encrypted_stream_resumes_at_any_offset(tmp_path, size):
+
+    path = tmp_path / "resume.bin"
+    path.write_bytes(os.urandom(size))
+    key = generate_key()
+    nonce_prefix = os.urandom(7)
+
+    with open(str(path), 'rb') as f:
+        expected = b''.join(iter_encrypted_segments(
+            f, key, chunk_size=1024, nonce_prefix=nonce_prefix))
+
+        reader = SeekableIteratorReader(
+            lambda offset: iter_encrypted_segments_at(
+                f, key, offset, nonce_prefix, chunk_size=1024))
+        assert reader.read() == expected
+
+        # Resumable uploads seek to the offset committed by the server
+        for offset in (0, 5, 20, 1060, len(expected) - 1, len(expected)):
+            offset = min(offset, len(expected))
+            assert reader.seek(offset) == offset
+            assert reader.read() == expected[offset:]
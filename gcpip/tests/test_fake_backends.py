@@ -0,0 +1,595 @@
+import base64
+import functools
+import gzip
+import io
+import os
+import re
+import pytest
+from types import SimpleNamespace
+from conftest import KMS_KEY
+from cryptography.exceptions import InvalidTag
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from gcpip import runner
+from gcpip.load.load import (
+    load_gcs_csv_to_bq, load_gcs_csvs_to_bq, get_load_groups)
+from gcpip.testing.bigquery import FakeLoadJob
+from gcpip.testing.latency import Latency
+from gcpip.upload.encryption import (
+    generate_key, encrypt_dek, encrypt_file, derive_file_key)
+from gcpip.upload import gcp_upload
+from gcpip.upload.gcp_upload import (
+    encrypt_upload_file, decrypt_blob, upload_file, UPLOADED, SKIPPED)
+from gcpip.utils.biq_query import gcs_csv_to_bq
+from gcpip.utils.checksums import compute_checksums
+from gcpip.utils.clients import get_storage_client, get_kms_client
+from gcpip.utils.encryption import ensure_kms_key
+from gcpip.utils.storage import (
+    delete_blobs, blobs_exist, patch_blobs_metadata)
+
+
+def test_fakes_replace_client_getters(fakes):
+
+    assert get_storage_client() is fakes.storage
+    assert get_storage_client(project='other') is fakes.storage
+    assert get_kms_client('key.json') is fakes.kms
+
+
+def test_fake_storage_objects(fakes, tmp_path):
+
+    client = fakes.storage
+    bucket = client.create_bucket('landing', location='EU')
+    with pytest.raises(Conflict):
+        client.create_bucket('landing')
+    with pytest.raises(NotFound):
+        client.get_bucket('missing')
+
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'a,b\n1,2\n' * 1000)
+    blob = bucket.blob('dir/data.csv')
+    blob.metadata = {'k': 'v'}
+    blob.upload_from_filename(str(source))
+    loaded = bucket.get_blob('dir/data.csv')
+    checksums = compute_checksums(str(source))
+    assert loaded.size == 8000 and loaded.metadata == {'k': 'v'}
+    assert loaded.md5_hash == checksums['md5']
+    assert loaded.crc32c == checksums.get('crc32c')
+    assert loaded.download_as_string(start=4, end=7) == b'1,2\n'
+
+    # Reads are pinned to a generation
+    old = bucket.blob('dir/data.csv', generation=loaded.generation)
+    bucket.blob('dir/data.csv').upload_from_string(b'new')
+    with pytest.raises(NotFound):
+        old.download_as_string()
+
+    parts = [bucket.blob('part-{}'.format(i)) for i in range(3)]
+    for i, part in enumerate(parts):
+        part.upload_from_string(str(i))
+    composed = bucket.blob('composed')
+    composed.compose(parts)
+    assert composed.download_as_string() == b'012'
+    assert composed.md5_hash is None
+
+    gzipped = bucket.blob('gzipped.csv')
+    gzipped.content_encoding = 'gzip'
+    gzipped.upload_from_string(gzip.compress(b'plain'))
+    assert gzipped.download_as_string() == b'plain'
+    assert gzip.decompress(gzipped.download_as_string(raw_download=True)) \
+        == b'plain'
+
+    assert [x.name for x in bucket.list_blobs(prefix='part-')] == \
+        ['part-0', 'part-1', 'part-2']
+    results = delete_blobs(client, 'landing', ['part-0', 'missing'])
+    assert results[0]['error'] is None
+    assert isinstance(results[1]['error'], NotFound)
+    assert [x['exists'] for x in blobs_exist(
+        client, 'landing', ['part-0', 'part-1'])] == [False, True]
+
+
+def test_batches_run_through_the_fake(fakes):
+
+    client = fakes.storage
+    bucket = client.create_bucket('landing')
+    names = ['dir/{}.csv'.format(i) for i in range(5)]
+    for name in names:
+        bucket.blob(name).upload_from_string(name)
+
+    results = patch_blobs_metadata(client, 'landing', {
+        'dir/0.csv': {'k': 'v'}, 'missing.csv': {'k': 'v'}})
+    assert results[0]['error'] is None
+    assert isinstance(results[1]['error'], NotFound)
+    assert bucket.get_blob('dir/0.csv').metadata == {'k': 'v'}
+
+    results = delete_blobs(client, 'landing', names[:4] + ['missing.csv'],
+                           batch_size=2)
+    assert [x['error'] is None for x in results] == [True] * 4 + [False]
+    assert [x['exists'] for x in blobs_exist(client, 'landing', names)] == \
+        [False] * 4 + [True]
+    assert client.calls['batch'] == 1 + 3 + 1
+    assert client.calls['objects.delete'] == 5
+
+
+def test_fake_bigquery_loads(fakes, schema_config):
+
+    bucket = fakes.storage.create_bucket('landing')
+    bucket.blob('sales/2020-01.csv').upload_from_string(
+        'name,amount,paid\nann,10,true\nbob,,false\n')
+    bucket.blob('sales/2020-02.csv').upload_from_string(
+        'name,amount,paid\ncyd,30,t\n')
+    bucket.blob('bad.csv').upload_from_string('name,amount,paid\n,1,true\n')
+
+    bq = fakes.bigquery
+    bq.create_dataset(bq.dataset('landing_data'))
+    schema_config = dict(schema_config, field3={
+        'name': 'paid', 'type': 'BOOLEAN', 'mode': 'nullable'})
+    job = load_gcs_csv_to_bq(bq, 'landing', 'sales/*.csv', bq.project,
+                             'landing_data', 'sales', schema_config, 1)
+    assert job.result().output_rows == 3
+    rows = bq.list_rows('landing_data.sales')
+    assert [tuple(x.values()) for x in rows] == [
+        ('ann', 10, 1), ('bob', None, 0), ('cyd', 30, 1)]
+
+    # gcpip loads with WRITE_EMPTY
+    with pytest.raises(BadRequest):
+        gcs_csv_to_bq(bq, bq.project, 'landing', 'sales/2020-02.csv',
+                      'landing_data', 'sales', 1).result()
+
+    # Failed jobs load nothing
+    job = load_gcs_csv_to_bq(bq, 'landing', 'bad.csv', bq.project,
+                             'landing_data', 'sales_bad', schema_config, 1)
+    assert 'Required field name' in job.errors[0]['message']
+    assert bq.get_table('landing_data.sales_bad').num_rows == 0
+
+
+def test_load_sources_in_one_job(fakes, schema_config):
+
+    bucket = fakes.storage.create_bucket('landing')
+    for day in range(1, 6):
+        bucket.blob('daily/2020-01-0{}.csv'.format(day)).upload_from_string(
+            'name,amount\nann,{}\n'.format(day))
+    bucket.blob('extra/2020-02.csv').upload_from_string('bob,7\ncyd,8\n')
+    bq = fakes.bigquery
+    bq.create_dataset(bq.dataset('landing_data'))
+    sources = [{'bucket_id': 'landing', 'file_path': path,
+                'skip_leading_rows': 1} for path in (
+        'daily/2020-01-0*.csv', 'daily/2020-01-01.csv',
+        'daily/2020-01-02.csv')]
+
+    # Within the URI limit sources are not sized, BigQuery alone lists the
+    # wildcard
+    calls = fakes.storage.calls.copy()
+    stats = load_gcs_csvs_to_bq(bq, sources, bq.project, 'landing_data',
+                                'daily', schema_config,
+                                storage_client=fakes.storage)
+    assert len(stats['jobs']) == bq.calls['jobs.insert'] == 1
+    assert stats['errors'] == []
+    assert (stats['output_rows'], stats['input_files']) == (7, 7)
+    assert fakes.storage.calls['objects.get'] == calls['objects.get']
+    assert fakes.storage.calls['objects.list'] == calls['objects.list'] + 1
+
+    # Over the limits, and with other header rows, jobs run in parallel.
+    # Files are sized with one lookup each, the wildcard is not listed.
+    sources.append({'bucket_id': 'landing', 'file_path': 'extra/2020-02.csv',
+                    'skip_leading_rows': 0})
+    calls = fakes.storage.calls.copy()
+    stats = load_gcs_csvs_to_bq(bq, sources, bq.project, 'landing_data',
+                                'daily_split', schema_config,
+                                storage_client=fakes.storage, max_uris=2)
+    assert len(stats['jobs']) == 3
+    assert stats['output_rows'] == 9
+    assert stats['input_file_bytes'] == 7 * len('name,amount\nann,1\n') + 12
+    assert fakes.storage.calls['objects.get'] == calls['objects.get'] + 3
+    assert fakes.storage.calls['objects.list'] == calls['objects.list'] + 1
+
+
+def test_load_splits_jobs_over_the_size_limit(fakes, schema_config):
+
+    bucket = fakes.storage.create_bucket('landing')
+    for day in range(1, 6):
+        bucket.blob('daily/2020-01-0{}.csv'.format(day)).upload_from_string(
+            'name,amount\nann,{}\n'.format(day))
+    bq = fakes.bigquery
+    bq.create_dataset(bq.dataset('landing_data'))
+    sources = [{'bucket_id': 'landing', 'file_path': path,
+                'skip_leading_rows': 1} for path in (
+        'daily/2020-01-0*.csv', 'daily/2020-01-01.csv',
+        'daily/2020-01-02.csv')]
+
+    # 126 bytes fail as one job, the wildcard and the two files load apart
+    bq.max_load_bytes = 100
+    stats = load_gcs_csvs_to_bq(bq, sources, bq.project, 'landing_data',
+                                'daily', schema_config)
+    assert len(stats['jobs']) == bq.calls['jobs.insert'] == 3
+    assert stats['errors'] == []
+    assert (stats['output_rows'], stats['input_files']) == (7, 7)
+    assert bq.get_table('landing_data.daily').num_rows == 7
+
+    # A single URI over the limit cannot be split
+    bq.max_load_bytes = 50
+    stats = load_gcs_csvs_to_bq(bq, sources, bq.project, 'landing_data',
+                                'daily_over', schema_config)
+    assert len(stats['jobs']) == 3
+    assert [x[0] for x in stats['errors']] == stats['jobs'][1:2]
+    assert stats['errors'][0][1].errors[0]['reason'] == 'quotaExceeded'
+    assert stats['output_rows'] == 2
+
+
+def test_load_does_not_split_other_errors(fakes, schema_config,
+                                          monkeypatch):
+
+    bucket = fakes.storage.create_bucket('landing')
+    for day in (1, 2):
+        bucket.blob('daily/2020-01-0{}.csv'.format(day)).upload_from_string(
+            'name,amount\nann,{}\n'.format(day))
+    bq = fakes.bigquery
+    bq.create_dataset(bq.dataset('landing_data'))
+    sources = [{'bucket_id': 'landing', 'skip_leading_rows': 1,
+                'file_path': 'daily/2020-01-0{}.csv'.format(day)}
+               for day in (1, 2)]
+
+    # A row over the row size limit fails with the invalid reason
+    def load_table_from_uri(source_uris, destination, **kwargs):
+        bq.calls['jobs.insert'] += 1
+        return FakeLoadJob('row_size', source_uris, destination,
+                           error='Row 2 exceeds the maximum row size')
+
+    monkeypatch.setattr(bq, 'load_table_from_uri', load_table_from_uri)
+    stats = load_gcs_csvs_to_bq(bq, sources, bq.project, 'landing_data',
+                                'daily', schema_config)
+    assert stats['jobs'] == ['row_size'] and bq.calls['jobs.insert'] == 1
+    error = stats['errors'][0][1]
+    assert isinstance(error, BadRequest)
+    assert error.errors == [{'reason': 'invalid', 'message':
+                             'Row 2 exceeds the maximum row size'}]
+    with pytest.raises(BadRequest, match='maximum row size'):
+        runner.run_load(SimpleNamespace(
+            key_file=None, sources=sources, project_id=bq.project,
+            destination_dataset='landing_data',
+            destination_table='daily_runner',
+            destination_schema=schema_config))
+    assert bq.calls['jobs.insert'] == 2
+
+
+def test_load_groups_respect_limits():
+
+    sources = [{'bucket_id': 'b', 'file_path': '{}.csv'.format(x),
+                'skip_leading_rows': 1} for x in range(5)]
+    groups = get_load_groups(sources, [40, 40, 40, 10, 10], max_bytes=100)
+    assert [x['uris'] for x in groups] == [
+        ['gs://b/0.csv', 'gs://b/1.csv'],
+        ['gs://b/2.csv', 'gs://b/3.csv', 'gs://b/4.csv']]
+    assert [x['bytes'] for x in groups] == [80, 60]
+    assert len(get_load_groups(sources, max_uris=2)) == 3
+    # Unknown sizes of wildcard sources do not count
+    groups = get_load_groups(sources, [40, None, 40, None, 40],
+                             max_bytes=100)
+    assert [len(x['uris']) for x in groups] == [4, 1]
+
+
+def test_latency_is_reproducible():
+
+    first = Latency(seconds=0.01, jitter=0.02, bandwidth_mbps=100, seed=3)
+    second = Latency(seconds=0.01, jitter=0.02, bandwidth_mbps=100, seed=3)
+    delays = [first.get_delay(10 ** 6) for _ in range(5)]
+    assert delays == [second.get_delay(10 ** 6) for _ in range(5)]
+    assert all(0.02 <= x <= 0.04 for x in delays)
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+@pytest.mark.parametrize('streaming_upload', [False, True])
+@pytest.mark.parametrize('streaming_download', [False, True])
+def test_encrypted_round_trip(fakes, tmp_path, compression,
+                              streaming_upload, streaming_download):
+
+    bucket = fakes.storage.create_bucket('landing')
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'a,b\n1,2\n' * 500 + os.urandom(5000))
+
+    encrypt_upload_file(fakes.storage, fakes.kms, 'landing', str(source),
+                        'in/data.csv', *KMS_KEY, streaming=streaming_upload,
+                        compression=compression)
+    assert sorted(x.name for x in bucket.list_blobs()) == [
+        'in/data.csv.dek', 'in/data.csv.encrypted']
+    assert bucket.get_blob('in/data.csv.encrypted').metadata.get(
+        'gcpip-compression') == compression
+
+    obsolete = decrypt_blob(
+        fakes.storage, fakes.kms, 'landing', 'in/data.csv.encrypted',
+        *KMS_KEY, temp_data=str(tmp_path / 'temp'),
+        streaming=streaming_download)
+    assert obsolete == ['in/data.csv.encrypted', 'in/data.csv.dek']
+    assert [x.name for x in bucket.list_blobs()] == ['in/data.csv']
+    assert bucket.blob('in/data.csv').download_as_string() == \
+        source.read_bytes()
+    assert bucket.get_blob('in/data.csv').content_type == 'text/csv'
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_composite_upload_round_trip(fakes, tmp_path, monkeypatch, encrypt):
+
+    bucket = fakes.storage.create_bucket('landing')
+    source = tmp_path / 'data.csv'
+    source.write_bytes(os.urandom(3 * 1024 * 1024 + 7))
+    monkeypatch.setattr(gcp_upload, 'get_part_ranges', functools.partial(
+        gcp_upload.get_part_ranges, max_parts=4, min_part_size=1))
+    deleted = []
+
+    def delete_parts(storage_client, bucket_name, blob_paths, **kwargs):
+        deleted.extend(blob_paths)
+        return delete_blobs(storage_client, bucket_name, blob_paths,
+                            **kwargs)
+
+    monkeypatch.setattr(gcp_upload, 'delete_blobs', delete_parts)
+    if encrypt:
+        encrypt_upload_file(fakes.storage, fakes.kms, 'landing', str(source),
+                            'in/data.csv', *KMS_KEY, composite_threshold=1)
+        name = 'in/data.csv.encrypted'
+    else:
+        upload_file(fakes.storage, 'landing', str(source), 'in/data.csv',
+                    composite_threshold=1)
+        name = 'in/data.csv'
+
+    # Parts named after the destination are composed once, then deleted
+    assert fakes.storage.calls['objects.compose'] == 1
+    assert len(deleted) == 4
+    assert all(re.match(re.escape(name) + r'\.part-[0-9a-f]{8}-0\d$', x)
+               for x in deleted)
+    assert sorted(x.name for x in bucket.list_blobs()) == sorted(
+        [name] + (['in/data.csv.dek'] if encrypt else []))
+    if encrypt:
+        decrypt_blob(fakes.storage, fakes.kms, 'landing', name, *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'))
+    assert bucket.blob('in/data.csv').download_as_string() == \
+        source.read_bytes()
+
+
+def test_compose_upload_limits_and_cleanup(fakes):
+
+    bucket = fakes.storage.create_bucket('landing')
+
+    def failing_part():
+        raise IOError('Disk read failed')
+
+    # Parts uploaded before a failure are deleted, nothing is composed
+    with pytest.raises(IOError):
+        gcp_upload.compose_upload(
+            fakes.storage, 'landing', 'out.bin',
+            [lambda: io.BytesIO(b'a'), failing_part, lambda: io.BytesIO(b'c')],
+            workers=1)
+    assert fakes.storage.calls['objects.compose'] == 0
+    assert list(bucket.list_blobs()) == []
+
+    # No parts, or more parts than one compose request takes, fail early
+    inserts = fakes.storage.calls['objects.insert']
+    for count in (0, gcp_upload.COMPOSITE_MAX_PARTS + 1):
+        with pytest.raises(ValueError):
+            gcp_upload.compose_upload(
+                fakes.storage, 'landing', 'out.bin',
+                [lambda: io.BytesIO(b'x')] * count)
+    assert fakes.storage.calls['objects.insert'] == inserts
+
+    gcp_upload.compose_upload(
+        fakes.storage, 'landing', 'out.bin',
+        [lambda i=i: io.BytesIO(bytes([i])) for i in range(32)])
+    assert [x.name for x in bucket.list_blobs()] == ['out.bin']
+    assert bucket.blob('out.bin').download_as_string() == bytes(range(32))
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_empty_file_is_not_a_composite_upload(fakes, tmp_path, encrypt):
+
+    bucket = fakes.storage.create_bucket('landing')
+    source = tmp_path / 'empty.csv'
+    source.write_bytes(b'')
+    if encrypt:
+        encrypt_upload_file(fakes.storage, fakes.kms, 'landing', str(source),
+                            'in/empty.csv', *KMS_KEY, composite_threshold=0)
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     'in/empty.csv.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'))
+    else:
+        upload_file(fakes.storage, 'landing', str(source), 'in/empty.csv',
+                    composite_threshold=0)
+    assert fakes.storage.calls['objects.compose'] == 0
+    assert bucket.blob('in/empty.csv').download_as_string() == b''
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_legacy_fernet_blob_decrypts(fakes, tmp_path, streaming):
+
+    bucket = fakes.storage.create_bucket('landing')
+    source = tmp_path / 'data.csv'
+    source.write_bytes(os.urandom(5000))
+    dek = generate_key()
+    ensure_kms_key(fakes.kms, *KMS_KEY)
+    bucket.blob('in/data.csv.dek').upload_from_string(
+        encrypt_dek(fakes.kms, dek, *KMS_KEY))
+    bucket.blob('in/data.csv.encrypted').upload_from_filename(
+        encrypt_file(str(source), dek, legacy=True))
+
+    decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                 'in/data.csv.encrypted', *KMS_KEY,
+                 temp_data=str(tmp_path / 'temp'), streaming=streaming)
+    assert [x.name for x in bucket.list_blobs()] == ['in/data.csv']
+    assert bucket.blob('in/data.csv').download_as_string() == \
+        source.read_bytes()
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_skip_unchanged_reads_file_only_when_set(fakes, tmp_path, monkeypatch,
+                                                 encrypt):
+
+    fakes.storage.create_bucket('landing')
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'a,b\n1,2\n' * 500)
+    checksummed = []
+    original = gcp_upload.compute_checksums
+
+    def compute_checksums(file_name):
+        checksummed.append(file_name)
+        return original(file_name)
+
+    monkeypatch.setattr(gcp_upload, 'compute_checksums', compute_checksums)
+
+    def upload(skip_unchanged):
+        if encrypt:
+            return encrypt_upload_file(
+                fakes.storage, fakes.kms, 'landing', str(source),
+                'in/data.csv', *KMS_KEY, compression='gzip',
+                skip_unchanged=skip_unchanged)
+        return upload_file(fakes.storage, 'landing', str(source),
+                           'in/data.csv', compression='gzip',
+                           skip_unchanged=skip_unchanged)
+
+    assert upload(False) == UPLOADED
+    assert checksummed == []
+    # Blobs without plaintext digests are uploaded again once
+    assert upload(True) == UPLOADED
+    assert upload(True) == SKIPPED
+    assert len(checksummed) == 2
+
+
+def test_decrypt_missing_blob(fakes, tmp_path):
+
+    fakes.storage.create_bucket('landing')
+    with pytest.raises(FileNotFoundError, match='in/missing.csv.encrypted'):
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     'in/missing.csv.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'))
+
+
+def test_runner_upload_and_decrypt_offline(fakes, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    fakes.storage.create_bucket('landing')
+    config = tmp_path / 'upload.yaml'
+    config.write_text('project_name: fake-project\n')
+    source = tmp_path / 'source'
+    source.mkdir()
+    for i in range(3):
+        (source / 'part-{}.csv'.format(i)).write_bytes(os.urandom(5000))
+
+    kms_args = ['-l', 'europe-west2', '-r', 'ring', '-k', 'key']
+    runner.main(['upload', '-a', 'encrypted', '-s', str(source), '-d',
+                 'in/', '-c', str(config), '-b', 'landing'] + kms_args)
+    bucket = fakes.storage.bucket('landing')
+    assert len([x for x in bucket.list_blobs()
+                if x.name.endswith('.encrypted')]) == 3
+
+    runner.main(['decrypt', '-s', 'in/', '-c', str(config), '-b',
+                 'landing'] + kms_args)
+    names = [x.name for x in bucket.list_blobs()]
+    assert sorted(names) == ['in/part-{}.csv'.format(i) for i in range(3)]
+    for i in range(3):
+        assert bucket.blob(names[i]).download_as_string() == \
+            (source / 'part-{}.csv'.format(i)).read_bytes()
+
+
+def test_runner_rejects_plain_zstd_upload(tmp_path):
+
+    args = ['upload', '-s', str(tmp_path), '-d', 'in/', '-c', 'upload.yaml',
+            '-b', 'landing', '--compression', 'zstd']
+    with pytest.raises(SystemExit):
+        runner.get_args(args + ['-a', 'plain'])
+    assert runner.get_args(args + ['-a', 'encrypted']).compression == 'zstd'
+    assert runner.get_args(['upload', '-a', 'plain'] + args[1:-1] +
+                           ['gzip']).compression == 'gzip'
+
+
+def test_runner_load_offline(fakes, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    bucket = fakes.storage.create_bucket('landing')
+    fakes.bigquery.create_dataset(fakes.bigquery.dataset('landing_data'))
+    bucket.blob('data/sales.csv').upload_from_string(
+        'name,amount\nann,10\nbob,20\n')
+    bucket.blob('meta/load.yaml').upload_from_string('''
+project_id: fake-project
+sources:
+  source1:
+    bucket_id: landing
+    file_path: data/sales.csv
+    skip_leading_rows: 1
+destination:
+  schema:
+    field1: {name: name, type: STRING, mode: required}
+    field2: {name: amount, type: INTEGER, mode: nullable}
+  dataset: landing_data
+  table: sales
+''')
+    bucket.blob('submissions/submission.yaml').upload_from_string('''
+submissions:
+  submission1:
+    submission_name: sales
+    metadata_file: landing/meta/load.yaml
+    action: load
+''')
+
+    fakes.storage.calls.clear()
+    runner.main(['load', '-b', 'landing', '-s',
+                 'submissions/submission.yaml'])
+    assert fakes.bigquery.get_table('landing_data.sales').num_rows == 2
+    # One lookup each of the submission and load config, no existence check
+    assert fakes.storage.calls['objects.get'] == 2
+
+    with pytest.raises(FileNotFoundError, match='submissions/missing.yaml'):
+        runner.main(['load', '-b', 'landing', '-s',
+                     'submissions/missing.yaml'])
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_session_key_round_trip(fakes, tmp_path, streaming):
+
+    bucket = fakes.storage.create_bucket('landing')
+    session = gcp_upload.create_upload_session(
+        fakes.storage, fakes.kms, 'landing', 'in', *KMS_KEY)
+    sources = {}
+    for i in range(3):
+        source = tmp_path / 'data{}.csv'.format(i)
+        source.write_bytes(os.urandom(3000))
+        sources['in/data{}.csv'.format(i)] = source.read_bytes()
+        encrypt_upload_file(fakes.storage, fakes.kms, 'landing', str(source),
+                            'in/data{}.csv'.format(i), *KMS_KEY,
+                            session=session, streaming=streaming)
+    # One KMS call wraps the session key, no file has its own DEK blob
+    assert fakes.kms.calls['encrypt'] == 1
+    assert [x.name for x in bucket.list_blobs(prefix='in/data')] == [
+        'in/data{}.csv.encrypted'.format(i) for i in range(3)]
+
+    # Every file has its own key, derived from its salt and name
+    keys = set()
+    for name in sources:
+        metadata = bucket.get_blob(name + '.encrypted').metadata
+        assert metadata['gcpip-session-dek'] == session['dek_blob_path']
+        keys.add(derive_file_key(
+            session['dek'], base64.b64decode(metadata['gcpip-key-salt']),
+            name + '.encrypted'))
+    assert len(keys) == 3
+
+    # A blob copied to another name, or under a replaced session DEK, does
+    # not decrypt
+    copy = bucket.blob('in/copy.csv.encrypted')
+    copy.metadata = bucket.get_blob('in/data0.csv.encrypted').metadata
+    copy.upload_from_string(
+        bucket.blob('in/data0.csv.encrypted').download_as_string())
+    with pytest.raises(InvalidTag):
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     'in/copy.csv.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'), streaming=streaming)
+    assert not bucket.blob('in/copy.csv').exists()
+
+    wrapped = bucket.blob(session['dek_blob_path']).download_as_string()
+    bucket.blob(session['dek_blob_path']).upload_from_string(
+        encrypt_dek(fakes.kms, generate_key(), *KMS_KEY))
+    with pytest.raises(InvalidTag):
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     'in/data0.csv.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'), streaming=streaming)
+    bucket.blob(session['dek_blob_path']).upload_from_string(wrapped)
+
+    for name, data in sources.items():
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     name + '.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'), streaming=streaming)
+        assert bucket.blob(name).download_as_string() == data
+    # The session DEK is shared by the batch and stays
+    assert bucket.blob(session['dek_blob_path']).exists()
@@ -0,0 +1,122 @@
+import threading
+import time
+import pytest
+from gcpip.testing.kms import FakeKmsClient
+from gcpip.testing.latency import Latency
+from gcpip.upload.encryption import (
+    generate_key, encrypt_dek, decrypt_dek, DekCache)
+from gcpip.utils.encryption import ensure_kms_key, invalidate_kms_cache
+
+
+@pytest.fixture
+def kms_client():
+
+    invalidate_kms_cache()
+    yield FakeKmsClient()
+    invalidate_kms_cache()
+
+
+def test_ensure_kms_key_creates_once(kms_client):
+
+    name = ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring', 'key')
+    assert name == FakeKmsClient.crypto_key_path(
+        'project', 'europe-west2', 'ring', 'key')
+    assert kms_client.calls['create_key_ring'] == 1
+    assert kms_client.calls['create_crypto_key'] == 1
+
+    # Positive checks are cached
+    ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring', 'key')
+    assert kms_client.calls['get_crypto_key'] == 1
+
+
+def test_ensure_kms_key_cache_expiry_and_invalidation(kms_client):
+
+    args = ('project', 'europe-west2', 'ring', 'key')
+
+    # An expired check goes back to KMS but never creates the key again
+    for _ in range(2):
+        ensure_kms_key(kms_client, *args, ttl=0)
+    assert kms_client.calls['get_crypto_key'] == 2
+    assert kms_client.calls['get_key_ring'] == 2
+    for _ in range(2):
+        ensure_kms_key(kms_client, *args)
+    assert kms_client.calls['get_crypto_key'] == 3
+
+    invalidate_kms_cache(kms_client.crypto_key_path(*args))
+    ensure_kms_key(kms_client, *args)
+    assert kms_client.calls['get_crypto_key'] == 4
+    assert kms_client.calls['get_key_ring'] == 3
+
+    invalidate_kms_cache()
+    ensure_kms_key(kms_client, *args)
+    assert kms_client.calls['get_crypto_key'] == 5
+    assert kms_client.calls['get_key_ring'] == 4
+    assert kms_client.calls['create_key_ring'] == 1
+    assert kms_client.calls['create_crypto_key'] == 1
+
+
+def test_ensure_kms_key_concurrent_callers():
+
+    invalidate_kms_cache()
+    kms_client = FakeKmsClient(latency=Latency(0.05))
+    errors = []
+
+    def ensure(key_id):
+        try:
+            ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring',
+                           key_id)
+        except Exception as e:
+            errors.append(e)
+
+    # Callers of one missing key create it at most once
+    threads = [threading.Thread(target=ensure, args=('key',))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert kms_client.calls['create_key_ring'] == 1
+    assert kms_client.calls['create_crypto_key'] == 1
+    assert kms_client.calls['get_crypto_key'] == 1
+
+    # Checks of different keys do not wait for each other: with one lock
+    # held across calls, 4 keys of 2 calls each would take 0.4s
+    start = time.monotonic()
+    threads = [threading.Thread(target=ensure, args=('key-{}'.format(i),))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert time.monotonic() - start < 0.3
+    assert kms_client.calls['create_crypto_key'] == 5
+    invalidate_kms_cache()
+
+
+def test_envelope_round_trip(kms_client):
+
+    ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring', 'key')
+    dek = generate_key()
+    wrapped = encrypt_dek(kms_client, dek, 'project', 'europe-west2', 'ring',
+                          'key')
+    assert wrapped != dek
+
+    cache = DekCache()
+    for _ in range(3):
+        assert decrypt_dek(kms_client, wrapped, 'project', 'europe-west2',
+                           'ring', 'key', cache=cache) == dek
+    assert kms_client.calls['decrypt'] == 1
+
+
+def test_wrong_key_fails(kms_client):
+
+    ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring', 'key')
+    ensure_kms_key(kms_client, 'project', 'europe-west2', 'ring', 'other')
+    wrapped = encrypt_dek(kms_client, generate_key(), 'project',
+                          'europe-west2', 'ring', 'key')
+
+    with pytest.raises(Exception):
+        decrypt_dek(kms_client, wrapped, 'project', 'europe-west2', 'ring',
+                    'other', cache=None)
@@ -0,0 +1,75 @@
+import ast
+import os
+import subprocess
+import sys
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+
+# Encryption and compression modules only upload and decrypt need
+CIPHERS = ['gcpip.upload.encryption', 'gcpip.upload.gcp_upload',
+           'gcpip.utils.compression',
+           'cryptography.hazmat.primitives.ciphers.aead',
+           'cryptography.hazmat.primitives.kdf.hkdf']
+
+# Modules each runner command imports before it makes its first API call,
+# the modules it must not import, and its cold start budget in ms.
+# google.auth imports cryptography for every command, the commands without
+# encryption must not load gcpip's own ciphers on top. The
+# budgets leave about 50% headroom over the import times on a developer
+# machine, and are below the time gcpip.runner alone took to import when it
+# loaded every client library. Scale them with GCPIP_IMPORT_BUDGET_SCALE on
+# slower machines.
+COMMANDS = {
+    'upload': (['gcpip.runner', 'google.cloud.kms_v1'],
+               ['google.cloud.bigquery', 'google.cloud.dataproc_v1'], 900),
+    'decrypt': (['gcpip.runner', 'google.cloud.kms_v1'],
+                ['google.cloud.bigquery', 'google.cloud.dataproc_v1'], 900),
+    'load': (['gcpip.runner', 'gcpip.load.load'],
+             ['google.cloud.dataproc_v1', 'google.cloud.kms_v1'] + CIPHERS,
+             900),
+    'bq_view': (['gcpip.runner', 'gcpip.bq_view_generator'],
+                ['google.cloud.dataproc_v1', 'google.cloud.kms_v1'] + CIPHERS,
+                900),
+    'fe': (['gcpip.runner', 'gcpip.fe.gap_pyspark',
+            'google.cloud.dataproc_v1'],
+           ['google.cloud.bigquery', 'google.cloud.kms_v1'] + CIPHERS, 1100),
+}
+
+
+def import_cold(modules, forbidden):
+    """
+    Imports modules in a fresh interpreter with -X importtime
+
+    Returns:
+        tuple: import time in ms of modules, and the forbidden modules that
+            were imported
+    """
+
+    code = 'import sys, {}; print([x for x in {!r} if x in sys.modules])' \
+        .format(', '.join(modules), forbidden)
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=env, capture_output=True, text=True,
+                            check=True)
+    # Lines are "import time: self [us] | cumulative | module", nested
+    # imports are indented, so the top level lines hold the total per module
+    elapsed = 0
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].rstrip() in \
+                [' ' + x for x in modules]:
+            elapsed += int(fields[1])
+    return elapsed / 1000, ast.literal_eval(result.stdout)
+
+
+@pytest.mark.parametrize('command', sorted(COMMANDS))
+def test_command_import_time(command):
+
+    modules, forbidden, budget = COMMANDS[command]
+    budget *= float(os.environ.get('GCPIP_IMPORT_BUDGET_SCALE', 1))
+    elapsed, imported = import_cold(modules, forbidden)
+    assert imported == []
+    assert 0 < elapsed < budget, \
+        '{} imports took {:.0f} ms, budget {:.0f} ms'.format(
+            command, elapsed, budget)
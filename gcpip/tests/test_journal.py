@@ -0,0 +1,217 @@
+import os
+import pytest
+from conftest import KMS_KEY
+from gcpip.upload import gcp_upload
+from gcpip.upload.gcp_upload import (
+    upload_file, encrypt_upload_file, decrypt_blob, UPLOADED)
+from gcpip.upload.journal import (
+    UploadJournal, get_fingerprint, IN_PROGRESS, COMPLETE)
+
+CHUNK_SIZE = 256 * 1024
+
+
+@pytest.fixture
+def journal(tmp_path):
+
+    journal = UploadJournal(str(tmp_path / "state"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def source(tmp_path):
+
+    path = tmp_path / "data.csv"
+    path.write_bytes(b'a,b\n1,2\n')
+    return str(path)
+
+
+def test_journal_tracks_session_and_offset(journal, source):
+
+    fingerprint = get_fingerprint(source, encrypted=True)
+    assert journal.get('bucket', 'data.csv', fingerprint) is None
+
+    state = {'nonce_prefix': '00' * 7, 'dek': None, 'metadata': {}}
+    journal.start('bucket', 'data.csv', source, fingerprint,
+                  'https://upload/session', state)
+    journal.set_committed('bucket', 'data.csv', 8 * 1024 * 1024)
+
+    entry = journal.get('bucket', 'data.csv', fingerprint)
+    assert entry['status'] == IN_PROGRESS
+    assert entry['session_url'] == 'https://upload/session'
+    assert entry['committed'] == 8 * 1024 * 1024
+    assert entry['state'] == state
+    assert not journal.is_complete('bucket', 'data.csv', fingerprint)
+
+    journal.complete('bucket', 'data.csv')
+    entry = journal.get('bucket', 'data.csv', fingerprint)
+    assert entry['status'] == COMPLETE
+    assert entry['session_url'] is None
+    assert journal.is_complete('bucket', 'data.csv', fingerprint)
+
+    journal.discard('bucket', 'data.csv')
+    assert journal.get('bucket', 'data.csv', fingerprint) is None
+
+
+def test_journal_persists_across_instances(tmp_path, source):
+
+    state_dir = str(tmp_path / "state")
+    fingerprint = get_fingerprint(source)
+
+    journal = UploadJournal(state_dir)
+    journal.start('bucket', 'data.csv', source, fingerprint, 'url')
+    journal.close()
+
+    journal = UploadJournal(state_dir)
+    assert journal.get('bucket', 'data.csv', fingerprint)['session_url'] \
+        == 'url'
+    journal.close()
+
+
+def test_changed_file_or_options_invalidate_entry(journal, source):
+
+    fingerprint = get_fingerprint(source, compression=None)
+    journal.start('bucket', 'data.csv', source, fingerprint, 'url')
+
+    assert get_fingerprint(source, compression='gzip') != fingerprint
+    assert journal.get('bucket', 'data.csv',
+                       get_fingerprint(source, compression='gzip')) is None
+
+    with open(source, 'ab') as f:
+        f.write(b'3,4\n')
+    os.utime(source, ns=(0, 0))
+    assert journal.get('bucket', 'data.csv',
+                       get_fingerprint(source, compression=None)) is None
+
+
+class InterruptedTransport():
+    """
+    Forwards requests to the fake resumable endpoint and records their
+    Content-Range, then fails like a dropped connection after `limit`
+    requests were answered.
+    """
+
+    def __init__(self, transport, limit=None):
+        self.transport = transport
+        self.limit = limit
+        self.ranges = []
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if self.limit is not None and len(self.ranges) == self.limit:
+            raise ConnectionError('Connection dropped')
+        self.ranges.append(headers['Content-Range'])
+        return self.transport.request(method, url, data=data,
+                                      headers=headers)
+
+
+@pytest.fixture
+def fakes(fakes, monkeypatch):
+
+    monkeypatch.setattr(gcp_upload, 'STREAM_UPLOAD_CHUNK_SIZE', CHUNK_SIZE)
+    fakes.storage.create_bucket('landing')
+    return fakes
+
+
+@pytest.fixture
+def large_source(tmp_path):
+
+    path = tmp_path / "large.csv"
+    path.write_bytes(os.urandom(4 * CHUNK_SIZE + 7))
+    return str(path)
+
+
+def upload(fakes, source, journal, transport, encrypt):
+
+    if encrypt:
+        return encrypt_upload_file(
+            fakes.storage, fakes.kms, 'landing', source, 'in/data.csv',
+            *KMS_KEY, journal=journal, transport=transport)
+    return upload_file(fakes.storage, 'landing', source, 'in/data.csv',
+                       journal=journal, transport=transport)
+
+
+def download(fakes, tmp_path, encrypt):
+
+    if encrypt:
+        decrypt_blob(fakes.storage, fakes.kms, 'landing',
+                     'in/data.csv.encrypted', *KMS_KEY,
+                     temp_data=str(tmp_path / 'temp'), streaming=True)
+    return fakes.storage.bucket('landing').blob(
+        'in/data.csv').download_as_string()
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_upload_resumes_at_committed_offset(fakes, journal, large_source,
+                                            tmp_path, encrypt):
+
+    interrupted = InterruptedTransport(fakes.storage.transport, limit=2)
+    with pytest.raises(ConnectionError):
+        upload(fakes, large_source, journal, interrupted, encrypt)
+    assert interrupted.ranges[0].startswith('bytes 0-')
+    if encrypt:
+        entry = journal.get('landing', 'in/data.csv.encrypted',
+                            get_fingerprint(large_source, encrypted=True,
+                                            compression=None))
+    else:
+        entry = journal.get('landing', 'in/data.csv',
+                            get_fingerprint(large_source, compression=None))
+    assert entry['committed'] == 2 * CHUNK_SIZE
+
+    resumed = InterruptedTransport(fakes.storage.transport)
+    assert upload(fakes, large_source, journal, resumed, encrypt) == UPLOADED
+    assert resumed.ranges[0].startswith('bytes */')
+    assert resumed.ranges[1].startswith(
+        'bytes {}-'.format(2 * CHUNK_SIZE))
+    with open(large_source, 'rb') as f:
+        assert download(fakes, tmp_path, encrypt) == f.read()
+
+
+def test_expired_session_restarts(fakes, journal, large_source, tmp_path):
+
+    fingerprint = get_fingerprint(large_source, compression=None)
+    with pytest.raises(ConnectionError):
+        upload(fakes, large_source, journal, InterruptedTransport(
+            fakes.storage.transport, limit=2), False)
+    fakes.storage.expire_session(
+        journal.get('landing', 'in/data.csv', fingerprint)['session_url'])
+
+    restarted = InterruptedTransport(fakes.storage.transport)
+    assert upload(fakes, large_source, journal, restarted, False) == UPLOADED
+    # The expired session answers 404, a new session starts from byte 0
+    assert restarted.ranges[0] == 'bytes */{}'.format(
+        os.path.getsize(large_source))
+    assert restarted.ranges[1].startswith('bytes 0-')
+    assert journal.is_complete('landing', 'in/data.csv', fingerprint)
+    with open(large_source, 'rb') as f:
+        assert download(fakes, tmp_path, False) == f.read()
+
+
+def test_finished_session_is_not_uploaded_again(fakes, journal, source):
+
+    fingerprint = get_fingerprint(source, compression=None)
+
+    class LostResponse(InterruptedTransport):
+        def request(self, method, url, data=None, headers=None, **kwargs):
+            response = super().request(method, url, data, headers)
+            if response.status_code == 200:
+                raise ConnectionError('Connection dropped')
+            return response
+
+    # The last chunk was committed but its response never arrived
+    with pytest.raises(ConnectionError):
+        upload(fakes, source, journal, LostResponse(
+            fakes.storage.transport), False)
+    assert not journal.is_complete('landing', 'in/data.csv', fingerprint)
+    inserts = fakes.storage.calls['objects.insert']
+
+    recovered = InterruptedTransport(fakes.storage.transport)
+    assert upload(fakes, source, journal, recovered, False) == UPLOADED
+    assert recovered.ranges == ['bytes */{}'.format(os.path.getsize(source))]
+    assert fakes.storage.calls['objects.insert'] == inserts
+    assert journal.is_complete('landing', 'in/data.csv', fingerprint)
+
+
+def test_journaled_upload_needs_transport(fakes, journal, source):
+
+    with pytest.raises(ValueError):
+        upload(fakes, source, journal, None, False)
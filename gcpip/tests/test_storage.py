@@ -0,0 +1,269 @@
+import base64
+import os
+from types import SimpleNamespace
+import pytest
+from google.api_core.exceptions import Forbidden, NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.resumable_media import DataCorruption
+from google.cloud import storage
+from gcpip.utils.storage import (
+    ApiCallCounter, get_bucket_handle, get_bucket_metadata,
+    invalidate_bucket_cache, api_calls, delete_blobs, patch_blobs_metadata,
+    blobs_exist, download_blob_sliced, get_blob_generation, blob_exists,
+    invalidate_object_cache, delete_blob, download_gcs_file)
+from gcpip.utils.checksums import google_crc32c
+from gcpip.testing.storage import FakeStorageClient, FakeBlob
+from gcpip.upload.gcp_upload import upload_file
+
+
+class CountingClient():
+
+    project = 'test-project'
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_bucket(self, bucket_name):
+        self.calls += 1
+        return SimpleNamespace(name=bucket_name, location='EUROPE-WEST2')
+
+
+def test_bucket_handle_makes_no_request():
+
+    # Anonymous credentials: any request would fail without network access
+    client = storage.Client(project='test-project',
+                            credentials=AnonymousCredentials())
+    api_calls.reset()
+
+    bucket = get_bucket_handle(client, 'landing')
+    assert bucket.name == 'landing'
+    assert bucket.blob('a/b.csv').path == '/b/landing/o/a%2Fb.csv'
+    # Only the operations that used to load the bucket count a saved call
+    assert api_calls.snapshot() == {'made': {}, 'saved': {}}
+
+
+def test_bucket_metadata_is_cached():
+
+    client = CountingClient()
+    invalidate_bucket_cache()
+    api_calls.reset()
+
+    bucket = get_bucket_metadata(client, 'landing')
+    assert get_bucket_metadata(client, 'landing') is bucket
+    assert client.calls == 1
+    assert bucket.location == 'EUROPE-WEST2'
+
+    # Expired and invalidated entries are loaded again
+    get_bucket_metadata(client, 'other', ttl=0)
+    get_bucket_metadata(client, 'other')
+    invalidate_bucket_cache('landing')
+    get_bucket_metadata(client, 'landing')
+    assert client.calls == 4
+    assert api_calls.snapshot() == {'made': {'buckets.get': 4},
+                                    'saved': {'buckets.get': 1}}
+    invalidate_bucket_cache()
+
+
+def test_blob_lookup_does_not_list_the_bucket(tmp_path):
+
+    client = FakeStorageClient(str(tmp_path))
+    bucket = client.create_bucket('landing')
+    for i in range(50):
+        bucket.blob('data/{}.csv'.format(i)).upload_from_string('a')
+    bucket.blob('submissions/load.yaml').upload_from_string('b')
+    client.calls.clear()
+    invalidate_object_cache()
+
+    generation = bucket.get_blob('submissions/load.yaml').generation
+    assert get_blob_generation(client, 'landing',
+                               'submissions/load.yaml') == generation
+    assert not blob_exists(client, 'landing', 'submissions/missing.yaml')
+    assert client.calls['objects.list'] == 0
+
+    # Cached lookups, hits and misses, until the object is deleted
+    client.calls.clear()
+    assert blob_exists(client, 'landing', 'submissions/load.yaml', ttl=60)
+    assert not blob_exists(client, 'landing', 'missing.yaml', ttl=60)
+    assert blob_exists(client, 'landing', 'submissions/load.yaml', ttl=60)
+    assert not blob_exists(client, 'landing', 'missing.yaml', ttl=60)
+    assert client.calls['objects.get'] == 2
+    # A lookup without ttl never answers from the cache
+    assert blob_exists(client, 'landing', 'submissions/load.yaml')
+    assert client.calls['objects.get'] == 3
+    delete_blob(client, 'landing', 'submissions/load.yaml')
+    assert not blob_exists(client, 'landing', 'submissions/load.yaml',
+                           ttl=60)
+    invalidate_object_cache()
+
+
+def test_uploads_invalidate_cached_lookups(tmp_path):
+
+    client = FakeStorageClient(str(tmp_path / 'gcs'))
+    client.create_bucket('landing')
+    source = tmp_path / 'data.csv'
+    source.write_bytes(b'a,b\n1,2\n')
+    invalidate_object_cache()
+
+    assert not blob_exists(client, 'landing', 'in/data.csv', ttl=60)
+    upload_file(client, 'landing', str(source), 'in/data.csv')
+    assert blob_exists(client, 'landing', 'in/data.csv', ttl=60)
+    generation = get_blob_generation(client, 'landing', 'in/data.csv',
+                                     ttl=60)
+    upload_file(client, 'landing', str(source), 'in/data.csv',
+                compression='gzip')
+    assert get_blob_generation(client, 'landing', 'in/data.csv',
+                               ttl=60) != generation
+    invalidate_object_cache()
+
+
+def test_api_call_counter_summary():
+
+    counter = ApiCallCounter()
+    assert counter.summary() == 'none'
+    counter.record('objects.get')
+    counter.record('buckets.get', saved=True)
+    counter.record('buckets.get', saved=True)
+    assert counter.summary() == 'buckets.get: 2 saved'
+    assert counter.snapshot()['made'] == {'objects.get': 1}
+
+
+@pytest.fixture
+def batch_client(tmp_path, monkeypatch):
+    """
+    Fake client answering batches through the storage library. Blobs named
+    denied* fail gets and patches with 403.
+    """
+    def deny(method):
+        def call(blob, *args, **kwargs):
+            if blob.name.startswith('denied'):
+                raise Forbidden('Forbidden')
+            return method(blob, *args, **kwargs)
+        return call
+
+    for name in ('reload', 'patch'):
+        monkeypatch.setattr(FakeBlob, name, deny(getattr(FakeBlob, name)))
+    client = FakeStorageClient(str(tmp_path))
+    bucket = client.create_bucket('landing')
+    for name in ['a.csv', 'denied.csv'] + [
+            'data/{}.csv'.format(i) for i in range(250)]:
+        bucket.blob(name).upload_from_string('a')
+    client.calls.clear()
+    return client
+
+
+def test_delete_blobs_in_batches(batch_client):
+
+    names = ['data/{}.csv'.format(i) for i in range(250)] + ['missing.dek']
+    results = delete_blobs(batch_client, 'landing', names)
+
+    assert batch_client.calls['batch'] == 3
+    assert batch_client.calls['objects.delete'] == 251
+    assert [x['blob'] for x in results] == names
+    assert all(x['error'] is None for x in results[:-1])
+    assert isinstance(results[-1]['error'], NotFound)
+    assert [x.name for x in batch_client.bucket('landing').list_blobs()] == [
+        'a.csv', 'denied.csv']
+
+    results = delete_blobs(batch_client, 'landing', ['missing.dek'],
+                           ignore_missing=True)
+    assert results[0]['error'] is None
+
+
+def test_patch_and_exists_report_errors_per_blob(batch_client):
+
+    results = patch_blobs_metadata(batch_client, 'landing', {
+        'a.csv': {'k': 'v'}, 'denied.csv': {'k': 'v'}})
+    assert results[0]['error'] is None
+    assert isinstance(results[1]['error'], Forbidden)
+    assert batch_client.calls['batch'] == 1
+    assert batch_client.bucket('landing').get_blob('a.csv').metadata == {
+        'k': 'v'}
+
+    results = blobs_exist(batch_client, 'landing',
+                          ['a.csv', 'missing.csv', 'denied.csv'])
+    assert [x['exists'] for x in results] == [True, False, None]
+    assert isinstance(results[2]['error'], Forbidden)
+
+
+class SlicedBlob():
+    """
+    Loaded blob serving ranged downloads from memory in small writes
+    """
+
+    def __init__(self, data, crc32c=None):
+        self.name = 'landing/big.encrypted'
+        self.generation = 7
+        self.size = len(data)
+        self.data = data
+        self.md5_hash = None
+        self.crc32c = crc32c
+        self.ranges = []
+        self.bucket = SimpleNamespace(blob=self.get_part)
+
+    def get_part(self, name, generation=None):
+        assert name == self.name and generation == self.generation
+        return SimpleNamespace(download_to_file=self.download_to_file)
+
+    def download_to_file(self, file_obj, start, end, raw_download, checksum):
+        self.ranges.append((start, end))
+        for offset in range(start, end + 1, 1000):
+            file_obj.write(self.data[offset:min(offset + 1000, end + 1)])
+
+
+def get_crc32c(data):
+
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+
+
+@pytest.mark.skipif(google_crc32c is None,
+                    reason='google-crc32c is not installed')
+def test_sliced_download(tmp_path):
+
+    data = os.urandom(100 * 1024 + 17)
+    blob = SlicedBlob(data, crc32c=get_crc32c(data))
+    path = str(tmp_path / 'big')
+
+    download_blob_sliced(blob, path, workers=4, slice_size=16 * 1024)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert sorted(blob.ranges)[0] == (0, 16 * 1024 - 1)
+    assert sorted(blob.ranges)[-1] == (96 * 1024, len(data) - 1)
+    assert len(blob.ranges) == 7
+
+
+@pytest.mark.skipif(google_crc32c is None,
+                    reason='google-crc32c is not installed')
+def test_sliced_download_detects_corruption(tmp_path):
+
+    data = os.urandom(50 * 1024)
+    blob = SlicedBlob(data, crc32c=get_crc32c(b'other' + data[5:]))
+    path = str(tmp_path / 'big')
+
+    with pytest.raises(DataCorruption):
+        download_blob_sliced(blob, path, workers=2, slice_size=8 * 1024)
+    assert not os.path.exists(path)
+
+
+def test_download_lookup_is_skipped_when_size_is_known(tmp_path):
+
+    client = FakeStorageClient(str(tmp_path / 'gcs'))
+    bucket = client.create_bucket('landing')
+    data = os.urandom(40 * 1024)
+    bucket.blob('data.bin').upload_from_string(data)
+    path = str(tmp_path / 'data.bin')
+    api_calls.reset()
+
+    download_gcs_file(client, 'landing', 'data.bin', path)
+    download_gcs_file(client, 'landing', 'data.bin', path, size=len(data))
+    blob = bucket.get_blob('data.bin')
+    download_gcs_file(client, 'landing', 'data.bin', path, blob=blob,
+                      sliced_threshold=16 * 1024)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert client.calls['objects.get'] == 2
+    if hasattr(os, 'pwrite'):
+        assert api_calls.snapshot()['made'] == {'objects.get': 1}
+        assert api_calls.snapshot()['saved'] == {'objects.get': 2,
+                                                 'buckets.get': 3}
+        with pytest.raises(FileNotFoundError):
+            download_gcs_file(client, 'landing', 'missing.bin', path)
@@ -0,0 +1,155 @@
+import threading
+import time
+import pytest
+from gcpip import runner
+from gcpip.config.config_reader import SubmissionConfig
+from gcpip.submission import (
+    get_submission_steps, run_submission_steps, format_report)
+
+LOAD_CONFIG = '''
+project_id: fake-project
+sources:
+  source1:
+    bucket_id: landing
+    file_path: data/{table}.csv
+    skip_leading_rows: 1
+destination:
+  schema:
+    field1: {{name: name, type: STRING, mode: required}}
+    field2: {{name: amount, type: INTEGER, mode: nullable}}
+  dataset: landing_data
+  table: {table}
+'''
+
+VIEW_CONFIG = '''
+views:
+  view1:
+    view_name: {table}_view
+    project_id_des: fake-project
+    dataset_des: views
+    cols:
+      col1:
+        name_des: customer
+        name_src: name
+        project_id_src: fake-project
+        dataset_src: landing_data
+        table_src: {table}
+        condition:
+'''
+
+FE_CONFIG = '''
+project_id: fake-project
+source_dataset: views
+source_table: sales_view
+destination_dataset: features
+destination_table: sales_features
+staging_bucket: landing
+'''
+
+SUBMISSION_CONFIG = '''
+submissions:
+  load_sales: {metadata_file: landing/meta/load_sales.yaml, action: load}
+  load_costs: {metadata_file: landing/meta/load_costs.yaml, action: load}
+  view_sales: {metadata_file: landing/meta/view_sales.yaml, action: view}
+  view_costs: {metadata_file: landing/meta/view_costs.yaml, action: view}
+  fe_sales:
+    metadata_file: landing/meta/fe_sales.yaml
+    action: feature_engineering
+'''
+
+
+@pytest.fixture
+def fakes(fakes):
+
+    bucket = fakes.storage.create_bucket('landing')
+    fakes.bigquery.create_dataset(fakes.bigquery.dataset('landing_data'))
+    fakes.bigquery.create_dataset(fakes.bigquery.dataset('views'))
+    for table in ('sales', 'costs'):
+        bucket.blob('data/{}.csv'.format(table)).upload_from_string(
+            'name,amount\nann,10\nbob,20\n')
+        bucket.blob('meta/load_{}.yaml'.format(table)).upload_from_string(
+            LOAD_CONFIG.format(table=table))
+        bucket.blob('meta/view_{}.yaml'.format(table)).upload_from_string(
+            VIEW_CONFIG.format(table=table))
+    bucket.blob('meta/fe_sales.yaml').upload_from_string(FE_CONFIG)
+    bucket.blob('submissions/all.yaml').upload_from_string(SUBMISSION_CONFIG)
+    return fakes
+
+
+def test_submission_steps_run_as_graph(fakes):
+
+    steps = get_submission_steps(
+        fakes.storage, SubmissionConfig(SUBMISSION_CONFIG.encode()))
+    assert {x: steps[x]['depends_on'] for x in steps} == {
+        'load_sales': [], 'load_costs': [], 'view_sales': ['load_sales'],
+        'view_costs': ['load_costs'], 'fe_sales': ['view_sales']}
+
+    events = []
+    lock = threading.Lock()
+
+    def run_step(step):
+        with lock:
+            events.append(('start', step['name']))
+        time.sleep(0.05)
+        if step['name'] == 'view_sales':
+            raise RuntimeError('view failed')
+        with lock:
+            events.append(('end', step['name']))
+
+    results = run_submission_steps(steps, run_step, workers=2)
+    statuses = {x['name']: x['status'] for x in results}
+    assert statuses == {'load_sales': 'succeeded', 'load_costs': 'succeeded',
+                        'view_sales': 'failed', 'view_costs': 'succeeded',
+                        'fe_sales': 'skipped'}
+    # Both loads run at once, each view only after its own load
+    assert set(events[:2]) == {('start', 'load_sales'),
+                               ('start', 'load_costs')}
+    assert events.index(('end', 'load_costs')) < \
+        events.index(('start', 'view_costs'))
+    assert str(results[2]['error']) == 'view failed'
+    report = format_report(results)
+    assert '5 steps' in report and '3 succeeded, 1 failed, 1 skipped' in report
+
+
+def test_submission_dependency_cycle(fakes):
+
+    steps = get_submission_steps(fakes.storage, SubmissionConfig(b'''
+submissions:
+  a: {metadata_file: landing/meta/load_sales.yaml, action: load,
+      depends_on: [b]}
+  b: {metadata_file: landing/meta/load_costs.yaml, action: load,
+      depends_on: [a]}
+'''))
+    with pytest.raises(ValueError):
+        run_submission_steps(steps, lambda step: None)
+
+
+def test_runner_run_submission_offline(fakes, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    fakes.storage.bucket('landing').blob(
+        'submissions/all.yaml').upload_from_string(
+            SUBMISSION_CONFIG.split('  fe_sales')[0])
+    runner.main(['run-submission', '-b', 'landing', '-s',
+                 'submissions/all.yaml', '-w', '3'])
+    assert fakes.bigquery.get_table('landing_data.sales').num_rows == 2
+    assert fakes.bigquery.get_table('landing_data.costs').num_rows == 2
+    assert fakes.bigquery.get_table('views.sales_view').view_query == \
+        'SELECT name as customer FROM `fake-project.landing_data.sales`'
+
+    # Feature engineering steps need the Dataproc arguments, checked before
+    # the loads and views of the submission run
+    fakes.storage.bucket('landing').blob(
+        'submissions/fe.yaml').upload_from_string(SUBMISSION_CONFIG)
+    results = []
+
+    def run_steps(steps, run_step, workers):
+        results.extend(run_submission_steps(steps, run_step, workers))
+        return results
+
+    monkeypatch.setattr(runner, 'run_submission_steps', run_steps)
+    with pytest.raises(ValueError, match='need the cluster name, pyspark '
+                                         'file and other python files'):
+        runner.main(['run-submission', '-b', 'landing', '-s',
+                     'submissions/fe.yaml'])
+    assert results == []